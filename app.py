@@ -1,11 +1,22 @@
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 import pandas as pd
-import numpy as np
-import re
-import io
-import itertools
-from xlsxwriter import Workbook
-from Levenshtein import ratio
+
+from reconciliation import delta, engine, parallel, profiling
+from reconciliation.catalog_cache import CatalogCache
+from reconciliation.identifiers import IDENTIFIER_KEYS, keys_named
+from reconciliation.journal import DecisionJournal
+from reconciliation.review import PendingDecisions
+from reconciliation.rules import RULES, AutoRules, resolve_clusters, resolve_cross_matches, resolve_duplicates
+from reconciliation.similarity_cache import SimilarityCache
+from reconciliation.table_view import PAGE_SIZES, Query, TableView, page_count
 
 # ✅ Initialize all session state variables before accessing them
 if "step" not in st.session_state:
@@ -29,20 +40,277 @@ if "qb_fuzzy_duplicates" not in st.session_state:
 if "dt_fuzzy_duplicates" not in st.session_state:
     st.session_state["dt_fuzzy_duplicates"] = []
 
-if "exact_matches" not in st.session_state:
-    st.session_state["exact_matches"] = pd.DataFrame()
-
 if "fuzzy_queue" not in st.session_state:
     st.session_state["fuzzy_queue"] = []
 
+if "journal" not in st.session_state:
+    st.session_state["journal"] = DecisionJournal()
+
+if "delta_plan" not in st.session_state:
+    st.session_state["delta_plan"] = None
+
+# Bumped whenever the cleaned data or the step 2 merges are replaced; keys the step 2 caches
+if "data_version" not in st.session_state:
+    st.session_state["data_version"] = 0
+
+# ⏱️ One span per rerun, the pipeline stages nested inside (see the sidebar panel)
+if "profiler" not in st.session_state:
+    st.session_state["profiler"] = profiling.Profiler()
+profiler = st.session_state["profiler"]
+profiler.track_memory(st.session_state.get("profile_memory", False))
+profiler.begin_rerun()
+
 
 # ------------------------- UTILITIES -------------------------
-def normalize_sku(sku):
-    """Normalize SKU by removing spaces, converting to uppercase, and standardizing format."""
-    sku = sku.upper().strip()
-    sku = re.sub(r'(?<!\d)[.]', '', sku)  # Remove dots except when followed by a digit
-    sku = re.sub(r'\s+', '', sku)  # Remove extra spaces
-    return sku
+@st.cache_resource
+def get_similarity_cache():
+    """One on-disk similarity store shared by every session."""
+    return SimilarityCache()
+
+@st.cache_resource
+def get_catalog_cache():
+    """Prepared inventories shared by every session, by file content (see `catalog_cache`)."""
+    return CatalogCache()
+
+def full_inventory(file, file_hash):
+    """Every column of an uploaded inventory (read-only), parsed once for every session uploading it."""
+    if file is None:
+        return None
+    return get_catalog_cache().get(("full", file_hash), lambda: engine.load_inventory(file))
+
+def identifier_columns(qb_file, dt_file):
+    """Identifier columns of both uploads (read-only, see `engine.load_identifiers`), shared by every session."""
+    key = ("identifiers", st.session_state["qb_file_hash"], st.session_state["dt_file_hash"])
+    return get_catalog_cache().get(key, lambda: engine.load_identifiers(qb_file, dt_file))
+
+def data_changed():
+    """Invalidate what step 2 derived from the cleaned data."""
+    st.session_state["data_version"] += 1
+
+def finish_review(source):
+    """Apply the step 1 decisions logged for `source` to its cleaned frame, once."""
+    pending = st.session_state.pop(f"{source}_pending", None)
+    if pending is not None:
+        st.session_state[f"{source}_cleaned_data"] = pending.apply()
+        data_changed()
+
+@st.cache_data(max_entries=6, show_spinner="📦 Préparation du fichier...")
+def export_file(fingerprint, export_format, _final_output):
+    """Export bytes, memoized on the key the final inventory was built for."""
+    return engine.export_bytes(_final_output, export_format)
+
+def show_dataframe(df):
+    """`st.dataframe`, timed: serializing the table is part of the rerun's cost."""
+    with profiling.span("render", rows_in=len(df)):
+        st.dataframe(df)
+
+def show_table(df, key, columns=None):
+    """One page of `df`, filtered and sorted on the server: only that page is sent to the browser."""
+    filter_col, sort_col, order_col, size_col = st.columns([3, 2, 1, 1])
+    text = filter_col.text_input("🔎 Filtrer", key=f"{key}_filter")
+    sort_by = sort_col.selectbox("Trier par", ["—", *df.columns], key=f"{key}_sort")
+    ascending = order_col.checkbox("Croissant", value=True, key=f"{key}_ascending")
+    page_size = size_col.selectbox("Lignes", PAGE_SIZES, key=f"{key}_page_size")
+    shown = st.multiselect(
+        "Colonnes", list(df.columns), default=[col for col in columns or df.columns if col in df.columns], key=f"{key}_columns"
+    )
+
+    view = st.session_state.setdefault(f"{key}_view", TableView())
+    query = Query(text.strip(), None if sort_by == "—" else sort_by, ascending)
+    rows = len(view.rows(df, query))
+    pages = page_count(rows, page_size)
+    if st.session_state.get(f"{key}_page", 1) > pages:  # Fewer rows since the last rerun
+        st.session_state[f"{key}_page"] = 1
+    number = st.number_input("Page", min_value=1, max_value=pages, key=f"{key}_page")
+
+    with profiling.span("render", rows_in=min(page_size, rows)):
+        st.dataframe(view.page(df, query, number, page_size, shown or None))
+    start = (number - 1) * page_size
+    st.caption(f"Lignes {min(start + 1, rows)}–{min(start + page_size, rows)} sur {rows} (page {number}/{pages})")
+
+def profiling_panel(profiler):
+    """Collapsible sidebar panel: the last run's stages, totals per stage, trace downloads."""
+    with st.sidebar.expander("⏱️ Profilage"):
+        st.checkbox(
+            "Mesurer la mémoire (tracemalloc, plus lent)", key="profile_memory",
+            help="Ralentit toutes les sessions du serveur tant qu'une d'elles mesure."
+        )
+        if st.session_state.get("profile_memory") and not profiler.records_memory:
+            st.caption("Une autre session mesure déjà la mémoire : les pics de celle-ci ne sont pas enregistrés.")
+        # A click usually runs twice (the action, then st.rerun()): the heavy run is often the previous one
+        runs = {span["rerun"]: span for span in profiler.spans if span["category"] == "rerun"}
+        if runs:
+            rerun = st.selectbox(
+                "Exécution", sorted(runs, reverse=True)[:20],
+                format_func=lambda rerun: f"{rerun} — {runs[rerun]['wall'] * 1000:.0f} ms"
+                + (" (interrompue)" if runs[rerun].get("interrupted") else ""),
+            )
+            spans = profiler.frame(rerun=rerun)
+            spans["name"] = spans["depth"].map(lambda depth: "· " * depth) + spans["name"]
+            st.dataframe(spans.drop(columns=["depth", "category", "rerun", "interrupted"], errors="ignore"), hide_index=True)
+        summary = profiler.summary()
+        if not summary.empty:
+            st.caption("Session, par étape")
+            st.dataframe(summary)
+        if st.checkbox("Mémoire de la session", key="session_memory"):
+            catalog = get_catalog_cache()
+            # What the catalog cache holds is counted once for the server, not per session
+            st.dataframe(profiling.memory_report({key: st.session_state[key] for key in st.session_state}, catalog.values()))
+            stats = catalog.stats()
+            st.caption(
+                f"Catalogues partagés : {stats['entries']} entrées, {stats['mib']} / {stats['max_mib']} MiB, "
+                f"{stats['hits']} réutilisations, {stats['misses']} préparations"
+            )
+        if st.checkbox("Préparer l'export du profil", key="profile_export"):
+            st.download_button(
+                "📥 Profil (JSON)", profiler.to_json().encode("utf-8"),
+                file_name="profil.json", mime="application/json"
+            )
+            st.download_button(
+                "📥 Trace Chrome / Perfetto", profiler.to_chrome_trace().encode("utf-8"),
+                file_name="profil_trace.json", mime="application/json"
+            )
+
+SOURCE_LABELS = {"qb": "📘 QuickBooks", "dt": "📗 D-Tools", "cross": "🔀 QuickBooks ↔ D-Tools"}
+STAGE_LABELS = {"load": "lecture", "duplicates": "doublons", "scoring": "comparaison des SKU"}
+
+def cancel_loading():
+    st.session_state["loading_cancelled"] = True
+
+def progress_text(source, job):
+    text = f"{SOURCE_LABELS[source]} — {STAGE_LABELS.get(job.stage, 'démarrage')}"
+    if job.total:
+        text += f" : {job.done:,}/{job.total:,} SKU, {job.scored:,} paires comparées"
+        eta = job.eta()
+        if eta is not None:
+            text += f", ~{eta:.0f} s restantes"
+    return text
+
+def prepare_sources(sources):
+    """`engine.prepare_source` for every source at once, with a progress bar each and a cancel button.
+
+    Each source runs on its own thread. A click on the button reruns the
+    script, which interrupts the wait below: the workers are told to stop and
+    the app goes back to step 0.
+    """
+    cancel = threading.Event()
+    jobs = {source: parallel.Job(cancel=cancel) for source in sources}
+    st.button("⛔ Annuler le chargement", on_click=cancel_loading)
+    bars = {source: st.progress(0.0, text=progress_text(source, job)) for source, job in jobs.items()}
+    catalog = get_catalog_cache()
+    hashes = {source: st.session_state[f"{source}_file_hash"] for source in sources}
+    with ThreadPoolExecutor(len(sources)) as pool:
+        # A file another session already prepared comes straight from the catalog cache
+        futures = {
+            source: pool.submit(
+                contextvars.copy_context().run, catalog.get, ("prepared", hashes[source], tuple(columns)),
+                functools.partial(engine.prepare_source, file, columns, jobs[source]),
+            )
+            for source, (file, columns) in sources.items()
+        }
+        finished = False
+        try:
+            while not all(future.done() for future in futures.values()):
+                for source, bar in bars.items():
+                    bar.progress(jobs[source].fraction, text=progress_text(source, jobs[source]))
+                time.sleep(0.2)
+            finished = True
+        finally:
+            if not finished:
+                cancel.set()
+                st.session_state["step"] = 0
+    for bar in bars.values():
+        bar.empty()
+    return {source: future.result() for source, future in futures.items()}
+
+def stop_producer():
+    """Cancel the background matching of the previous files, if still running."""
+    producer = st.session_state.pop("producer", None)
+    if producer is not None:
+        producer.cancel.set()
+
+def start_producer(df_qb, df_dt, threshold):
+    """Fuzzy matching in the background while the exact duplicates are reviewed.
+
+    The QuickBooks clusters, the D-Tools clusters and the step 2 scores of the
+    SKUs mismatched so far run side by side, the cores shared between them.
+    The step 2 scores go to the similarity cache: the step 2 queue then only
+    scores the SKUs renamed in step 1.
+    """
+    stop_producer()
+    similarity_cache, catalog = get_similarity_cache(), get_catalog_cache()
+    qb_hash, dt_hash = st.session_state["qb_file_hash"], st.session_state["dt_file_hash"]
+    _, mismatched_qb, mismatched_dt = engine.split_matches(df_qb, df_dt)
+
+    def clusters(df, file_hash, job):
+        return catalog.get(
+            ("clusters", file_hash, threshold),
+            lambda: engine.fuzzy_duplicates(df, threshold, similarity_cache, f"self:{file_hash}", job),
+        )
+
+    st.session_state["producer"] = parallel.Producer({
+        "qb": lambda job: clusters(df_qb, qb_hash, job),
+        "dt": lambda job: clusters(df_dt, dt_hash, job),
+        "cross": lambda job: engine.cross_matches(
+            mismatched_qb, mismatched_dt, threshold, similarity_cache, f"cross:{qb_hash}:{dt_hash}", job
+        ),
+    }, workers=os.cpu_count())
+
+def cancel_producer():
+    """Stop the background matching: what it has not finished is skipped (step 2 scores its own queue)."""
+    producer = st.session_state.get("producer")
+    if producer is not None:
+        producer.cancel.set()
+        st.session_state["producer_cancelled"] = True
+
+def collect_fuzzy(name, rules=None):
+    """Take the producer's result for `name` once it is ready. Returns whether it is (no producer: ready).
+
+    Near-duplicate clusters the `rules` settle never reach the review queue.
+    Once the producer is cancelled, a task it had not finished counts as ready.
+    """
+    producer = st.session_state.get("producer")
+    if producer is None:
+        return True
+    result = producer.take(name)
+    if result is not None and name in ("qb", "dt"):
+        clusters = list(result)  # Shared with other sessions: popped from a copy
+        pending = st.session_state.get(f"{name}_pending")
+        if rules is not None and pending is not None:
+            clusters = resolve_clusters(
+                pending, name, clusters, rules, st.session_state["auto_resolved"], st.session_state["journal"]
+            )
+        st.session_state[f"{name}_fuzzy_duplicates"] = clusters
+    return not producer.pending(name) or producer.cancel.is_set()
+
+AUTO_RULE_LABELS = {
+    "merge_duplicates": "doublons exacts fusionnés",
+    "merge_variants": "groupes de variantes fusionnés",
+    "accept_similarity": "correspondances acceptées",
+    "ignore_discontinued": "correspondances ignorées (articles discontinués)",
+}
+
+def show_auto_resolved():
+    """What the automatic rules settled so far, if anything."""
+    resolved = st.session_state.get("auto_resolved")
+    if resolved:
+        st.info("🤖 Résolus automatiquement : " + " · ".join(
+            f"{resolved[rule]} {AUTO_RULE_LABELS[rule]}" for rule in RULES if resolved[rule]
+        ))
+
+def wait_for_producer(name):
+    """Progress of a background task the review is waiting on; reruns until it is done."""
+    job = st.session_state["producer"].jobs[name]
+    st.progress(job.fraction, text=f"⏳ Recherche des correspondances approximatives — {progress_text(name, job)}")
+    st.button("⛔ Arrêter la recherche", key=f"cancel_producer_{name}", on_click=cancel_producer)
+    time.sleep(1)
+    st.rerun()
+
+EXPORT_LABELS = {"xlsx": "Excel", "csv": "CSV", "parquet": "Parquet"}
+
+# Radio labels -> action names stored in the decision journal
+DUPLICATE_ACTIONS = {"✅ Garder": "keep", "🟡 Fusionner (somme quantités)": "merge", "🔴 Supprimer": "delete"}
+CROSS_MATCH_ACTIONS = {"✅ Garder les deux": "keep", "🟡 Fusionner": "merge", "🔴 Ignorer": "ignore"}
 
 st.set_page_config(layout="wide")
 
@@ -52,6 +320,10 @@ st.title("📦 Outil de Réconciliation des Stocks")
 st.sidebar.header("Étape 1: Importer les fichiers")
 qb_file = st.sidebar.file_uploader("📘 Inventaire QuickBooks", type=["csv", "xlsx"])
 dt_file = st.sidebar.file_uploader("📗 Inventaire D-Tools", type=["csv", "xlsx"])
+journal_file = st.sidebar.file_uploader(
+    "🗂️ Journal des décisions précédent (optionnel)", type=["json"],
+    help="Mode incrémental : réapplique les décisions précédentes, seuls les changements sont à revoir."
+)
 
 # ------------------------- FUZZINESS SLIDER -------------------------
 st.sidebar.header("🎚️ Réglage du Niveau de Correspondance")
@@ -63,6 +335,49 @@ fuzziness_threshold = st.sidebar.slider(
 
 st.sidebar.write(f"🔍 **Niveau de correspondance sélectionné** : {fuzziness_threshold:.2f}")
 
+# Step 2 candidates per SKU: every pair, or only the k best of both SKUs (1 = mutual best match)
+candidates_per_sku = st.sidebar.number_input(
+    "🎯 Candidats par SKU à l'étape 2 (0 = tous) :",
+    min_value=0, max_value=10, value=0, step=1,
+    help="1 = meilleure correspondance mutuelle uniquement : au plus une proposition par SKU."
+)
+top_k = candidates_per_sku or None
+
+# ------------------------- AUTOMATIC RESOLUTION -------------------------
+st.sidebar.header("🤖 Résolution automatique")
+auto_merge_duplicates = st.sidebar.checkbox(
+    "Fusionner les doublons exacts (somme des quantités)", help="Appliqué au lancement du nettoyage."
+)
+auto_merge_variants = st.sidebar.checkbox(
+    "Fusionner les variantes de SKU (séparateurs, zéros, préfixe de marque)",
+    help=(
+        "Groupes approximatifs dont tous les SKU ont la même signature et la même marque, "
+        "p. ex. ABC-100 / ABC100 / ABC-0100. Sans colonne de marque (QuickBooks), les groupes restent à valider."
+    ),
+)
+auto_accept = st.sidebar.checkbox("Accepter les correspondances sûres à l'étape 2")
+auto_accept_similarity = st.sidebar.slider(
+    "Similitude minimale :", min_value=0.80, max_value=1.0, step=0.01, value=0.99, disabled=not auto_accept,
+    help="Seulement si aucun des deux SKU n'a d'autre candidat."
+)
+auto_same_brand = st.sidebar.checkbox("… et si la marque correspond", value=True, disabled=not auto_accept)
+auto_ignore_discontinued = st.sidebar.checkbox("Ignorer les articles D-Tools discontinués à l'étape 2")
+auto_rules = AutoRules(
+    merge_duplicates=auto_merge_duplicates,
+    merge_variants=auto_merge_variants,
+    accept_similarity=auto_accept_similarity if auto_accept else None,
+    same_brand=auto_same_brand,
+    ignore_discontinued=auto_ignore_discontinued,
+)
+
+# Secondary identifiers paired before the fuzzy matching, in the order selected (first = highest priority)
+identifier_names = st.sidebar.multiselect(
+    "🔗 Identifiants communs (par priorité) :", [key.name for key in IDENTIFIER_KEYS],
+    default=[key.name for key in IDENTIFIER_KEYS],
+    help="Les SKU qui partagent un numéro de pièce, un code UPC/EAN ou l'UGS QuickBooks sont appariés sans révision."
+)
+identifier_keys = keys_named(identifier_names)
+
 # ------------------------- START PROCESS BUTTON -------------------------
 
 start_process = st.sidebar.button("🚀 Lancer le Nettoyage des Données")
@@ -71,50 +386,112 @@ if start_process:
     st.session_state["step"] = 1
 step = st.session_state["step"]
 
-if start_process and qb_file and dt_file:
-    with st.spinner("📊 Chargement des données en cours..."):
-        # Load Data (Ensure SKU is string)
-        df_qb = pd.read_csv(qb_file, sep=";", dtype=str) if qb_file.name.endswith('.csv') else pd.read_excel(qb_file, dtype=str)
-        df_dt = pd.read_csv(dt_file, sep=";", dtype=str) if dt_file.name.endswith('.csv') else pd.read_excel(dt_file, dtype=str)
+if st.session_state.pop("loading_cancelled", False):
+    st.warning("⛔ Chargement annulé.")
+if st.session_state.pop("producer_cancelled", False):
+    st.warning("⛔ Recherche approximative arrêtée : les quasi-doublons non trouvés ne seront pas proposés.")
 
-        # Normalize SKUs
-        df_qb["SKU_NORM"] = df_qb["SKU"].astype(str).str.strip().str.upper().apply(normalize_sku)
-        df_dt["SKU_NORM"] = df_dt["SKU"].astype(str).str.strip().str.upper().apply(normalize_sku)
-
-        # Initialize Session State Properly
-        
-        st.session_state["qb_duplicate_queue"] = df_qb["SKU_NORM"][df_qb.duplicated("SKU_NORM", keep=False)].unique().tolist()
-        st.session_state["qb_cleaned_data"] = df_qb.copy()
-
-       
-        st.session_state["dt_duplicate_queue"] = df_dt["SKU_NORM"][df_dt.duplicated("SKU_NORM", keep=False)].unique().tolist()
-        st.session_state["dt_cleaned_data"] = df_dt.copy()
+if start_process and qb_file and dt_file:
+    # Content hashes key the similarity cache (same file = no rescoring)
+    st.session_state["qb_file_hash"] = engine.source_hash(qb_file)
+    st.session_state["dt_file_hash"] = engine.source_hash(dt_file)
+
+    try:
+        previous_journal = DecisionJournal.from_json(journal_file.getvalue()) if journal_file else None
+    except ValueError as e:
+        st.error(f"⚠️ Journal des décisions illisible : {e}")
+        st.session_state["step"] = 0
+        st.stop()
+
+    if previous_journal is not None and previous_journal.threshold != fuzziness_threshold:
+        st.error(f"⚠️ Le journal précédent a été créé avec un niveau de correspondance de {previous_journal.threshold:.2f}. Réglez le curseur sur cette valeur pour le mode incrémental.")
+        st.session_state["step"] = 0
+        st.stop()
+
+    # **⚡ Both files side by side: load, normalize SKUs, exact duplicates**
+    # (the fuzzy matching runs in the background, see start_producer)
+    prepared = prepare_sources({"qb": (qb_file, engine.QB_COLUMNS), "dt": (dt_file, engine.DT_COLUMNS)})
+    df_qb, df_dt = prepared["qb"][0], prepared["dt"][0]
 
-        # **🚀 Optimized Fuzzy Matching Using itertools**
-        def fast_fuzzy_match(sku_list, threshold):
-            """Optimized fuzzy matching using itertools to reduce comparisons."""
-            return [(sku1, sku2) for sku1, sku2 in itertools.combinations(sku_list, 2) if ratio(sku1, sku2) > threshold]
+    with st.spinner("📊 Chargement des données en cours..."):
+        # Every decision of this run goes to the journal, with the inputs' fingerprints
+        journal = DecisionJournal(threshold=fuzziness_threshold)
+        journal.take_snapshot("qb", df_qb)
+        journal.take_snapshot("dt", df_dt)
+        st.session_state["journal"] = journal
+        st.session_state["fuzzy_selected"] = []
+        st.session_state["identifier_matches"] = []  # Found again at step 2, on these files
+        st.session_state["cross_decided"] = set()  # (QuickBooks SKU, D-Tools SKU) pairs reviewed in step 2
+        st.session_state["previous_journal"] = previous_journal
+        st.session_state["delta_plan"] = None
+
+        if previous_journal is not None:
+            # **🔁 Delta Mode: replay previous decisions, only review what changed**
+            delta_plan = delta.plan(previous_journal, df_qb, df_dt, fuzziness_threshold)
+            st.session_state["delta_plan"] = delta_plan
+            for source, df, qty_col in (("qb", df_qb, engine.QB_QTY_COL), ("dt", df_dt, engine.DT_QTY_COL)):
+                df, decided_groups, clusters = delta.replay_cleanup(
+                    previous_journal, source, df, qty_col, delta_plan, fuzziness_threshold
+                )
+                st.session_state[f"{source}_cleaned_data"] = df
+                st.session_state[f"{source}_duplicate_queue"] = delta.pending_duplicates(df, decided_groups)
+                st.session_state[f"{source}_fuzzy_duplicates"] = clusters
+            journal.decisions[:0] = delta_plan.replayed
+            stop_producer()
+        else:
+            # Initialize Session State Properly
+            for source, (df, queue) in prepared.items():
+                st.session_state[f"{source}_cleaned_data"] = df
+                st.session_state[f"{source}_duplicate_queue"] = list(queue)  # Shared, see prepare_sources
+                st.session_state[f"{source}_fuzzy_duplicates"] = []
+
+            # **🚀 Indexed Fuzzy Matching in the background, scores cached on disk and filtered by the slider**
+            start_producer(df_qb, df_dt, fuzziness_threshold)
+
+        # Step 1 decisions are logged against a SKU index and applied when each file is done
+        st.session_state["auto_resolved"] = Counter()
+        for source, qty_col in (("qb", engine.QB_QTY_COL), ("dt", engine.DT_QTY_COL)):
+            pending = PendingDecisions(st.session_state[f"{source}_cleaned_data"], qty_col)
+            st.session_state[f"{source}_pending"] = pending
+            # 🤖 Only what the rules cannot settle is left to review
+            st.session_state[f"{source}_duplicate_queue"] = resolve_duplicates(
+                pending, source, st.session_state[f"{source}_duplicate_queue"], auto_rules,
+                st.session_state["auto_resolved"], journal
+            )
+            st.session_state[f"{source}_fuzzy_duplicates"] = resolve_clusters(
+                pending, source, st.session_state[f"{source}_fuzzy_duplicates"], auto_rules,
+                st.session_state["auto_resolved"], journal
+            )
+        data_changed()
+
+if st.session_state["delta_plan"] is not None and step in (1, 1.6):
+    summary = st.session_state["delta_plan"].summary()
+    st.info(
+        f"🔁 Mode incrémental — QuickBooks : {summary['qb']['new']} nouveaux, {summary['qb']['changed']} modifiés, "
+        f"{summary['qb']['deleted']} supprimés · D-Tools : {summary['dt']['new']} nouveaux, "
+        f"{summary['dt']['changed']} modifiés, {summary['dt']['deleted']} supprimés · "
+        f"{summary['replayed']} décisions réappliquées"
+    )
 
-        
-        st.session_state["qb_fuzzy_duplicates"] = fast_fuzzy_match(df_qb["SKU_NORM"].unique(), fuzziness_threshold)
-        
-        st.session_state["dt_fuzzy_duplicates"] = fast_fuzzy_match(df_dt["SKU_NORM"].unique(), fuzziness_threshold)
+if step in (1, 1.6):
+    show_auto_resolved()
 
 # ------------------------- STEP 1: CLEAN QuickBooks FIRST -------------------------
 if step == 1 and qb_file and dt_file:
     st.header("🔍 Étape 1: Nettoyage des fichiers individuels (QuickBooks)")
 
+    fuzzy_ready_qb = collect_fuzzy("qb", auto_rules)
     total_duplicates_qb = len(st.session_state["qb_duplicate_queue"])
-    total_fuzzy_qb = len(st.session_state["qb_fuzzy_duplicates"])
+    total_fuzzy_qb = len(st.session_state["qb_fuzzy_duplicates"]) if fuzzy_ready_qb else "…"
 
     st.subheader(f"📘 QuickBooks: {total_duplicates_qb} exacts, {total_fuzzy_qb} approximatifs")
 
     if len(st.session_state["qb_duplicate_queue"]) > 0:
         current_sku = st.session_state["qb_duplicate_queue"][0]
-        df_duplicate_group_qb = st.session_state["qb_cleaned_data"][st.session_state["qb_cleaned_data"]["SKU_NORM"] == current_sku]
+        df_duplicate_group_qb = st.session_state["qb_pending"].rows(current_sku)
 
         st.subheader(f"🛠️ Gestion des doublons (QuickBooks) - SKU: `{current_sku}`")
-        st.dataframe(df_duplicate_group_qb)
+        show_dataframe(df_duplicate_group_qb)
 
         keep_sku = st.selectbox("Sélectionnez le SKU à conserver", df_duplicate_group_qb["SKU"].unique(), key=f"qb_keep_sku_{current_sku}")
         custom_sku = st.text_input("Ou entrez un nouveau SKU standardisé:", "", key=f"qb_custom_sku_{current_sku}")
@@ -125,37 +502,47 @@ if step == 1 and qb_file and dt_file:
             selected_sku = custom_sku if custom_sku else keep_sku
 
             if action == "🟡 Fusionner (somme quantités)":
-                sum_quantity = df_duplicate_group_qb["Quantité en stock"].astype(float).sum()
-                st.session_state["qb_cleaned_data"].loc[st.session_state["qb_cleaned_data"]["SKU_NORM"] == current_sku, "SKU"] = selected_sku
-                st.session_state["qb_cleaned_data"].loc[st.session_state["qb_cleaned_data"]["SKU_NORM"] == selected_sku, "Quantité en stock"] = sum_quantity
+                st.session_state["qb_pending"].merge_duplicate(current_sku, selected_sku)
 
             elif action == "🔴 Supprimer":
-                st.session_state["qb_cleaned_data"] = st.session_state["qb_cleaned_data"][st.session_state["qb_cleaned_data"]["SKU_NORM"] != current_sku]
+                st.session_state["qb_pending"].delete_duplicate(current_sku)
 
+            st.session_state["journal"].record(
+                "duplicates", DUPLICATE_ACTIONS[action], source="qb", sku_norm=current_sku, selected_sku=selected_sku
+            )
             st.session_state["qb_duplicate_queue"].pop(0)
             st.rerun()
         # ✅ Process Fuzzy Duplicates for QuickBooks
     elif len(st.session_state["qb_fuzzy_duplicates"]) > 0:
-        fuzzy_sku1, fuzzy_sku2 = st.session_state["qb_fuzzy_duplicates"][0]
-        df_fuzzy_group_qb = st.session_state["qb_cleaned_data"][st.session_state["qb_cleaned_data"]["SKU_NORM"].isin([fuzzy_sku1, fuzzy_sku2])]
+        cluster = st.session_state["qb_fuzzy_duplicates"][0]
+        cluster_key = "_".join(cluster)
+        df_fuzzy_group_qb = st.session_state["qb_pending"].rows(*cluster)
 
-        st.subheader(f"🔍 Correspondance Approximative (QuickBooks)")
-        st.dataframe(df_fuzzy_group_qb)
+        st.subheader(f"🔍 Correspondance Approximative (QuickBooks) - {len(cluster)} SKU")
+        show_dataframe(df_fuzzy_group_qb)
 
-        keep_sku = st.selectbox("Sélectionnez le SKU à conserver", df_fuzzy_group_qb["SKU"].unique(), key=f"qb_fuzzy_keep_{fuzzy_sku1}_{fuzzy_sku2}")
-        custom_sku = st.text_input("Ou entrez un nouveau SKU standardisé:", "", key=f"qb_fuzzy_custom_sku_{fuzzy_sku1}_{fuzzy_sku2}")
+        keep_sku = st.selectbox("Sélectionnez le SKU à conserver", df_fuzzy_group_qb["SKU"].unique(), key=f"qb_fuzzy_keep_{cluster_key}")
+        custom_sku = st.text_input("Ou entrez un nouveau SKU standardisé:", "", key=f"qb_fuzzy_custom_sku_{cluster_key}")
 
-        confirm = st.radio(f"Fusionner `{fuzzy_sku1}` et `{fuzzy_sku2}` ?", ["❌ Non", "✅ Oui"], key=f"qb_fuzzy_{fuzzy_sku1}_{fuzzy_sku2}")
+        confirm = st.radio(f"Fusionner {', '.join(f'`{sku}`' for sku in cluster)} en une seule ligne (somme des quantités) ?", ["❌ Non", "✅ Oui"], key=f"qb_fuzzy_{cluster_key}")
 
-        if st.button("Suivant ➡️", key=f"qb_fuzzy_next_{fuzzy_sku1}"):
+        if st.button("Suivant ➡️", key=f"qb_fuzzy_next_{cluster_key}"):
+            selected_sku = custom_sku if custom_sku else keep_sku
             if confirm == "✅ Oui":
-                sum_quantity = df_fuzzy_group_qb["Quantité en stock"].astype(float).sum()
-                st.session_state["qb_cleaned_data"].loc[st.session_state["qb_cleaned_data"]["SKU_NORM"] == fuzzy_sku1, "Quantité en stock"] = sum_quantity
+                st.session_state["qb_pending"].merge_fuzzy_cluster(cluster, selected_sku)
 
+            st.session_state["journal"].record(
+                "fuzzy_duplicates", "merge" if confirm == "✅ Oui" else "skip", source="qb",
+                skus=list(cluster), selected_sku=selected_sku
+            )
             st.session_state["qb_fuzzy_duplicates"].pop(0)
             st.rerun()
 
-    if len(st.session_state["qb_duplicate_queue"]) == 0 and len(st.session_state["qb_fuzzy_duplicates"]) == 0:
+    elif not fuzzy_ready_qb:
+        wait_for_producer("qb")
+
+    if len(st.session_state["qb_duplicate_queue"]) == 0 and len(st.session_state["qb_fuzzy_duplicates"]) == 0 and fuzzy_ready_qb:
+        finish_review("qb")
         st.session_state["step"] = 1.5  # Move to D-Tools after QuickBooks is done
         st.rerun()
 
@@ -169,17 +556,18 @@ if step == 1.5:
 if step == 1.6:
     st.header("🔍 Étape 1: Nettoyage des fichiers individuels (D-Tools)")
 
+    fuzzy_ready_dt = collect_fuzzy("dt", auto_rules)
     total_duplicates_dt = len(st.session_state["dt_duplicate_queue"])
-    total_fuzzy_dt = len(st.session_state["dt_fuzzy_duplicates"])
+    total_fuzzy_dt = len(st.session_state["dt_fuzzy_duplicates"]) if fuzzy_ready_dt else "…"
 
     st.subheader(f"📗 D-Tools: {total_duplicates_dt} exacts, {total_fuzzy_dt} approximatifs")
 
     if len(st.session_state["dt_duplicate_queue"]) > 0:
         current_sku = st.session_state["dt_duplicate_queue"][0]
-        df_duplicate_group_dt = st.session_state["dt_cleaned_data"][st.session_state["dt_cleaned_data"]["SKU_NORM"] == current_sku]
+        df_duplicate_group_dt = st.session_state["dt_pending"].rows(current_sku)
 
         st.subheader(f"🛠️ Gestion des doublons (D-Tools) - SKU: `{current_sku}`")
-        st.dataframe(df_duplicate_group_dt)
+        show_dataframe(df_duplicate_group_dt)
 
         keep_sku = st.selectbox("Sélectionnez le SKU à conserver", df_duplicate_group_dt["SKU"].unique(), key=f"dt_keep_sku_{current_sku}")
         custom_sku = st.text_input("Ou entrez un nouveau SKU standardisé:", "", key=f"dt_custom_sku_{current_sku}")
@@ -190,44 +578,57 @@ if step == 1.6:
             selected_sku = custom_sku if custom_sku else keep_sku
 
             if action == "🟡 Fusionner (somme quantités)":
-                sum_quantity = df_duplicate_group_dt["Quantity on Hand"].astype(float).sum()
-                st.session_state["dt_cleaned_data"].loc[st.session_state["dt_cleaned_data"]["SKU_NORM"] == current_sku, "SKU"] = selected_sku
-                st.session_state["dt_cleaned_data"].loc[st.session_state["dt_cleaned_data"]["SKU_NORM"] == selected_sku, "Quantity on Hand"] = sum_quantity
+                st.session_state["dt_pending"].merge_duplicate(current_sku, selected_sku)
 
             elif action == "🔴 Supprimer":
-                st.session_state["dt_cleaned_data"] = st.session_state["dt_cleaned_data"][st.session_state["dt_cleaned_data"]["SKU_NORM"] != current_sku]
+                st.session_state["dt_pending"].delete_duplicate(current_sku)
 
+            st.session_state["journal"].record(
+                "duplicates", DUPLICATE_ACTIONS[action], source="dt", sku_norm=current_sku, selected_sku=selected_sku
+            )
             st.session_state["dt_duplicate_queue"].pop(0)
             st.rerun()
 
              # ✅ Process Fuzzy Duplicates for QuickBooks
     elif len(st.session_state["dt_fuzzy_duplicates"]) > 0:
-        fuzzy_sku1, fuzzy_sku2 = st.session_state["dt_fuzzy_duplicates"][0]
-        df_fuzzy_group_dt = st.session_state["dt_cleaned_data"][st.session_state["dt_cleaned_data"]["SKU_NORM"].isin([fuzzy_sku1, fuzzy_sku2])]
+        cluster = st.session_state["dt_fuzzy_duplicates"][0]
+        cluster_key = "_".join(cluster)
+        df_fuzzy_group_dt = st.session_state["dt_pending"].rows(*cluster)
 
-        st.subheader(f"🔍 Correspondance Approximative (D-Tools)")
-        st.dataframe(df_fuzzy_group_dt)
+        st.subheader(f"🔍 Correspondance Approximative (D-Tools) - {len(cluster)} SKU")
+        show_dataframe(df_fuzzy_group_dt)
 
-        keep_sku = st.selectbox("Sélectionnez le SKU à conserver", df_fuzzy_group_dt["SKU"].unique(), key=f"dt_fuzzy_keep_{fuzzy_sku1}_{fuzzy_sku2}")
-        custom_sku = st.text_input("Ou entrez un nouveau SKU standardisé:", "", key=f"dt_fuzzy_custom_sku_{fuzzy_sku1}_{fuzzy_sku2}")
+        keep_sku = st.selectbox("Sélectionnez le SKU à conserver", df_fuzzy_group_dt["SKU"].unique(), key=f"dt_fuzzy_keep_{cluster_key}")
+        custom_sku = st.text_input("Ou entrez un nouveau SKU standardisé:", "", key=f"dt_fuzzy_custom_sku_{cluster_key}")
 
-        confirm = st.radio(f"Fusionner `{fuzzy_sku1}` et `{fuzzy_sku2}` ?", ["❌ Non", "✅ Oui"], key=f"dt_fuzzy_{fuzzy_sku1}_{fuzzy_sku2}")
+        confirm = st.radio(f"Fusionner {', '.join(f'`{sku}`' for sku in cluster)} en une seule ligne (somme des quantités) ?", ["❌ Non", "✅ Oui"], key=f"dt_fuzzy_{cluster_key}")
 
-        if st.button("Suivant ➡️", key=f"dt_fuzzy_next_{fuzzy_sku1}"):
+        if st.button("Suivant ➡️", key=f"dt_fuzzy_next_{cluster_key}"):
+            selected_sku = custom_sku if custom_sku else keep_sku
             if confirm == "✅ Oui":
-                sum_quantity = df_fuzzy_group_dt["Quantity on Hand"].astype(float).sum()
-                st.session_state["dt_cleaned_data"].loc[st.session_state["dt_cleaned_data"]["SKU_NORM"] == fuzzy_sku1, "Quantity on Hand"] = sum_quantity
+                st.session_state["dt_pending"].merge_fuzzy_cluster(cluster, selected_sku)
 
+            st.session_state["journal"].record(
+                "fuzzy_duplicates", "merge" if confirm == "✅ Oui" else "skip", source="dt",
+                skus=list(cluster), selected_sku=selected_sku
+            )
             st.session_state["dt_fuzzy_duplicates"].pop(0)
             st.rerun()
 
         # ✅ Download Cleaned Files
-    if len(st.session_state["dt_duplicate_queue"]) == 0 and len(st.session_state["dt_fuzzy_duplicates"]) == 0:
+    elif not fuzzy_ready_dt:
+        wait_for_producer("dt")
+
+    if len(st.session_state["dt_duplicate_queue"]) == 0 and len(st.session_state["dt_fuzzy_duplicates"]) == 0 and fuzzy_ready_dt:
         st.session_state["dt_cleanup_done"] = True  # ✅ Store cleanup completion flag
+        finish_review("dt")
         st.success("✅ Tous les doublons ont été traités pour D-Tools !")
 
-        cleaned_dt = st.session_state["dt_cleaned_data"].to_csv(index=False, sep=";").encode("utf-8")
-        cleaned_qb = st.session_state["qb_cleaned_data"].to_csv(index=False, sep=";").encode("utf-8")
+        # Working frames only hold the review columns: restore the others for download
+        cleaned_dt = engine.restore_columns(st.session_state["dt_cleaned_data"], full_inventory(dt_file, st.session_state["dt_file_hash"]))
+        cleaned_qb = engine.restore_columns(st.session_state["qb_cleaned_data"], full_inventory(qb_file, st.session_state["qb_file_hash"]))
+        cleaned_dt = cleaned_dt.to_csv(index=False, sep=";").encode("utf-8")
+        cleaned_qb = cleaned_qb.to_csv(index=False, sep=";").encode("utf-8")
 
         col1, col2 = st.columns(2)
         with col1:
@@ -246,6 +647,20 @@ if step == 1.6:
             )
 
     if st.button("🔜 Passer à l'étape 2"):
+        finish_review("qb")
+        finish_review("dt")
+        if st.session_state["delta_plan"] is not None:
+            # Replay the previous step 2 merges once, before building the queue
+            delta_plan = st.session_state["delta_plan"]
+            replayed_before = len(delta_plan.replayed)
+            fuzzy_selected, decided = delta.replay_cross_matches(
+                st.session_state["previous_journal"], st.session_state["qb_cleaned_data"],
+                st.session_state["dt_cleaned_data"], delta_plan
+            )
+            st.session_state["fuzzy_selected"] = fuzzy_selected
+            st.session_state["cross_decided"] = decided
+            st.session_state["journal"].decisions[:0] = delta_plan.replayed[replayed_before:]
+            data_changed()
         st.session_state["step"] = 2
         st.rerun()
 
@@ -253,21 +668,40 @@ if step == 1.6:
 # ------------------------- STEP 2: MATCH SKUs (Step-by-Step) -------------------------
 if step == 2:
     st.header("🔍 Étape 2: Correspondance des SKUs")
+    finish_review("qb")
+    finish_review("dt")
 
     df_qb = st.session_state["qb_cleaned_data"]
     df_dt = st.session_state["dt_cleaned_data"]
 
-    # ---- Exact Matches ----
-    exact_matches = df_qb[df_qb["SKU"].isin(df_dt["SKU"])].copy()
-    exact_matches["Match Type"] = "Exact"
-    st.session_state["exact_matches"] = exact_matches
+    # ---- Exact Matches & Mismatches, split once per version of the cleaned data ----
+    fuzzy_selected = st.session_state.get("fuzzy_selected", [])
+    matches = st.session_state.get("step2_matches")
+    if (
+        matches is None or matches["version"] != st.session_state["data_version"]
+        or matches["paired"] > len(fuzzy_selected) or matches["keys"] != identifier_keys
+    ):
+        matches = dict(zip(("exact", "qb", "dt"), engine.split_matches(df_qb, df_dt, fuzzy_selected)))
+        # SKUs sharing a part number or barcode are paired without review: the rest goes to fuzzy matching
+        matches["identifiers"] = engine.identifier_matches(
+            matches["qb"], matches["dt"], *identifier_columns(qb_file, dt_file), identifier_keys
+        )
+        matches["qb"], matches["dt"] = engine.drop_paired(matches["qb"], matches["dt"], matches["identifiers"])
+        matches.update(version=st.session_state["data_version"], paired=len(fuzzy_selected), keys=identifier_keys)
+        st.session_state["step2_matches"] = matches
+        st.session_state["identifier_matches"] = matches["identifiers"]
+    elif matches["paired"] < len(fuzzy_selected):
+        # Merges since the split: only drop the newly paired SKUs
+        matches["qb"], matches["dt"] = engine.drop_paired(matches["qb"], matches["dt"], fuzzy_selected[matches["paired"]:])
+        matches["paired"] = len(fuzzy_selected)
+    exact_matches, mismatched_qb, mismatched_dt = matches["exact"], matches["qb"], matches["dt"]
 
     with st.expander(f"✅ {len(exact_matches)} Correspondances Exactes (Afficher / Masquer)"):
-        st.dataframe(exact_matches)
+        show_table(exact_matches, "exact_matches")
+
+    with st.expander(f"🔗 {len(matches['identifiers'])} Correspondances par identifiant (Afficher / Masquer)"):
+        show_table(pd.DataFrame(matches["identifiers"]), "identifier_matches")
 
-    # ---- Mismatches ----
-    mismatched_qb = df_qb[~df_qb["SKU"].isin(df_dt["SKU"])].copy()
-    mismatched_dt = df_dt[~df_dt["SKU"].isin(df_qb["SKU"])].copy()
     total_mismatches = len(mismatched_qb) + len(mismatched_dt)
 
     st.session_state["mismatched_qb"] = mismatched_qb
@@ -278,22 +712,51 @@ if step == 2:
     col1, col2 = st.columns(2)
     with col1:
         st.write(f"📘 QuickBooks SKUs non trouvés dans D-Tools: {len(mismatched_qb)}")
-        st.dataframe(mismatched_qb)
+        show_table(mismatched_qb, "mismatched_qb")
     with col2:
         st.write(f"📗 D-Tools SKUs non trouvés dans QuickBooks: {len(mismatched_dt)}")
-        st.dataframe(mismatched_dt)
+        show_table(mismatched_dt, "mismatched_dt")
 
     # ---- Fuzzy Matches ----
-    if "fuzzy_queue" not in st.session_state or not st.session_state["fuzzy_queue"]:
-        fuzzy_matches = [
-            {"QuickBooks SKU": qb_sku, "D-Tools SKU": dt_sku, "Similitude": round(ratio(qb_sku, dt_sku) * 100, 2)}
-            for qb_sku in mismatched_qb["SKU"]
-            for dt_sku in mismatched_dt["SKU"]
-            if 90 < ratio(qb_sku, dt_sku) * 100 < 100 and qb_sku != dt_sku
+    # Built once per data version and threshold: an empty queue with the same key is a finished review
+    queue_key = (st.session_state["data_version"], fuzziness_threshold, top_k, identifier_keys, auto_rules)
+    if st.session_state.get("fuzzy_queue_key") != queue_key:
+        decided = st.session_state.get("cross_decided", set())
+        if st.session_state["delta_plan"] is not None:
+            # Delta mode: only pairs with a new SKU, minus the replayed decisions
+            queue = delta.new_cross_matches(
+                mismatched_qb, mismatched_dt, fuzziness_threshold, st.session_state["delta_plan"], decided, top_k
+            )
+        else:
+            # The background warm-up writes to the same cache entry: let it finish first
+            if not collect_fuzzy("cross"):
+                wait_for_producer("cross")
+            # Cached cross-file scores (batched matrix scoring on a miss), best first
+            cross_key = f"cross:{st.session_state['qb_file_hash']}:{st.session_state['dt_file_hash']}"
+            queue = engine.cross_matches(
+                mismatched_qb, mismatched_dt, fuzziness_threshold, get_similarity_cache(), cross_key, top_k=top_k
+            )
+        # Pairs already answered stay answered when the slider moves
+        queue = [
+            fuzzy_match for fuzzy_match in queue
+            if (fuzzy_match["QuickBooks SKU"], fuzzy_match["D-Tools SKU"]) not in decided
         ]
-        fuzzy_matches_df = pd.DataFrame(fuzzy_matches).sort_values(by="Similitude", ascending=False)
-        st.session_state["fuzzy_queue"] = fuzzy_matches_df.to_dict(orient="records")
-
+        # 🤖 Pairs the rules settle are merged / ignored now and journaled like a review
+        merged, remaining = resolve_cross_matches(
+            queue, df_qb, df_dt, auto_rules, st.session_state.setdefault("auto_resolved", Counter()),
+            st.session_state["journal"],
+            full_inventory(dt_file, st.session_state["dt_file_hash"]) if auto_rules.ignore_discontinued else None,
+        )
+        if len(remaining) < len(queue):
+            left = {(fuzzy_match["QuickBooks SKU"], fuzzy_match["D-Tools SKU"]) for fuzzy_match in remaining}
+            st.session_state["cross_decided"] = decided | {
+                (fuzzy_match["QuickBooks SKU"], fuzzy_match["D-Tools SKU"]) for fuzzy_match in queue
+            } - left
+            st.session_state["fuzzy_selected"] = st.session_state.get("fuzzy_selected", []) + merged
+        st.session_state["fuzzy_queue"] = remaining
+        st.session_state["fuzzy_queue_key"] = queue_key
+
+    show_auto_resolved()
     st.subheader(f"⚠️ {len(st.session_state['fuzzy_queue'])} Correspondances Approximatives")
 
     if len(st.session_state["fuzzy_queue"]) > 0:
@@ -315,12 +778,17 @@ if step == 2:
 
         if st.button("Suivant ➡️"):
             if action == "🟡 Fusionner":
-                df_dt = df_dt[df_dt["SKU"] != fuzzy_match["D-Tools SKU"]]
                 st.session_state["fuzzy_selected"] = st.session_state.get("fuzzy_selected", []) + [fuzzy_match]
             elif action == "✅ Garder les deux":
                 pass  # Keep both
+            st.session_state["journal"].record(
+                "cross_matches", CROSS_MATCH_ACTIONS[action], qb_sku=fuzzy_match["QuickBooks SKU"],
+                dt_sku=fuzzy_match["D-Tools SKU"], score=fuzzy_match["Similitude"]
+            )
+            st.session_state.setdefault("cross_decided", set()).add(
+                (fuzzy_match["QuickBooks SKU"], fuzzy_match["D-Tools SKU"])
+            )
             st.session_state["fuzzy_queue"].pop(0)
-            st.session_state["dt_cleaned_data"] = df_dt
             st.rerun()
         
     if st.button("🔜 Passer à l'étape 3", key="step_3"):
@@ -335,96 +803,55 @@ if step == 3:
         st.session_state["step"] = 2
         st.rerun()
 
-    # ✅ Start with the D-Tools dataset to preserve template
-    df_output = st.session_state["dt_cleaned_data"].copy()
     df_qb = st.session_state.get("qb_cleaned_data", pd.DataFrame())  # Ensure df_qb exists
 
-    # st.write("Columns in df_output:", df_output.columns.tolist())
-    
-    # ✅ Identify QuickBooks "Quantité en stock" column dynamically
-    qb_qty_col = next((col for col in df_qb.columns if "Quantité en stock" or "Quantity on" in col), None)
-   
-
-    if qb_qty_col:
-        df_qb.rename(columns={qb_qty_col: "Quantity on Hand"}, inplace=True)
-    else:
+    if engine.QB_QTY_COL not in df_qb.columns:
         st.warning("⚠️ 'Quantité en stock' column not found in QuickBooks data. Proceeding without it.")
 
-    # ✅ Merge QuickBooks Quantities into D-Tools Dataset
-    st.write("Columns in df_qb:", df_qb.columns.tolist())
-    if "Quantity on Hand" in df_qb.columns:
-        df_output = df_output.merge(df_qb[["SKU", "Quantity on Hand"]], on="SKU", how="left", suffixes=("", "_QB"))
-
-        # ✅ Ensure "Quantity on Hand" is correctly assigned
-        df_output["Quantity on Hand"] = df_output["Quantity on Hand_QB"].combine_first(df_output["Quantity on Hand"])
-
-        # ✅ Remove the extra column
-        df_output.drop(columns=["Quantity on Hand_QB"], inplace=True)
-    
-    # ✅ Extract & Prepare Fuzzy Matches Data
-    df_fuzzy_selected = pd.DataFrame(st.session_state.get("fuzzy_selected", []))
-
-    if not df_fuzzy_selected.empty:
-        df_fuzzy_selected = df_fuzzy_selected.rename(columns={"QuickBooks SKU": "SKU"})  # Align SKU column
-        df_fuzzy_selected["Match Type"] = "Fuzzy Merged"
-
-    # ✅ Prepare Exact Matches Data
-    exact_matches = st.session_state.get("exact_matches", pd.DataFrame()).copy()
-    
-    if not exact_matches.empty:
-        exact_matches["Match Type"] = "Exact Match"
-        exact_matches = exact_matches.rename(columns={"QuickBooks SKU": "SKU"})  # Align SKU column
-
-    # ✅ Merge Exact Matches and Fuzzy Matches into the D-Tools Format
-    final_output = df_output.copy()
-    
-    for df_merge in [exact_matches, df_fuzzy_selected]:
-        if not df_merge.empty and "Quantity on Hand" in df_merge.columns:
-            final_output = final_output.merge(
-                df_merge[["SKU", "Quantity on Hand"]], on="SKU", how="left", suffixes=("", "_Match")
-            )
-        # ✅ Ensure No Duplicate "Quantity on Hand" Columns
-    if "Quantity on Hand_QB" in final_output.columns and "Quantity on Hand_Match" in final_output.columns:
-        final_output["Quantity on Hand"] = final_output["Quantity on Hand_QB"].combine_first(final_output["Quantity on Hand_Match"])
-        final_output.drop(columns=["Quantity on Hand_QB", "Quantity on Hand_Match"], inplace=True)
-    elif "Quantity on Hand_QB" in final_output.columns:
-        final_output.rename(columns={"Quantity on Hand_QB": "Quantity on Hand"}, inplace=True)
-    elif "Quantity on Hand_Match" in final_output.columns:
-        final_output.rename(columns={"Quantity on Hand_Match": "Quantity on Hand"}, inplace=True)
-
-    
-    # ✅ Ensure All Expected D-Tools Columns Exist
-    expected_columns = list(df_output.columns)
-
-    # Add missing columns without overwriting existing data
-    for col in expected_columns:
-        if col not in final_output.columns:
-            final_output[col] = ""
-
-    # ✅ Align Final Output to D-Tools Column Order
-    final_output = final_output[expected_columns]
-
-    # ✅ Remove Any Unnecessary Columns (Like Unnamed)
-    final_output = final_output.loc[:, ~final_output.columns.str.contains("^Unnamed")]
-    
-    st.write(final_output)
-    
-    
-    # ✅ Export to Excel in Memory
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        final_output.to_excel(writer, sheet_name="Final Inventory", index=False)
-
-    excel_data = output.getvalue()
-
-    # ✅ Single Download Button for Cleaned Excel File
+    # ✅ Rebuilt only when the reviewed data changed, not on every rerun
+    # Identifier matches first: they take precedence over the merges reviewed
+    paired = st.session_state.get("identifier_matches", []) + st.session_state.get("fuzzy_selected", [])
+    final_inputs = (
+        df_qb,
+        st.session_state["dt_cleaned_data"],
+        pd.DataFrame(paired),
+    )
+    final_key = (st.session_state.get("dt_file_hash"), engine.frame_hash(*final_inputs))
+    if st.session_state.get("final_output_key") != final_key:
+        st.session_state["final_output"] = engine.build_final_output(
+            *final_inputs[:2],
+            paired,
+            full_inventory(dt_file, st.session_state.get("dt_file_hash")),
+        )
+        st.session_state["final_output_key"] = final_key
+    final_output = st.session_state["final_output"]
+
+    show_table(final_output, "final_output", ["Brand", "SKU", "Short Description", engine.DT_QTY_COL])
+
+    # ✅ Export, serialized once per content and format
+    export_format = st.radio(
+        "Format d'export :", list(EXPORT_LABELS), format_func=EXPORT_LABELS.get, horizontal=True
+    )
+    export_data = export_file(final_key, export_format, final_output)
+
     st.download_button(
-        label="📥 Télécharger Inventaire Final (Excel)",
-        data=excel_data,
-        file_name="Inventaire_Final.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        label=f"📥 Télécharger Inventaire Final ({EXPORT_LABELS[export_format]})",
+        data=export_data,
+        file_name=f"Inventaire_Final.{export_format}",
+        mime=engine.EXPORT_FORMATS[export_format]
+    )
+
+    # ✅ Decision journal, to replay these decisions on next week's files
+    st.download_button(
+        label="📥 Télécharger le journal des décisions",
+        data=st.session_state["journal"].to_json().encode("utf-8"),
+        file_name="journal_decisions.json",
+        mime="application/json"
     )
 
     if st.button("🔙 Retour au début"):
         st.session_state["step"] = 1
         st.rerun()
+
+profiler.end_rerun()
+profiling_panel(profiler)
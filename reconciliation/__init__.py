@@ -0,0 +1 @@
+"""Reconciliation logic shared by the Streamlit app (app.py)."""
@@ -0,0 +1,226 @@
+"""Stage benchmark on synthetic inventories, with a regression check.
+
+    python -m reconciliation.benchmark --sizes 1k,10k                    # compare with the baseline
+    python -m reconciliation.benchmark --sizes 1k,10k --update-baseline  # record it
+
+For each catalog size a QuickBooks / D-Tools pair is generated once (see
+`synthetic`) and kept under the data dir. The stages then run in pipeline
+order, each on the previous one's output, and each gets its wall time and
+peak memory: the process's peak RSS during the stage above the RSS it started
+with (Linux resets the peak between stages; elsewhere the peak of the run is
+used, which only grows). Caches are off: the load is a cold parse and the
+fuzzy stages score everything.
+
+A stage regresses when it is slower, or peaks higher, than the baseline by
+more than the tolerance and by more than a small absolute margin (timer and
+allocator noise on the small sizes). Any regression makes the exit code 1.
+
+The baseline records 1k, 10k and 100k only. At 100k the matcher and the
+export already take about half a minute each on the reference machine (one
+CPU, 5 GB); the 1M run did not finish there, so it has no baseline and
+`--sizes 1M` only prints its timings.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import asdict
+
+from reconciliation import engine, ingest
+from reconciliation.matching import fast_fuzzy_match
+from reconciliation.similarity_cache import CACHE_DIR
+from reconciliation.synthetic import DT_TEMPLATE, QB_TEMPLATE, REPO_DIR, SyntheticSpec, write
+
+STAGES = ("load", "normalize", "fast_fuzzy_match", "cross_match", "merge", "export")
+BASELINE_PATH = os.path.join(REPO_DIR, "benchmarks", "baseline.json")
+DATA_DIR = os.path.join(CACHE_DIR, "benchmark")
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1M": 1_000_000}
+
+TOLERANCE = 0.25
+MIN_SECONDS = 0.05
+MIN_MIB = 16
+
+
+def _status_kib(field):
+    """A memory field of /proc/self/status, or None off Linux."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _reset_peak():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")  # Resets VmHWM, the peak RSS
+    except OSError:
+        pass
+
+
+@contextmanager
+def measure(results, stage):
+    """Record the wall time and peak memory of the block under `results[stage]`."""
+    _reset_peak()
+    start_kib = _status_kib("VmRSS") or 0
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    peak_kib = _status_kib("VmHWM") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (
+        1024 if sys.platform == "darwin" else 1
+    )
+    results[stage] = {"seconds": round(seconds, 4), "peak_mib": round(max(peak_kib - start_kib, 0) / 1024, 1)}
+
+
+def dataset(n_skus, seed=0, data_dir=DATA_DIR):
+    """Paths of the generated pair for this size, generating it on first use."""
+    directory = os.path.join(data_dir, f"seed{seed}")
+    spec = SyntheticSpec(n_skus=n_skus, seed=seed)
+    for qb_format in ("xlsx", "csv"):
+        qb_path = os.path.join(directory, f"qb_{n_skus}.{qb_format}")
+        dt_path = os.path.join(directory, f"dt_{n_skus}.csv")
+        if os.path.exists(qb_path) and os.path.exists(dt_path):
+            return qb_path, dt_path
+    return write(spec, directory)
+
+
+def run_stages(qb_path, dt_path, threshold=0.95):
+    """Run the pipeline once, every stage measured. Returns {stage: {seconds, peak_mib}}."""
+    results = {}
+    cache_dir = ingest.PARSED_CACHE_DIR
+    with tempfile.TemporaryDirectory() as parsed_cache:
+        ingest.PARSED_CACHE_DIR = parsed_cache  # Cold parse every run
+        try:
+            with measure(results, "load"):
+                df_qb = engine.load_inventory(qb_path, engine.QB_COLUMNS)
+                df_dt = engine.load_inventory(dt_path, engine.DT_COLUMNS)
+            df_dt_full = engine.load_inventory(dt_path)
+        finally:
+            ingest.PARSED_CACHE_DIR = cache_dir
+
+    with measure(results, "normalize"):
+        df_qb = engine.working_frame(df_qb)
+        df_dt = engine.working_frame(df_dt)
+
+    with measure(results, "fast_fuzzy_match"):
+        # The matcher alone, on every SKU: no signature grouping, no clustering
+        fast_fuzzy_match(df_qb["SKU_NORM"].unique(), threshold)
+        fast_fuzzy_match(df_dt["SKU_NORM"].unique(), threshold)
+
+    with measure(results, "cross_match"):
+        _, mismatched_qb, mismatched_dt = engine.split_matches(df_qb, df_dt)
+        queue = engine.cross_matches(mismatched_qb, mismatched_dt, threshold)
+
+    with measure(results, "merge"):
+        fuzzy_selected = engine.apply_cross_policy(queue, engine.DecisionPolicy(cross_matches="merge"))
+        final_output = engine.build_final_output(df_qb, df_dt, fuzzy_selected, df_dt_full)
+
+    with measure(results, "export"):
+        engine.export_bytes(final_output, "xlsx")
+    return results
+
+
+def benchmark(sizes, threshold=0.95, seed=0, repeat=1, data_dir=DATA_DIR, log=print):
+    """{size label: {stage: {seconds, peak_mib}}}, the best of `repeat` runs per stage."""
+    # Unmeasured pass on the bundled exports, so that lazy imports (Excel
+    # reader and writer, RapidFuzz) are not charged to the first size
+    run_stages(QB_TEMPLATE, DT_TEMPLATE, threshold)
+    report = {}
+    for label in sizes:
+        qb_path, dt_path = dataset(SIZES[label], seed, data_dir)
+        best = {}
+        for _ in range(repeat):
+            for stage, result in run_stages(qb_path, dt_path, threshold).items():
+                if stage not in best:
+                    best[stage] = result
+                else:
+                    best[stage] = {key: min(best[stage][key], value) for key, value in result.items()}
+        report[label] = best
+        for stage in STAGES:
+            log(f"{label:>5} {stage:<17} {best[stage]['seconds']:9.3f} s {best[stage]['peak_mib']:9.1f} MiB")
+    return report
+
+
+def regressions(report, baseline, tolerance=TOLERANCE, min_seconds=MIN_SECONDS, min_mib=MIN_MIB):
+    """Stages worse than the baseline, as readable lines."""
+    found = []
+    for label, stages in report.items():
+        for stage, result in stages.items():
+            base = baseline.get(label, {}).get(stage)
+            if base is None:
+                continue
+            for key, unit, margin in (("seconds", "s", min_seconds), ("peak_mib", "MiB", min_mib)):
+                if result[key] > base[key] * (1 + tolerance) and result[key] - base[key] > margin:
+                    found.append(f"{label} {stage}: {result[key]:.3f} {unit} vs {base[key]:.3f} {unit} in the baseline")
+    return found
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the reconciliation stages on synthetic inventories.")
+    parser.add_argument("--sizes", default="1k,10k", help=f"comma-separated, among {', '.join(SIZES)} (default: %(default)s)")
+    parser.add_argument("--threshold", type=float, default=0.95, help="fuzzy threshold (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per size, the best is kept (default: %(default)s)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON (default: %(default)s)")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results into the baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="allowed slowdown / memory growth, as a fraction (default: %(default)s)")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="where generated inventories are kept (default: %(default)s)")
+    parser.add_argument("--json", help="also write this run's results to this file")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        build_parser().error(f"unknown sizes {unknown}, expected some of {list(SIZES)}")
+
+    report = benchmark(sizes, args.threshold, args.seed, args.repeat, args.data_dir)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        baseline.setdefault("results", {}).update(report)
+        baseline["meta"] = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "threshold": args.threshold,
+            "spec": {key: value for key, value in asdict(SyntheticSpec(seed=args.seed)).items() if key != "n_skus"},
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not baseline:
+        print(f"No baseline at {args.baseline}; record one with --update-baseline")
+        return 0
+    found = regressions(report, baseline["results"], args.tolerance)
+    for line in found:
+        print(f"REGRESSION {line}")
+    if not found:
+        print("No regression against the baseline")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
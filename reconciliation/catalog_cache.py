@@ -0,0 +1,89 @@
+"""In-memory store of prepared inventories, shared by every session of the server.
+
+Several users often upload the same catalog (the D-Tools master export). Its
+working frame, duplicate queue, near-duplicate clusters and full template
+only depend on the file's content, so they are built once per process, keyed
+by content hash, and handed to every session that uploads the same bytes.
+
+Values are shared, not copied: callers must not modify them (the pipeline
+functions return new frames; lists a session pops from are copied first).
+Entries are evicted least recently used first once their total size passes
+`max_bytes`; a session still holding an evicted value keeps it alive until
+it lets go. Two sessions asking for the same missing entry build it once:
+the second waits for the first.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from reconciliation.profiling import deep_bytes
+
+CATALOG_CACHE_MAX_BYTES = int(os.environ.get("INVENTORY_CATALOG_CACHE_MB", "512")) * 1024 * 1024
+
+
+class CatalogCache:
+    """Thread-safe, byte-bounded LRU of values built on demand."""
+
+    def __init__(self, max_bytes=CATALOG_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (value, bytes), least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._building = {}  # key -> lock held while the value is built
+
+    def get(self, key, build):
+        """The value for `key`, built with `build()` on a miss.
+
+        A value bigger than the whole budget is returned but not kept. If
+        `build` raises (e.g. cancelled), nothing is stored.
+        """
+        with self._lock:
+            if key in self._entries:
+                return self._hit(key)
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            with self._lock:
+                if key in self._entries:  # Built by another session meanwhile
+                    return self._hit(key)
+                self.misses += 1
+            try:
+                value = build()
+                self._put(key, value, deep_bytes(value))
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+        return value
+
+    def _hit(self, key):
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def _put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def values(self):
+        with self._lock:
+            return [value for value, _ in self._entries.values()]
+
+    def stats(self):
+        """Entries, MiB held, budget and hit/miss counts."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "mib": round(self._bytes / 2**20, 1),
+                "max_mib": round(self.max_bytes / 2**20, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,196 @@
+"""Command-line entry point: reconcile the inventories without the Streamlit UI.
+
+    python -m reconciliation.cli qb_inventory.xlsx dtools_inventory.csv \
+        --duplicates merge --cross-matches merge -o Inventaire_Final.xlsx --journal journal.json
+
+    # Next week: replay last week's decisions, only decide on what changed
+    python -m reconciliation.cli qb_inventory.xlsx dtools_inventory.csv \
+        --duplicates merge --cross-matches merge -o Inventaire_Final.xlsx \
+        --previous-journal journal.json --previous-final Inventaire_Final_old.xlsx --journal journal.json
+
+    # Inventories larger than memory: work in a SQLite file, stream the export
+    python -m reconciliation.cli qb_inventory.csv dtools_inventory.csv --duplicates merge --store work.db
+
+    # Several sources against one catalog, one quantity column each
+    python -m reconciliation.cli dtools_inventory.csv --source QC qb_quebec.xlsx --source MTL qb_montreal.xlsx \
+        --source Entrepot entrepot.csv --map Entrepot "Item #" SKU --map Entrepot "On Hand" "Quantité en stock"
+"""
+import argparse
+import sys
+import time
+from collections import Counter
+
+from reconciliation import delta, profiling
+from reconciliation.engine import (
+    CROSS_MATCH_ACTIONS,
+    DUPLICATE_ACTIONS,
+    FUZZY_DUPLICATE_ACTIONS,
+    DecisionPolicy,
+    export,
+    load_inventory,
+    reconcile,
+)
+from reconciliation.identifiers import IDENTIFIER_KEYS, keys_named
+from reconciliation.journal import DecisionJournal
+from reconciliation.multi_source import SourceMapping, reconcile_sources
+from reconciliation.rules import AutoRules
+from reconciliation.similarity_cache import SimilarityCache
+from reconciliation.store import reconcile_store
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Réconciliation des stocks QuickBooks / D-Tools.")
+    parser.add_argument("qb_file", nargs="?", help="QuickBooks inventory (.xlsx or ;-separated .csv), unless --source")
+    parser.add_argument("dt_file", help="D-Tools inventory (.xlsx or ;-separated .csv)")
+    parser.add_argument("--source", nargs=2, action="append", metavar=("NAME", "FILE"), default=[],
+                        help="instead of qb_file: an inventory source, repeated for each; the output gets "
+                             "one quantity column per NAME and their total")
+    parser.add_argument("--map", nargs=3, action="append", metavar=("NAME", "COLUMN", "QB_COLUMN"), default=[],
+                        help="read COLUMN of source NAME as the QuickBooks column QB_COLUMN (e.g. SKU)")
+    parser.add_argument("-o", "--output", default="Inventaire_Final.xlsx",
+                        help="output file, .xlsx, .csv or .parquet (default: %(default)s)")
+    parser.add_argument("--threshold", type=float, default=0.95,
+                        help="fuzzy matching threshold between 0.80 and 1.0 (default: %(default)s)")
+    parser.add_argument("--duplicates", choices=DUPLICATE_ACTIONS, default="keep",
+                        help="exact duplicates inside a file (default: %(default)s)")
+    parser.add_argument("--fuzzy-duplicates", choices=FUZZY_DUPLICATE_ACTIONS, default="skip",
+                        help="near-duplicates inside a file (default: %(default)s)")
+    parser.add_argument("--cross-matches", choices=CROSS_MATCH_ACTIONS, default="keep",
+                        help="QuickBooks vs D-Tools near matches (default: %(default)s)")
+    parser.add_argument("--top-k", type=int,
+                        help="keep only the step 2 pairs among the K best of both their SKUs "
+                             "(1: mutual best matches; default: every pair)")
+    parser.add_argument("--id-keys", nargs="*", metavar="KEY", choices=[key.name for key in IDENTIFIER_KEYS],
+                        default=[key.name for key in IDENTIFIER_KEYS],
+                        help="identifiers paired exactly before fuzzy matching, in priority order, among "
+                             "%(choices)s (default: all, in that order; no KEY: SKUs only)")
+    parser.add_argument("--auto-merge-variants", action="store_true",
+                        help="merge the near-duplicate clusters whose SKUs only differ by separators, zero padding "
+                             "or a brand prefix and share one brand (D-Tools only), whatever --fuzzy-duplicates says")
+    parser.add_argument("--auto-accept", type=float, metavar="SIMILARITY",
+                        help="merge the step 2 pairs scoring at least SIMILARITY (0.80-1.0) when neither SKU has "
+                             "another candidate and the brand matches, whatever --cross-matches says")
+    parser.add_argument("--any-brand", action="store_true", help="with --auto-accept, do not check the brand")
+    parser.add_argument("--auto-ignore-discontinued", action="store_true",
+                        help="ignore the step 2 pairs with a discontinued D-Tools item")
+    parser.add_argument("--store", metavar="DB",
+                        help="out-of-core: load both files into this SQLite file and run the exact "
+                             "matching, the dedupe and the merge there, for inventories larger than memory")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the on-disk similarity cache")
+    parser.add_argument("--journal", help="write the decision journal of this run to this .json file")
+    parser.add_argument("--previous-journal",
+                        help="delta mode: replay this journal and only decide on what changed since")
+    parser.add_argument("--previous-final",
+                        help="previous final inventory, to report added/removed SKUs and quantity changes")
+    parser.add_argument("--profile",
+                        help="write the per-stage timings of this run as a Chrome trace (.json) to this file")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="with --profile, also record each stage's peak memory (tracemalloc, slower)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not 0.80 <= args.threshold <= 1.0:
+        build_parser().error("--threshold must be between 0.80 and 1.0")
+    if args.top_k is not None and args.top_k < 1:
+        build_parser().error("--top-k must be at least 1")
+    if args.auto_accept is not None and not 0.80 <= args.auto_accept <= 1.0:
+        build_parser().error("--auto-accept must be between 0.80 and 1.0")
+    if (args.qb_file is None) == (not args.source):
+        build_parser().error("give either qb_file or --source")
+    if args.source and (args.journal or args.previous_journal):
+        build_parser().error("--journal and --previous-journal need a single qb_file")
+    if args.store and (args.source or args.journal or args.previous_journal or args.previous_final):
+        build_parser().error("--store needs qb_file, without --journal, --previous-journal or --previous-final")
+    if args.store and (args.auto_merge_variants or args.auto_accept is not None or args.auto_ignore_discontinued):
+        build_parser().error("--store does not apply the --auto-* rules")
+    if {name for name, _, _ in args.map} - {name for name, _ in args.source}:
+        build_parser().error("--map names a source not given with --source")
+
+    policy = DecisionPolicy(
+        duplicates=args.duplicates,
+        fuzzy_duplicates=args.fuzzy_duplicates,
+        cross_matches=args.cross_matches,
+    )
+    rules = AutoRules(
+        merge_variants=args.auto_merge_variants,
+        accept_similarity=args.auto_accept,
+        same_brand=not args.any_brand,
+        ignore_discontinued=args.auto_ignore_discontinued,
+    )
+    cache = None if args.no_cache else SimilarityCache()
+    # Read before writing, the new journal / output may replace the previous ones
+    previous_journal = DecisionJournal.load(args.previous_journal) if args.previous_journal else None
+    previous_final = load_inventory(args.previous_final) if args.previous_final else None
+    journal = DecisionJournal()
+
+    profiler = profiling.Profiler()
+    profiler.track_memory(args.profile and args.profile_memory)
+    with profiling.activate(profiler if args.profile else None):
+        final_output = _run(args, policy, rules, cache, previous_journal, journal)
+    profiler.track_memory(False)
+    if args.profile:
+        with open(args.profile, "w", encoding="utf-8") as f:
+            f.write(profiler.to_chrome_trace())
+        print(profiler.summary().to_string())
+
+    if previous_final is not None:
+        changes = delta.compare_with_previous(previous_final, final_output)
+        for change, count in changes["Changement"].value_counts().items():
+            print(f"{change}: {count}")
+    return 0
+
+
+def _run(args, policy, rules, cache, previous_journal, journal):
+    start = time.perf_counter()
+    resolved = Counter()
+    if args.store:
+        rows = reconcile_store(
+            args.qb_file, args.dt_file, args.output, args.store, policy, args.threshold, cache, args.top_k,
+            keys_named(args.id_keys),
+        )
+        print(f"{rows} lignes écrites dans {args.output} ({time.perf_counter() - start:.1f} s)")
+        return None
+    if args.source:
+        sources = [
+            SourceMapping(name, path, {col: target for map_name, col, target in args.map if map_name == name})
+            for name, path in args.source
+        ]
+        try:
+            final_output = reconcile_sources(
+                sources, args.dt_file, policy, args.threshold, cache, args.top_k, keys_named(args.id_keys), rules,
+                resolved,
+            )
+        except ValueError as e:
+            build_parser().error(str(e))
+    elif previous_journal is not None:
+        try:
+            final_output, delta_plan = delta.reconcile_delta(
+                args.qb_file, args.dt_file, previous_journal, policy, args.threshold, journal, args.top_k,
+                keys_named(args.id_keys), rules, resolved,
+            )
+        except ValueError as e:
+            build_parser().error(str(e))
+        summary = delta_plan.summary()
+        for source in ("qb", "dt"):
+            print(f"{source}: {summary[source]['new']} nouveaux, {summary[source]['changed']} modifiés, "
+                  f"{summary[source]['deleted']} supprimés")
+        print(f"{summary['replayed']} décisions précédentes réappliquées")
+    else:
+        final_output = reconcile(
+            args.qb_file, args.dt_file, policy, args.threshold, cache, journal, args.top_k, keys_named(args.id_keys),
+            rules, resolved,
+        )
+    for rule, count in resolved.items():
+        print(f"{rule}: {count} résolus automatiquement")
+
+    export(final_output, args.output)
+    if args.journal:
+        journal.save(args.journal)
+    print(f"{len(final_output)} lignes écrites dans {args.output} ({time.perf_counter() - start:.1f} s)")
+    return final_output
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""Near-duplicate clusters.
+
+The fuzzy matcher gives pairs; when A~B, B~C and A~C all score above the
+threshold they are one product entered three ways, and reviewing them as
+three pairs means three decisions that each only see part of the group. The
+pairs are reduced here to the connected components of their graph
+(union-find), each reviewed and merged once.
+"""
+
+
+class UnionFind:
+    """Disjoint sets over hashable items, with path halving and union by size."""
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, item):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+            return item
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, item1, item2):
+        root1, root2 = self.find(item1), self.find(item2)
+        if root1 == root2:
+            return
+        if self.size[root1] < self.size[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.size[root1] += self.size[root2]
+
+
+def cluster_pairs(scored_pairs, order=None):
+    """Group (sku1, sku2, score) pairs into clusters of SKUs.
+
+    Returns tuples of SKUs, members in `order` (a {sku: position} dict, first
+    seen otherwise). Largest clusters come first, then the most cohesive: the
+    mean score over all member pairs, a pair below the threshold counting 0,
+    so a tight triangle ranks above a loose chain of the same size.
+    """
+    uf = UnionFind()
+    seen = {}
+    for sku1, sku2, _ in scored_pairs:
+        for sku in (sku1, sku2):
+            seen.setdefault(sku, len(seen))
+        uf.union(sku1, sku2)
+    order = order or seen
+
+    members, score_sums = {}, {}
+    for sku in seen:
+        members.setdefault(uf.find(sku), []).append(sku)
+    for sku1, _, score in scored_pairs:
+        root = uf.find(sku1)
+        score_sums[root] = score_sums.get(root, 0.0) + score
+
+    clusters = []
+    for root, skus in members.items():
+        skus.sort(key=order.get)
+        n = len(skus)
+        cohesion = score_sums[root] / (n * (n - 1) / 2)
+        clusters.append((tuple(skus), cohesion))
+    clusters.sort(key=lambda cluster: (-len(cluster[0]), -cluster[1], order[cluster[0][0]]))
+    return [skus for skus, _ in clusters]
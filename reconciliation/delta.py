@@ -0,0 +1,256 @@
+"""Incremental (delta) reconciliation against the previous run.
+
+The previous run's `DecisionJournal` holds a fingerprint of every input row and
+every decision taken. Against the current files this gives, per source, the
+new, changed and deleted SKUs. Decisions on SKUs that still exist are replayed,
+and only pairs involving a new SKU are fuzzy-matched, against the rest of the
+catalog. Scores only depend on the SKU strings, so a changed quantity or
+description does not need new matching.
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from reconciliation import engine
+from reconciliation.clustering import cluster_pairs
+from reconciliation.dtypes import isin
+from reconciliation.journal import fingerprints
+from reconciliation.matching import cross_fuzzy_match, fuzzy_match_scores, top_k_pairs
+from reconciliation.normalization import normalize_skus
+from reconciliation.profiling import profiled
+from reconciliation.review import PendingDecisions
+from reconciliation.rules import AutoRules, resolve_cleanup, resolve_cross_matches
+
+
+@dataclass
+class SourceDelta:
+    """Raw SKUs of one source compared with the previous run."""
+
+    new: set = field(default_factory=set)
+    changed: set = field(default_factory=set)
+    deleted: set = field(default_factory=set)
+
+
+@dataclass
+class DeltaPlan:
+    qb: SourceDelta
+    dt: SourceDelta
+    replayed: list = field(default_factory=list)  # previous decisions applied again
+
+    def summary(self):
+        return {
+            source: {"new": len(delta.new), "changed": len(delta.changed), "deleted": len(delta.deleted)}
+            for source, delta in (("qb", self.qb), ("dt", self.dt))
+        } | {"replayed": len(self.replayed)}
+
+
+def diff_source(previous, df):
+    """Compare the rows of `df` with the fingerprints of the previous run."""
+    current = fingerprints(df)
+    return SourceDelta(
+        new={sku for sku in current if sku not in previous},
+        changed={sku for sku, digest in current.items() if sku in previous and previous[sku] != digest},
+        deleted={sku for sku in previous if sku not in current},
+    )
+
+
+@profiled("delta_plan")
+def plan(journal, df_qb, df_dt, threshold):
+    """Work out what changed since the run recorded in `journal`."""
+    if journal.threshold != threshold:
+        raise ValueError(f"Delta mode needs the previous run's threshold ({journal.threshold}), got {threshold}")
+    return DeltaPlan(diff_source(journal.snapshots["qb"], df_qb), diff_source(journal.snapshots["dt"], df_dt))
+
+
+# ------------------------- STEP 1 -------------------------
+@profiled("replay_cleanup")
+def replay_cleanup(journal, source, df, qty_col, delta_plan, threshold):
+    """Apply the previous step 1 decisions still valid for `source`.
+
+    A duplicate decision stands while its group is the one decided: none of
+    its rows new, changed or deleted. Returns the cleaned frame, the decided
+    duplicate groups and the near-duplicate clusters left to review.
+    """
+    source_delta = getattr(delta_plan, source)
+    new_skus = source_delta.new
+    touched = new_skus | source_delta.changed
+    deleted_norms = set(normalize_skus(pd.Series(sorted(source_delta.deleted), dtype=object)))
+    pending = PendingDecisions(df, qty_col)
+    decided_groups, previous_clusters = set(), {}
+    for decision in journal.decisions:
+        if decision.get("source") != source:
+            continue
+        if decision["stage"] == "duplicates":
+            group = pending.rows(decision["sku_norm"])["SKU"]
+            if group.empty or isin(group, touched).any() or decision["sku_norm"] in deleted_norms:
+                continue
+            if decision["action"] == "merge":
+                pending.merge_duplicate(decision["sku_norm"], decision["selected_sku"])
+            elif decision["action"] == "delete":
+                pending.delete_duplicate(decision["sku_norm"])
+            decided_groups.add(decision["sku_norm"])
+            delta_plan.replayed.append(decision)
+        elif decision["stage"] == "fuzzy_duplicates":
+            previous_clusters[tuple(decision["skus"])] = decision
+
+    # A previous decision stands if its cluster is still exactly a cluster
+    clusters = fuzzy_clusters(df, new_skus, threshold, previous_clusters)
+    by_members = {frozenset(skus): decision for skus, decision in previous_clusters.items()}
+    new_norms = set(df.loc[isin(df["SKU"], new_skus), "SKU_NORM"])
+    to_review = []
+    for cluster in clusters:
+        decision = by_members.get(frozenset(cluster))
+        if decision is None or new_norms.intersection(cluster):
+            to_review.append(cluster)
+            continue
+        if decision["action"] == "merge":
+            pending.merge_fuzzy_cluster(cluster, decision.get("selected_sku"))
+        delta_plan.replayed.append(decision)
+    return pending.apply(), decided_groups, to_review
+
+
+def pending_duplicates(df, decided_groups):
+    """Duplicate groups with no replayed decision."""
+    return [sku_norm for sku_norm in engine.duplicate_queue(df) if sku_norm not in decided_groups]
+
+
+@profiled("fuzzy_duplicates")
+def fuzzy_clusters(df, new_skus, threshold, previous_clusters=()):
+    """The near-duplicate clusters of `df`, in the same order as a full run.
+
+    Pairs between known SKUs all lie inside a previous cluster, so only those
+    small clusters are rescored, plus the pairs involving a new SKU. As in a
+    full run, structural variants are grouped by signature and only the first
+    of each group is scored.
+    """
+    all_norms = df["SKU_NORM"].unique()
+    position = {sku: i for i, sku in enumerate(all_norms)}
+    variants, grouped = engine.structural_variants(df, position)
+    new_norms = set(df.loc[isin(df["SKU"], new_skus), "SKU_NORM"])
+    fresh = [sku for sku in all_norms if sku in new_norms and sku not in grouped]
+    known = [sku for sku in all_norms if sku not in new_norms and sku not in grouped]
+
+    scored = fuzzy_match_scores(fresh, threshold) + cross_fuzzy_match(fresh, known, threshold)
+    for skus in previous_clusters:
+        members = sorted(
+            (sku for sku in set(skus) if sku in position and sku not in new_norms and sku not in grouped), key=position.get
+        )
+        scored += fuzzy_match_scores(members, threshold)
+    return cluster_pairs(variants + [pair for pair in scored if pair[2] > threshold], position)
+
+
+# ------------------------- STEP 2 -------------------------
+@profiled("replay_cross_matches")
+def replay_cross_matches(journal, df_qb, df_dt, delta_plan):
+    """Replay the previous step 2 decisions. Returns (fuzzy_selected, decided pairs)."""
+    qb_skus, dt_skus = set(df_qb["SKU"]), set(df_dt["SKU"])
+    fuzzy_selected, decided = [], set()
+    for decision in journal.decisions:
+        if decision["stage"] != "cross_matches":
+            continue
+        qb_sku, dt_sku = decision["qb_sku"], decision["dt_sku"]
+        if qb_sku not in qb_skus or dt_sku not in dt_skus:
+            continue
+        if decision["action"] == "merge":
+            fuzzy_selected.append({"QuickBooks SKU": qb_sku, "D-Tools SKU": dt_sku, "Similitude": decision.get("score")})
+        decided.add((qb_sku, dt_sku))
+        delta_plan.replayed.append(decision)
+    return fuzzy_selected, decided
+
+
+@profiled("cross_matches")
+def new_cross_matches(mismatched_qb, mismatched_dt, threshold, delta_plan, decided=(), top_k=None):
+    """Step 2 queue restricted to pairs with a new QuickBooks or D-Tools SKU, best first.
+
+    `top_k` ranks a SKU's candidates among these new pairs only.
+    """
+    qb_skus = mismatched_qb["SKU"].dropna()
+    dt_skus = mismatched_dt["SKU"].dropna()
+    new_qb = qb_skus[isin(qb_skus, delta_plan.qb.new)]
+    new_dt = dt_skus[isin(dt_skus, delta_plan.dt.new)]
+
+    pairs = cross_fuzzy_match(new_qb, dt_skus, threshold)
+    pairs += cross_fuzzy_match(qb_skus[~isin(qb_skus, delta_plan.qb.new)], new_dt, threshold)
+    pairs.sort(key=lambda pair: -pair[2])
+    if top_k is not None:
+        pairs = top_k_pairs(pairs, top_k)
+    return [
+        {"QuickBooks SKU": qb_sku, "D-Tools SKU": dt_sku, "Similitude": round(score * 100, 2)}
+        for qb_sku, dt_sku, score in pairs
+        if (qb_sku, dt_sku) not in decided
+    ]
+
+
+# ------------------------- REPORT -------------------------
+def compare_with_previous(previous_final, final_output):
+    """SKUs added to, removed from, or with a new quantity in the final inventory."""
+    qty = engine.DT_QTY_COL
+    previous = previous_final.drop_duplicates("SKU").set_index("SKU")[qty]
+    current = final_output.drop_duplicates("SKU").set_index("SKU")[qty]
+    previous_num = pd.to_numeric(previous, errors="coerce")
+    current_num = pd.to_numeric(current, errors="coerce")
+
+    both = previous.index.intersection(current.index)
+    moved = both[~(previous_num[both].fillna(0) == current_num[both].fillna(0))]
+    rows = [
+        *({"SKU": sku, "Changement": "Ajouté", "Avant": None, "Après": current[sku]} for sku in current.index.difference(previous.index)),
+        *({"SKU": sku, "Changement": "Retiré", "Avant": previous[sku], "Après": None} for sku in previous.index.difference(current.index)),
+        *({"SKU": sku, "Changement": "Quantité", "Avant": previous[sku], "Après": current[sku]} for sku in moved),
+    ]
+    return pd.DataFrame(rows, columns=["SKU", "Changement", "Avant", "Après"])
+
+
+# ------------------------- BATCH RUN -------------------------
+@profiled("reconcile")
+def reconcile_delta(
+    qb_source, dt_source, previous_journal, policy=None, threshold=0.95, journal=None, top_k=None,
+    identifier_keys=engine.IDENTIFIER_KEYS, rules=None, resolved=None,
+):
+    """Batch run that replays `previous_journal` and only decides on what changed.
+
+    Identifier matches are not decisions: they are found again on the
+    residuals left by the replayed merges. The `AutoRules` only see what is
+    left to decide, see `engine.reconcile`. Returns the final inventory and
+    the `DeltaPlan`.
+    """
+    policy = policy or engine.DecisionPolicy()
+    rules = rules or AutoRules()
+    resolved = Counter() if resolved is None else resolved
+    if journal is not None:
+        journal.threshold = threshold
+
+    df_qb, df_dt = engine.load_sources(qb_source, dt_source, journal)
+    delta_plan = plan(previous_journal, df_qb, df_dt, threshold)
+
+    cleaned = {}
+    for source, df, qty_col in (("qb", df_qb, engine.QB_QTY_COL), ("dt", df_dt, engine.DT_QTY_COL)):
+        df, decided_groups, clusters = replay_cleanup(previous_journal, source, df, qty_col, delta_plan, threshold)
+        df, queue, clusters = resolve_cleanup(
+            df, source, qty_col, pending_duplicates(df, decided_groups), clusters, rules, resolved, journal
+        )
+        if policy.fuzzy_duplicates != "merge" and not rules.merge_variants:
+            clusters = []  # As in a full run, which then does not compute them
+        cleaned[source] = engine.apply_cleanup_policy(df, source, qty_col, policy, queue, clusters, journal)
+    df_qb, df_dt = cleaned["qb"], cleaned["dt"]
+
+    fuzzy_selected, decided = replay_cross_matches(previous_journal, df_qb, df_dt, delta_plan)
+    _, mismatched_qb, mismatched_dt = engine.split_matches(df_qb, df_dt, fuzzy_selected)
+    paired = engine.identifier_matches(
+        mismatched_qb, mismatched_dt, *engine.load_identifiers(qb_source, dt_source), identifier_keys
+    )
+    mismatched_qb, mismatched_dt = engine.drop_paired(mismatched_qb, mismatched_dt, paired)
+    dt_full = engine.load_inventory(dt_source)
+    queue = []
+    if policy.cross_matches == "merge" or rules.cross:
+        queue = new_cross_matches(mismatched_qb, mismatched_dt, threshold, delta_plan, decided, top_k)
+    auto_selected, queue = resolve_cross_matches(queue, df_qb, df_dt, rules, resolved, journal, dt_full)
+    new_selected = auto_selected + engine.apply_cross_policy(queue, policy, journal, fuzzy_selected + paired + auto_selected)
+
+    if journal is not None:
+        # Carry the replayed decisions over so the next run can replay them too
+        journal.decisions[:0] = delta_plan.replayed
+    final_output = engine.build_final_output(
+        df_qb, df_dt, paired + fuzzy_selected + new_selected, dt_full
+    )
+    return final_output, delta_plan
@@ -0,0 +1,92 @@
+"""Compact dtypes for the frames kept in a session.
+
+Exports are read as text. Held as object columns, every cell is a Python
+string (~50 bytes of overhead each) and every copy duplicates the pointers.
+Working frames use instead:
+
+* Arrow-backed strings with NaN for missing values (`string[pyarrow_numpy]`,
+  pandas 3's default): one buffer per column, and the same comparisons,
+  `isin`, hashes and NaN handling as object strings;
+  pandas 2.2 converts an `isin` value set to Python strings one by one
+  (~12 us each), so lookups against another column go through `isin` here;
+* numbers for a quantity column when every value reads back as the same text
+  (`"12"` -> 12, `"0.6"` -> 0.6), so fingerprints and exports are unchanged;
+  otherwise object text, which merges can still write their summed numbers to.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+TEXT_DTYPE = pd.StringDtype("pyarrow_numpy")
+
+
+def compact_text(df):
+    """`df` with its text columns as Arrow strings (the same frame when already)."""
+    text = [col for col in df.columns if df[col].dtype == object]
+    if not text:
+        return df
+    return df.astype(dict.fromkeys(text, TEXT_DTYPE))
+
+
+def isin(values, others):
+    """`values.isin(others)`, in Arrow for Arrow strings (missing values match each other, as in pandas)."""
+    if values.dtype != TEXT_DTYPE:
+        return values.isin(others)
+    if getattr(others, "dtype", None) != TEXT_DTYPE:
+        others = pd.Series(list(others), dtype=object).astype(TEXT_DTYPE)
+    found = pc.is_in(pa.array(values), value_set=pa.array(others))
+    return pd.Series(found.to_numpy(zero_copy_only=False), index=values.index)
+
+
+def quantity_text(values):
+    """Text of numeric quantities, as written in the export they came from ("12", "0.6"), NaN if missing."""
+    numbers = values.astype("Float64")
+    known = numbers.notna().to_numpy()
+    text = np.full(len(values), np.nan, dtype=object)
+    text[known] = [
+        str(int(x)) if math.isfinite(x) and x.is_integer() else repr(x)
+        for x in numbers[known].to_numpy(dtype=np.float64).tolist()
+    ]
+    return pd.Series(text, index=values.index, dtype=TEXT_DTYPE)
+
+
+def numeric_quantity(values):
+    """Quantity column as Int64/Float64 when the conversion is lossless, else as object."""
+    if pd.api.types.is_numeric_dtype(values):
+        return values
+    numbers = pd.to_numeric(values, errors="coerce")
+    if numbers.notna().sum() != values.notna().sum():
+        return values.astype(object)
+    numbers = numbers.astype("Int64" if (numbers.dropna() % 1 == 0).all() else "Float64")
+    if not quantity_text(numbers).fillna("").equals(values.astype(TEXT_DTYPE).fillna("")):
+        return values.astype(object)
+    return numbers
+
+
+def _plain(value):
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        value = float(value)
+        if math.isnan(value):
+            return None
+        return int(value) if value.is_integer() else value
+    return None if value is pd.NA else value
+
+
+def plain_quantities(values):
+    """Quantities as Python values for export: whole numbers as int (12, not 12.0), missing as None."""
+    return pd.Series([_plain(value) for value in values.tolist()], index=values.index, dtype=object)
+
+
+def compact(df, qty_cols):
+    """Working frame in compact dtypes: Arrow strings, numeric `qty_cols` when lossless."""
+    df = compact_text(df)
+    numeric = {col: numeric_quantity(df[col]) for col in qty_cols if col in df.columns}
+    return df.assign(**numeric) if numeric else df
+
+
+def as_text(df):
+    """Every column as text (quantities back to their original text), for hashing."""
+    return df.apply(lambda col: quantity_text(col) if pd.api.types.is_numeric_dtype(col) else col.astype(TEXT_DTYPE))
@@ -0,0 +1,523 @@
+"""Headless reconciliation pipeline.
+
+load -> normalize -> dedupe -> match -> merge -> export, as plain functions on
+DataFrames. The Streamlit app takes the review decisions one at a time and
+applies them per stage through `review.PendingDecisions`; `reconcile` runs the
+whole pipeline with a `DecisionPolicy` instead of a reviewer.
+"""
+import hashlib
+import io
+from collections import Counter
+from dataclasses import dataclass
+
+import pandas as pd
+import xlsxwriter
+
+from reconciliation.clustering import cluster_pairs
+from reconciliation.dtypes import compact, isin, plain_quantities
+from reconciliation.identifiers import DT_IDENTIFIER_COLUMNS, IDENTIFIER_KEYS, QB_IDENTIFIER_COLUMNS, identifier_pairs
+from reconciliation.ingest import read_inventory
+from reconciliation.matching import cross_fuzzy_match, fuzzy_match_scores, top_k_pairs
+from reconciliation.normalization import DEFAULT_RULES, SIGNATURE_RULES, brand_signatures, normalize_skus
+from reconciliation.profiling import profiled
+from reconciliation.review import PendingDecisions
+from reconciliation.rules import AutoRules, resolve_cleanup, resolve_cross_matches
+from reconciliation.similarity_cache import content_hash
+
+QB_QTY_COL = "Quantité en stock"
+DT_QTY_COL = "Quantity on Hand"
+
+# Columns the review steps work on; the others are only read back for export
+QB_COLUMNS = ["SKU", "Description de la vente", QB_QTY_COL]
+DT_COLUMNS = ["Brand", "SKU", "Short Description", DT_QTY_COL]
+
+DUPLICATE_ACTIONS = ("keep", "merge", "delete")
+FUZZY_DUPLICATE_ACTIONS = ("skip", "merge")
+CROSS_MATCH_ACTIONS = ("keep", "merge", "ignore")
+
+
+@dataclass
+class DecisionPolicy:
+    """Answers given, for every queue entry, in place of the reviewer."""
+
+    duplicates: str = "keep"        # exact SKU_NORM duplicates (step 1)
+    fuzzy_duplicates: str = "skip"  # near-duplicates inside one file (step 1)
+    cross_matches: str = "keep"     # QuickBooks vs D-Tools near matches (step 2)
+
+    def __post_init__(self):
+        for name, allowed in (
+            ("duplicates", DUPLICATE_ACTIONS),
+            ("fuzzy_duplicates", FUZZY_DUPLICATE_ACTIONS),
+            ("cross_matches", CROSS_MATCH_ACTIONS),
+        ):
+            if getattr(self, name) not in allowed:
+                raise ValueError(f"{name} must be one of {allowed}, got {getattr(self, name)!r}")
+
+
+# ------------------------- LOAD & NORMALIZE -------------------------
+@profiled("load")
+def load_inventory(source, columns=None):
+    """Read a QuickBooks/D-Tools export (path or uploaded file) as text, optionally only `columns`."""
+    return read_inventory(source, columns)
+
+
+@profiled("restore_columns")
+def restore_columns(df, df_full):
+    """Put back the columns of `df_full` on the rows kept in `df`, keeping the edits made to `df`."""
+    if df_full is None:
+        return df
+    restored = df_full.loc[df.index].copy()
+    for col in df.columns:
+        restored[col] = df[col]
+    return restored
+
+
+def source_hash(source):
+    """Content hash of a path or uploaded file, used to key the similarity cache."""
+    if hasattr(source, "getvalue"):
+        return content_hash(source.getvalue())
+    with open(source, "rb") as f:
+        return content_hash(f.read())
+
+
+@profiled("normalize")
+def add_normalized_sku(df, rules=DEFAULT_RULES):
+    """Return a copy of the inventory with its `SKU_NORM` column."""
+    df = df.copy()
+    df["SKU_NORM"] = normalize_skus(df["SKU"], rules)
+    return df
+
+
+def load_identifiers(qb_source, dt_source):
+    """Identifier columns of both exports missing from the working frames, on the same row labels."""
+    return load_inventory(qb_source, QB_IDENTIFIER_COLUMNS), load_inventory(dt_source, DT_IDENTIFIER_COLUMNS)
+
+
+def working_frame(df):
+    """A loaded inventory as the review works on it: `SKU_NORM` added, compact dtypes (see `dtypes`)."""
+    return compact(add_normalized_sku(df), (QB_QTY_COL, DT_QTY_COL))
+
+
+# ------------------------- STEP 1: DEDUPE ONE FILE -------------------------
+@profiled("duplicate_queue")
+def duplicate_queue(df):
+    """`SKU_NORM` values shared by more than one row, in file order."""
+    return df["SKU_NORM"][df.duplicated("SKU_NORM", keep=False)].unique().tolist()
+
+
+def structural_variants(df, position, rules=SIGNATURE_RULES):
+    """`SKU_NORM` values sharing a brand and a canonical signature: (pairs, values left out of the fuzzy scoring).
+
+    One hash grouping, no scoring: each group is linked to its first member
+    (in `position` order) by a (first, other, 1.0) pair, and only that first
+    member needs comparing with the rest. Two brands only share a group when
+    one of its rows had its brand prefix stripped (CDN-6246010L of brand CDN
+    next to 6246010L of another brand); the same part number under two
+    brands is left to the scoring. `rules=None` finds no variants.
+    """
+    if rules is None:
+        return [], set()
+    brands = df["Brand"] if "Brand" in df.columns else pd.Series("", index=df.index, dtype=object)
+    variants = brand_signatures(df["SKU_NORM"], brands, rules)
+    variants.insert(0, "sku", df["SKU_NORM"].to_numpy())
+    # A stripped row links every brand of its signature
+    variants.loc[variants.groupby("signature")["stripped"].transform("any"), "brand"] = ""
+    variants = variants.drop_duplicates(["sku", "brand", "signature"])
+    variants = variants[variants.duplicated(["brand", "signature"], keep=False)]
+    pairs = []
+    for _, skus in variants.groupby(["brand", "signature"], sort=False)["sku"]:
+        first, *others = sorted(set(skus), key=position.get)
+        pairs += [(first, sku, 1.0) for sku in others]
+    # A value with rows of two brands can link two groups: one first member per connected group
+    return pairs, {sku for cluster in cluster_pairs(pairs, position) for sku in cluster[1:]}
+
+
+@profiled("fuzzy_duplicates")
+def fuzzy_duplicates(df, threshold, cache=None, key=None, job=None, signature_rules=SIGNATURE_RULES):
+    """Clusters of `SKU_NORM` values linked by scores above the threshold or by their signature, biggest first.
+
+    Structural variants (see `structural_variants`) are grouped before the
+    scoring, which only sees the first of each group. `job` (a
+    `parallel.Job`) chunks the scoring, reports progress and can cancel it.
+    """
+    skus = df["SKU_NORM"].unique()
+    position = {sku: i for i, sku in enumerate(skus)}
+    variants, grouped = structural_variants(df, position, signature_rules)
+    scored_skus = [sku for sku in skus if sku not in grouped]
+    if cache is not None:
+        pairs = cache.self_pairs(key, scored_skus, job)
+    else:
+        pairs = fuzzy_match_scores(scored_skus, threshold, job=job)
+    return cluster_pairs(variants + [pair for pair in pairs if pair[2] > threshold], position)
+
+
+@profiled("prepare_source")
+def prepare_source(source, columns, job=None):
+    """Step 1 inputs of one inventory: (working frame, duplicate queue).
+
+    Sources are independent up to here, so the app prepares both at once.
+    The near-duplicate search is left to `fuzzy_duplicates`.
+    """
+    if job is not None:
+        job.start("load")
+    df = working_frame(load_inventory(source, columns))
+    if job is not None:
+        job.start("duplicates")
+    return df, duplicate_queue(df)
+
+
+def _quantity(df, qty_col):
+    return pd.to_numeric(df[qty_col], errors="coerce")
+
+
+def merge_duplicate(df, sku_norm, selected_sku, qty_col):
+    """Collapse a duplicate group into one row named `selected_sku` holding the summed quantity."""
+    group = df.index[df["SKU_NORM"] == sku_norm]
+    if len(group) == 0:
+        return df
+    total = _quantity(df.loc[group], qty_col).sum() if qty_col in df.columns else None
+    df = df.drop(index=group[1:])
+    df.loc[group[0], "SKU"] = selected_sku
+    if total is not None:
+        df.loc[group[0], qty_col] = total
+    return df
+
+
+def delete_duplicate(df, sku_norm):
+    """Drop every row of a duplicate group."""
+    return df[df["SKU_NORM"] != sku_norm]
+
+
+def merge_fuzzy_cluster(df, sku_norms, selected_sku, qty_col):
+    """Collapse a near-duplicate cluster into one row named `selected_sku` holding the summed quantity.
+
+    The row kept is the first one already named `selected_sku`, else the first
+    row of the cluster. `selected_sku=None` keeps that first row's SKU.
+    """
+    rows = df.index[isin(df["SKU_NORM"], sku_norms)]
+    if len(rows) == 0:
+        return df
+    if selected_sku is None:
+        selected_sku = df.loc[rows[0], "SKU"]
+    named = rows[df.loc[rows, "SKU"].to_numpy() == selected_sku]
+    keep = named[0] if len(named) else rows[0]
+    total = _quantity(df.loc[rows], qty_col).sum() if qty_col in df.columns else None
+    df = df.drop(index=rows.drop(keep))
+    df.loc[keep, "SKU"] = selected_sku
+    if total is not None:
+        df.loc[keep, qty_col] = total
+    return df
+
+
+# ------------------------- STEP 2: MATCH BOTH FILES -------------------------
+@profiled("split_matches")
+def split_matches(df_qb, df_dt, fuzzy_selected=()):
+    """Return (exact_matches, mismatched_qb, mismatched_dt) on the raw `SKU`.
+
+    SKUs already paired in `fuzzy_selected` are no longer mismatched.
+    """
+    in_dt = isin(df_qb["SKU"], df_dt["SKU"])
+    exact_matches = df_qb[in_dt].assign(**{"Match Type": "Exact"})
+    mismatched_qb = df_qb[~in_dt]
+    mismatched_dt = df_dt[~isin(df_dt["SKU"], df_qb["SKU"])]
+    # Selections are new frames, never written to: no copies
+    return (exact_matches, *drop_paired(mismatched_qb, mismatched_dt, fuzzy_selected))
+
+
+def drop_paired(mismatched_qb, mismatched_dt, fuzzy_selected):
+    """The mismatched rows without the SKUs paired in `fuzzy_selected`.
+
+    Applied to the previous residuals with only the pairs merged since, it
+    gives the same frames as `split_matches` with all of them.
+    """
+    if not fuzzy_selected:
+        return mismatched_qb, mismatched_dt
+    paired_qb = [fuzzy_match["QuickBooks SKU"] for fuzzy_match in fuzzy_selected]
+    paired_dt = [fuzzy_match["D-Tools SKU"] for fuzzy_match in fuzzy_selected]
+    return mismatched_qb[~isin(mismatched_qb["SKU"], paired_qb)], mismatched_dt[~isin(mismatched_dt["SKU"], paired_dt)]
+
+
+@profiled("identifier_matches")
+def identifier_matches(mismatched_qb, mismatched_dt, qb_ids=None, dt_ids=None, keys=IDENTIFIER_KEYS, dt_values=None):
+    """Pairs of mismatched SKUs sharing a part number or barcode (see `identifiers`), in `keys` order.
+
+    Same form as the reviewed step 2 pairs (100% similar, plus the key that
+    joined them): they are merged without review, and the fuzzy matching
+    only runs on the residuals once `drop_paired` removed them.
+    """
+    return [
+        {"QuickBooks SKU": qb_sku, "D-Tools SKU": dt_sku, "Similitude": 100.0, "Identifiant": key}
+        for qb_sku, dt_sku, key in identifier_pairs(mismatched_qb, mismatched_dt, qb_ids, dt_ids, keys, dt_values)
+    ]
+
+
+@profiled("cross_matches")
+def cross_matches(mismatched_qb, mismatched_dt, threshold, cache=None, key=None, job=None, top_k=None):
+    """Step 2 review queue: near matches between the two residuals, best first.
+
+    With `top_k`, only the pairs among the `top_k` best of both their SKUs
+    (1: mutual best matches, at most one pair per SKU).
+    """
+    qb_skus = mismatched_qb["SKU"].dropna()
+    dt_skus = mismatched_dt["SKU"].dropna()
+    if cache is not None:
+        # The cache keeps every pair above its floor, for any threshold and top_k
+        pairs = [pair for pair in cache.cross_pairs(key, qb_skus, dt_skus, job) if pair[2] > threshold]
+        if top_k is not None:
+            pairs = top_k_pairs(pairs, top_k)
+    else:
+        pairs = cross_fuzzy_match(qb_skus, dt_skus, threshold, job=job, top_k=top_k)
+    return [
+        {"QuickBooks SKU": qb_sku, "D-Tools SKU": dt_sku, "Similitude": round(score * 100, 2)}
+        for qb_sku, dt_sku, score in pairs
+    ]
+
+
+# ------------------------- STEP 3: FINALIZE & EXPORT -------------------------
+def quantity_map(df_qb, fuzzy_selected=()):
+    """QuickBooks quantity for each D-Tools SKU, as a Series with a unique SKU index.
+
+    Precedence, first hit wins:
+      1. the QuickBooks row with the same SKU (exact match); QuickBooks rows
+         sharing a SKU count once, with their summed quantity;
+      2. the QuickBooks SKU paired with it in step 2 (identifier matches, then
+         the merges reviewed), in order, each SKU of either file paired at
+         most once.
+    D-Tools SKUs absent from the map keep their own quantity.
+    """
+    if QB_QTY_COL not in df_qb.columns:
+        return pd.Series(dtype=object)
+    shared = df_qb["SKU"].duplicated(keep=False)
+    single = df_qb.loc[~shared].set_index("SKU")[QB_QTY_COL].astype(object)
+    summed = _quantity(df_qb[shared], QB_QTY_COL).groupby(df_qb.loc[shared, "SKU"], sort=False).sum(min_count=1)
+    by_sku = pd.concat([single, summed.astype(object)])
+
+    paired = {}
+    paired_qb = set()
+    for fuzzy_match in fuzzy_selected:
+        qb_sku, dt_sku = fuzzy_match["QuickBooks SKU"], fuzzy_match["D-Tools SKU"]
+        if dt_sku in by_sku.index or dt_sku in paired or qb_sku in paired_qb or qb_sku not in by_sku.index:
+            continue
+        paired[dt_sku] = qb_sku
+        paired_qb.add(qb_sku)
+    from_pairs = pd.Series(
+        by_sku.reindex(list(paired.values())).to_numpy(), index=pd.Index(list(paired), dtype=by_sku.index.dtype), dtype=object
+    )
+    return pd.concat([by_sku, from_pairs])
+
+
+@profiled("merge")
+def build_final_output(df_qb, df_dt, fuzzy_selected, df_dt_full=None):
+    """D-Tools template filled with the QuickBooks quantities (see `quantity_map`).
+
+    One output row per D-Tools row: quantities are looked up in a unique SKU
+    index, never joined, so no SKU can multiply rows. `df_dt_full` is the
+    complete D-Tools file when `df_dt` only holds the working columns.
+    """
+    # ✅ Start with the D-Tools dataset to preserve template (restore_columns already copies it)
+    final_output = restore_columns(df_dt, df_dt_full) if df_dt_full is not None else df_dt.copy()
+
+    # ✅ QuickBooks quantity where there is one, D-Tools quantity otherwise
+    qb_quantity = final_output["SKU"].map(quantity_map(df_qb, fuzzy_selected))
+    if DT_QTY_COL in final_output.columns:
+        final_output[DT_QTY_COL] = plain_quantities(qb_quantity.combine_first(final_output[DT_QTY_COL].astype(object)))
+    else:
+        final_output[DT_QTY_COL] = plain_quantities(qb_quantity)
+
+    # ✅ D-Tools column order, without Unnamed columns
+    return final_output.loc[:, ~final_output.columns.str.contains("^Unnamed")]
+
+
+EXPORT_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+EXCEL_CHUNK_ROWS = 10_000
+
+
+@profiled("frame_hash")
+def frame_hash(*frames):
+    """Content hash of DataFrames (values, index and column names), to memoize exports on."""
+    digest = hashlib.sha256()
+    for df in frames:
+        digest.update(repr(list(df.columns)).encode("utf-8"))
+        digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def write_excel(final_output, target):
+    """Stream the final inventory to an .xlsx path or binary file object.
+
+    xlsxwriter's constant-memory mode flushes each row to a temporary file as
+    soon as it is written, so no cell objects pile up; rows are converted from
+    the frame a chunk at a time. Same cells as `DataFrame.to_excel`: bold
+    bordered header, missing values left blank, URLs as plain text (xlsxwriter
+    would make them hyperlinks, and stops at Excel's 65,530 per sheet).
+    """
+    chunks = (final_output.iloc[start:start + EXCEL_CHUNK_ROWS] for start in range(0, len(final_output), EXCEL_CHUNK_ROWS))
+    write_excel_chunks(final_output.columns, chunks, target)
+
+
+def write_excel_chunks(columns, chunks, target):
+    """`write_excel` for a final inventory given as successive frames with these `columns`."""
+    workbook = xlsxwriter.Workbook(target, {"constant_memory": True, "strings_to_urls": False})
+    worksheet = workbook.add_worksheet("Final Inventory")
+    header = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+    worksheet.write_row(0, 0, [str(col) for col in columns], header)
+    start = 0
+    for chunk in chunks:
+        values = chunk.astype(object).where(chunk.notna(), None).to_numpy()
+        for offset, row in enumerate(values, start=start + 1):
+            worksheet.write_row(offset, 0, row)
+        start += len(chunk)
+    workbook.close()
+
+
+def _parquet_frame(final_output):
+    """Text columns as strings; the quantity as a number when every value is one."""
+    df = final_output.copy()
+    for col in df.columns:
+        if col == DT_QTY_COL:
+            qty = pd.to_numeric(df[col], errors="coerce")
+            if qty.notna().sum() == df[col].notna().sum():
+                df[col] = qty
+                continue
+        df[col] = df[col].astype("string")
+    return df
+
+
+@profiled("export")
+def export_bytes(final_output, fmt="xlsx"):
+    """Serialize the final inventory as `xlsx`, `;`-separated `csv` or `parquet` bytes."""
+    output = io.BytesIO()
+    if fmt == "xlsx":
+        write_excel(final_output, output)
+    elif fmt == "csv":
+        final_output.to_csv(output, index=False, sep=";", encoding="utf-8")
+    elif fmt == "parquet":
+        _parquet_frame(final_output).to_parquet(output, index=False)
+    else:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {tuple(EXPORT_FORMATS)}")
+    return output.getvalue()
+
+
+@profiled("export")
+def export(final_output, path):
+    """Write the final inventory to .xlsx, `;`-separated .csv or .parquet, from the path's extension."""
+    if path.endswith(".csv"):
+        final_output.to_csv(path, index=False, sep=";")
+    elif path.endswith(".parquet"):
+        _parquet_frame(final_output).to_parquet(path, index=False)
+    else:
+        write_excel(final_output, path)
+
+
+# ------------------------- BATCH RUN -------------------------
+def load_sources(qb_source, dt_source, journal=None):
+    """Working frames of both inventories, fingerprinted into `journal` when given."""
+    df_qb = working_frame(load_inventory(qb_source, QB_COLUMNS))
+    df_dt = working_frame(load_inventory(dt_source, DT_COLUMNS))
+    if journal is not None:
+        journal.take_snapshot("qb", df_qb)
+        journal.take_snapshot("dt", df_dt)
+    return df_qb, df_dt
+
+
+@profiled("cleanup_policy")
+def apply_cleanup_policy(df, source, qty_col, policy, queue, fuzzy_clusters, journal=None):
+    """Answer a step 1 duplicate queue and near-duplicate clusters with the policy."""
+    pending = PendingDecisions(df, qty_col)
+    for sku_norm in queue:
+        selected_sku = pending.rows(sku_norm)["SKU"].iloc[0]
+        if policy.duplicates == "merge":
+            pending.merge_duplicate(sku_norm, selected_sku)
+        elif policy.duplicates == "delete":
+            pending.delete_duplicate(sku_norm)
+        if journal is not None:
+            journal.record("duplicates", policy.duplicates, source=source, sku_norm=sku_norm, selected_sku=selected_sku)
+    for cluster in fuzzy_clusters:
+        skus = pending.rows(*cluster)["SKU"]
+        selected_sku = skus.iloc[0] if len(skus) else None
+        if policy.fuzzy_duplicates == "merge":
+            pending.merge_fuzzy_cluster(cluster, selected_sku)
+        if journal is not None:
+            journal.record(
+                "fuzzy_duplicates", policy.fuzzy_duplicates, source=source, skus=list(cluster), selected_sku=selected_sku
+            )
+    return pending.apply()
+
+
+def apply_cross_policy(queue, policy, journal=None, fuzzy_selected=()):
+    """Answer the step 2 queue with the policy. Returns the pairs merged.
+
+    Pairs already in `fuzzy_selected` keep their SKUs: each SKU is merged at most once.
+    """
+    merged = []
+    if policy.cross_matches != "merge":
+        return merged
+    merged_qb_skus = {fuzzy_match["QuickBooks SKU"] for fuzzy_match in fuzzy_selected}
+    merged_dt_skus = {fuzzy_match["D-Tools SKU"] for fuzzy_match in fuzzy_selected}
+    for fuzzy_match in queue:
+        # Best match first: a SKU is only paired once
+        if fuzzy_match["QuickBooks SKU"] in merged_qb_skus or fuzzy_match["D-Tools SKU"] in merged_dt_skus:
+            continue
+        merged_qb_skus.add(fuzzy_match["QuickBooks SKU"])
+        merged_dt_skus.add(fuzzy_match["D-Tools SKU"])
+        merged.append(fuzzy_match)
+        if journal is not None:
+            journal.record(
+                "cross_matches", "merge",
+                qb_sku=fuzzy_match["QuickBooks SKU"], dt_sku=fuzzy_match["D-Tools SKU"], score=fuzzy_match["Similitude"],
+            )
+    return merged
+
+
+def clean_source(df, source, qty_col, policy, threshold, cache, key, journal, rules, resolved):
+    """Step 1 of one working frame without a reviewer: the `AutoRules`, then the policy."""
+    needs_clusters = policy.fuzzy_duplicates == "merge" or rules.merge_variants
+    fuzzy_clusters = fuzzy_duplicates(df, threshold, cache, key) if needs_clusters else []
+    df, queue, fuzzy_clusters = resolve_cleanup(
+        df, source, qty_col, duplicate_queue(df), fuzzy_clusters, rules, resolved, journal
+    )
+    # Clusters the rules left are answered (and journaled) by the policy, "skip" included
+    return apply_cleanup_policy(df, source, qty_col, policy, queue, fuzzy_clusters, journal)
+
+
+@profiled("reconcile")
+def reconcile(
+    qb_source, dt_source, policy=None, threshold=0.95, cache=None, journal=None, top_k=None, identifier_keys=IDENTIFIER_KEYS,
+    rules=None, resolved=None,
+):
+    """Run the whole pipeline without a reviewer and return the final inventory.
+
+    Every decision taken is recorded in `journal` when given. `top_k` limits
+    the step 2 candidates, see `cross_matches`. SKUs sharing one of the
+    `identifier_keys` are paired before any fuzzy matching (none: SKUs only).
+    The `AutoRules` settle what they can before the policy answers the rest;
+    their counts per rule go to the `resolved` Counter when given.
+    """
+    policy = policy or DecisionPolicy()
+    rules = rules or AutoRules()
+    resolved = Counter() if resolved is None else resolved
+    qb_hash, dt_hash = (source_hash(source) if cache is not None else None for source in (qb_source, dt_source))
+    if journal is not None:
+        journal.threshold = threshold
+
+    df_qb, df_dt = load_sources(qb_source, dt_source, journal)
+    df_qb = clean_source(df_qb, "qb", QB_QTY_COL, policy, threshold, cache, f"self:{qb_hash}", journal, rules, resolved)
+    df_dt = clean_source(df_dt, "dt", DT_QTY_COL, policy, threshold, cache, f"self:{dt_hash}", journal, rules, resolved)
+    dt_full = load_inventory(dt_source)
+
+    _, mismatched_qb, mismatched_dt = split_matches(df_qb, df_dt)
+    paired = identifier_matches(mismatched_qb, mismatched_dt, *load_identifiers(qb_source, dt_source), identifier_keys)
+    mismatched_qb, mismatched_dt = drop_paired(mismatched_qb, mismatched_dt, paired)
+    queue = []
+    if policy.cross_matches == "merge" or rules.cross:
+        queue = cross_matches(
+            mismatched_qb, mismatched_dt, threshold, cache, f"cross:{qb_hash}:{dt_hash}", top_k=top_k
+        )
+    auto_selected, queue = resolve_cross_matches(queue, df_qb, df_dt, rules, resolved, journal, dt_full)
+    fuzzy_selected = auto_selected + apply_cross_policy(queue, policy, journal, auto_selected)
+
+    return build_final_output(df_qb, df_dt, paired + fuzzy_selected, dt_full)
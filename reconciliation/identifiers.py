@@ -0,0 +1,108 @@
+"""Exact matching on secondary identifiers, before any fuzzy scoring.
+
+A SKU typed differently in the two files often still carries the same
+manufacturer part number or barcode. Each `IdentifierKey` names the columns
+holding one identifier in each export. Keys are tried in priority order, each
+as a hash join of the normalized values of the SKUs still unpaired, and only
+what no key pairs goes on to fuzzy matching.
+
+A join must be unambiguous: a value held by several SKUs of one file (e.g. a
+barcode Excel rounded to "8,76E+11") never pairs, nor does a SKU joined to
+several SKUs of the other file.
+"""
+from dataclasses import dataclass
+
+import pandas as pd
+
+from reconciliation.dtypes import isin
+from reconciliation.normalization import normalize_identifiers
+
+QB_UGS_COL = "UGS (unité de gestion de stock)"
+
+
+@dataclass(frozen=True)
+class IdentifierKey:
+    """One identifier and the columns holding it in the QuickBooks and D-Tools exports."""
+
+    name: str
+    qb_columns: tuple
+    dt_columns: tuple
+
+
+# Default priority: the first key pairing a SKU wins
+IDENTIFIER_KEYS = (
+    IdentifierKey("Part Number", ("SKU", QB_UGS_COL), ("Part Number",)),
+    IdentifierKey("UPC", ("SKU", QB_UGS_COL), ("UPC",)),
+    IdentifierKey("EAN", ("SKU", QB_UGS_COL), ("EAN",)),
+    IdentifierKey("UGS", (QB_UGS_COL,), ("SKU",)),
+)
+
+# Identifier columns beyond the working frames' (read separately, see `engine.load_identifiers`)
+QB_IDENTIFIER_COLUMNS = [QB_UGS_COL]
+DT_IDENTIFIER_COLUMNS = ["Part Number", "UPC", "EAN"]
+
+
+def keys_named(names, keys=IDENTIFIER_KEYS):
+    """The keys called `names`, in that order (the priority)."""
+    by_name = {key.name: key for key in keys}
+    unknown = [name for name in names if name not in by_name]
+    if unknown:
+        raise ValueError(f"Unknown identifier keys {unknown}, expected some of {list(by_name)}")
+    return tuple(by_name[name] for name in names)
+
+
+def _all_values(df, ids, columns):
+    """Normalized (value, SKU) rows of `df`, ambiguous values included."""
+    parts = []
+    for col in columns:
+        if col in df.columns:
+            values = df[col]
+        elif ids is not None and col in ids.columns:
+            values = ids[col].reindex(df.index)  # Same file rows: the working frames keep the row labels
+        else:
+            continue
+        parts.append(pd.DataFrame({"value": normalize_identifiers(values), "sku": df["SKU"]}))
+    if not parts:
+        return pd.DataFrame(columns=["value", "sku"])
+    return pd.concat(parts).dropna().drop_duplicates()
+
+
+def _unambiguous(values):
+    return values[~values["value"].duplicated(keep=False)]
+
+
+def _values(df, ids, columns):
+    """Unambiguous (value, SKU) rows of `df`: normalized identifiers held by a single SKU."""
+    return _unambiguous(_all_values(df, ids, columns))
+
+
+def catalog_values(df, ids=None, keys=IDENTIFIER_KEYS):
+    """Normalized D-Tools values of each key, computed once for `identifier_pairs(dt_values=...)`."""
+    return {key.name: _all_values(df.dropna(subset=["SKU"]), ids, key.dt_columns) for key in keys}
+
+
+def identifier_pairs(mismatched_qb, mismatched_dt, qb_ids=None, dt_ids=None, keys=IDENTIFIER_KEYS, dt_values=None):
+    """(QuickBooks SKU, D-Tools SKU, key name) of the SKUs sharing an identifier, key by key.
+
+    `qb_ids` / `dt_ids` hold the identifier columns missing from the
+    residuals, on the same row labels. `dt_values` (see `catalog_values`)
+    holds the values of a whole D-Tools frame the residual was taken from,
+    so they are not normalized again. Each SKU is paired at most once.
+    """
+    qb = mismatched_qb.dropna(subset=["SKU"])
+    dt = mismatched_dt.dropna(subset=["SKU"])
+    pairs = []
+    for key in keys:
+        if dt_values is not None:
+            values = dt_values[key.name]
+            dt_side = _unambiguous(values[isin(values["sku"], dt["SKU"])])
+        else:
+            dt_side = _values(dt, dt_ids, key.dt_columns)
+        joined = _values(qb, qb_ids, key.qb_columns).merge(
+            dt_side, on="value", suffixes=("_qb", "_dt")
+        ).drop_duplicates(["sku_qb", "sku_dt"])
+        joined = joined[~joined["sku_qb"].duplicated(keep=False) & ~joined["sku_dt"].duplicated(keep=False)]
+        pairs += [(qb_sku, dt_sku, key.name) for qb_sku, dt_sku in zip(joined["sku_qb"], joined["sku_dt"])]
+        qb = qb[~isin(qb["SKU"], joined["sku_qb"])]
+        dt = dt[~isin(dt["SKU"], joined["sku_dt"])]
+    return pairs
@@ -0,0 +1,173 @@
+"""Fast loading of the QuickBooks / D-Tools exports.
+
+* CSV goes through the pyarrow parser (multi-threaded, multi-line quoted
+  descriptions allowed), with the same missing-value markers as pandas.
+* XLSX goes through python-calamine when it is installed, openpyxl otherwise.
+  Multi-line cells get openpyxl's "\n" line endings either way.
+* `columns` restricts a CSV parse to the columns the pipeline works on; the
+  full file is only parsed when every column is needed (export).
+* A full parse is written to Parquet under the cache dir, keyed by the file's
+  content hash, so the next load of the same file (full or projected) is a
+  Parquet read. Old files are dropped once the directory passes the cache size.
+* Text comes back as Arrow strings (`dtypes.TEXT_DTYPE`), straight from the
+  Arrow tables for CSV and Parquet.
+"""
+import io
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from reconciliation.dtypes import TEXT_DTYPE, compact_text
+from reconciliation.similarity_cache import CACHE_DIR, CACHE_MAX_BYTES, content_hash
+
+PARSED_CACHE_DIR = os.path.join(CACHE_DIR, "parsed")
+
+# `pd.read_csv`'s default `na_values`, as documented
+NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+# Part of the cache file name: bumped whenever a parse gives different values
+PARSED_CACHE_VERSION = 2
+
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
+
+def _read_bytes(source):
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def _csv_options(header, columns=None, block_size=None):
+    read_options = pa_csv.ReadOptions(column_names=header, skip_rows=1)
+    if block_size is not None:
+        read_options.block_size = block_size
+    return dict(
+        # pandas' header names, so "Unnamed: n" and de-duplicated names match read_csv
+        read_options=read_options,
+        parse_options=pa_csv.ParseOptions(delimiter=";", newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={col: pa.string() for col in header},
+            include_columns=[col for col in header if columns is None or col in columns],
+            null_values=NA_VALUES,
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=True,
+        ),
+    )
+
+
+def _parse_csv(data, columns=None):
+    header = pd.read_csv(io.BytesIO(data), sep=";", nrows=0).columns.tolist()
+    table = pa_csv.read_csv(io.BytesIO(data), **_csv_options(header, columns))
+    return table.to_pandas(types_mapper=_text_types)
+
+
+def _text_types(arrow_type):
+    return TEXT_DTYPE if arrow_type in (pa.string(), pa.large_string()) else None
+
+
+def _read_excel(data):
+    df = compact_text(pd.read_excel(io.BytesIO(data), dtype=str, engine=EXCEL_ENGINE))
+    if EXCEL_ENGINE == "calamine":
+        # calamine keeps the "\r\n" of multi-line cells where openpyxl gives "\n"
+        for col in df.columns[df.dtypes == TEXT_DTYPE]:
+            df[col] = df[col].str.replace("\r\n", "\n", regex=False)
+    return df
+
+
+def _cache_path(digest):
+    return os.path.join(PARSED_CACHE_DIR, f"{digest}.v{PARSED_CACHE_VERSION}.parquet")
+
+
+def _store(df, digest, max_bytes=CACHE_MAX_BYTES):
+    """Write a parsed file to the Parquet cache, dropping the oldest files past `max_bytes`."""
+    os.makedirs(PARSED_CACHE_DIR, exist_ok=True)
+    path = _cache_path(digest)
+    df.to_parquet(f"{path}.tmp", index=False)
+    os.replace(f"{path}.tmp", path)
+
+    cached = sorted(
+        (entry for entry in os.scandir(PARSED_CACHE_DIR) if entry.name.endswith(".parquet")),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    total = sum(entry.stat().st_size for entry in cached)
+    for entry in cached:
+        if total <= max_bytes or entry.path == path:
+            continue
+        total -= entry.stat().st_size
+        os.remove(entry.path)
+
+
+def read_inventory(source, columns=None, name=None):
+    """Load an export (path or uploaded file) as Arrow string columns, optionally only `columns`.
+
+    Requested columns missing from the file are simply absent from the result.
+    """
+    name = str(name or getattr(source, "name", source))
+    data = _read_bytes(source)
+    digest = content_hash(data)
+    path = _cache_path(digest)
+
+    if os.path.exists(path):
+        os.utime(path)  # Most recently used
+        if columns is not None:
+            columns = [col for col in pq.read_schema(path).names if col in columns]
+        return pq.read_table(path, columns=columns).to_pandas(types_mapper=_text_types)
+
+    if name.endswith(".csv"):
+        if columns is not None:
+            # Columnar parse of just these columns; the full parse waits for export
+            return _parse_csv(data, columns)
+        df = _parse_csv(data)
+    else:
+        # XLSX is parsed whole either way, so cache it right away
+        df = _read_excel(data)
+
+    _store(df, digest)
+    if columns is not None:
+        df = df[[col for col in df.columns if col in columns]]
+    return df
+
+
+# Bytes of CSV parsed per chunk by `iter_inventory`; Arrow reads a few blocks ahead
+CSV_BLOCK_BYTES = 1024 * 1024
+EXCEL_CHUNK_ROWS = 50_000
+
+
+def iter_inventory(source, name=None, block_size=CSV_BLOCK_BYTES):
+    """Load an export as successive frames, labelled by file row, as `read_inventory` would in one.
+
+    CSV is parsed a block of `block_size` bytes at a time and never held
+    whole. XLSX stops at Excel's 1,048,576 rows: it is read whole (from the
+    Parquet cache when there) and handed out in slices.
+    """
+    name = str(name or getattr(source, "name", source))
+    if not name.endswith(".csv"):
+        df = read_inventory(source, name=name)
+        for start in range(0, len(df), EXCEL_CHUNK_ROWS):
+            yield df.iloc[start:start + EXCEL_CHUNK_ROWS]
+        return
+
+    if hasattr(source, "getvalue"):
+        data = source.getvalue()
+        header = pd.read_csv(io.BytesIO(data), sep=";", nrows=0).columns.tolist()
+        stream = pa.BufferReader(data)
+    else:
+        header = pd.read_csv(source, sep=";", nrows=0).columns.tolist()
+        stream = pa.OSFile(str(source))
+    with stream:
+        start = 0
+        for batch in pa_csv.open_csv(stream, **_csv_options(header, block_size=block_size)):
+            df = batch.to_pandas(types_mapper=_text_types)
+            df.index = pd.RangeIndex(start, start + len(df))
+            start += len(df)
+            yield df
@@ -0,0 +1,71 @@
+"""Decision journal.
+
+Every review decision of a run, in order, plus a fingerprint of each input
+row. Saved next to `Inventaire_Final.xlsx`, it lets the next run replay the
+decisions on unchanged SKUs and only review what changed (see `delta`).
+
+Decision entries, by stage:
+
+    {"stage": "duplicates", "source": "qb", "sku_norm": ..., "action": "merge", "selected_sku": ...}
+    {"stage": "fuzzy_duplicates", "source": "dt", "skus": [sku1, sku2, ...], "action": "merge", "selected_sku": ...}
+    {"stage": "cross_matches", "qb_sku": ..., "dt_sku": ..., "action": "merge"}
+"""
+import json
+
+import pandas as pd
+
+from reconciliation.dtypes import as_text
+
+JOURNAL_VERSION = 1
+
+
+def fingerprints(df):
+    """Fingerprint of the rows of each raw SKU, as {SKU: hex digest}."""
+    # As text: a quantity converted to numbers hashes as the text it was read from
+    values = as_text(df.drop(columns=["SKU_NORM"], errors="ignore")).fillna("")
+    hashes = pd.util.hash_pandas_object(values, index=False)
+    # Order-independent combination of the rows sharing a SKU
+    combined = hashes.groupby(df["SKU"].astype(str).to_numpy()).sum()
+    return {sku: format(int(digest), "016x") for sku, digest in combined.items()}
+
+
+class DecisionJournal:
+    """Append-only list of review decisions, with the input fingerprints they were made on."""
+
+    def __init__(self, decisions=None, snapshots=None, threshold=None):
+        self.decisions = list(decisions or [])
+        self.snapshots = dict(snapshots or {})
+        self.threshold = threshold
+
+    def record(self, stage, action, **details):
+        self.decisions.append({"stage": stage, "action": action, **details})
+
+    def take_snapshot(self, source, df):
+        self.snapshots[source] = fingerprints(df)
+
+    def to_json(self):
+        return json.dumps(
+            {
+                "version": JOURNAL_VERSION,
+                "threshold": self.threshold,
+                "snapshots": self.snapshots,
+                "decisions": self.decisions,
+            },
+            ensure_ascii=False,
+        )
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        if data.get("version") != JOURNAL_VERSION:
+            raise ValueError(f"Unsupported journal version: {data.get('version')!r}")
+        return cls(data["decisions"], data["snapshots"], data["threshold"])
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_json())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls.from_json(f.read())
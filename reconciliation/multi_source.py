@@ -0,0 +1,173 @@
+"""Reconcile any number of inventory sources against one D-Tools catalog.
+
+`engine.reconcile` compares one QuickBooks file with the catalog. Run once per
+QuickBooks company file or warehouse export, it would load, clean and index
+the catalog every time. A `Catalog` does that once: the cleaned working frame,
+its normalized identifiers and the SKU list the fuzzy scoring runs against.
+Each source is then resolved against it alone (exact join, identifiers, fuzzy
+matching), so the cost grows linearly with the number of sources.
+
+A `SourceMapping` renames the columns of a source to the QuickBooks ones the
+pipeline works on. The result is the D-Tools template with one quantity
+column per source, and the catalog quantity column holding their total.
+There is no journal: delta mode stays a two-file run.
+"""
+from collections import Counter
+from dataclasses import dataclass
+
+import pandas as pd
+
+from reconciliation import engine
+from reconciliation.dtypes import plain_quantities
+from reconciliation.identifiers import DT_IDENTIFIER_COLUMNS, IDENTIFIER_KEYS, QB_IDENTIFIER_COLUMNS, catalog_values
+from reconciliation.matching import cross_fuzzy_match, top_k_pairs
+from reconciliation.profiling import profiled
+from reconciliation.rules import AutoRules, resolve_cross_matches
+
+
+@dataclass(frozen=True)
+class SourceMapping:
+    """One inventory source: its name in the output, and which of its columns are the QuickBooks ones."""
+
+    name: str
+    source: object        # path or uploaded file
+    columns: dict = None  # source column -> QuickBooks column (default: the QuickBooks names already)
+
+
+@dataclass
+class Catalog:
+    """The D-Tools side, prepared once for every source."""
+
+    df: pd.DataFrame      # cleaned working frame
+    full: pd.DataFrame    # complete file, for the export
+    skus: pd.Series       # unique SKUs: the fuzzy matching choices
+    identifiers: dict     # key name -> normalized values, see `identifiers.catalog_values`
+    key: str = None       # content hash, keys the similarity cache
+
+
+def quantity_column(name):
+    """Output column holding the quantity of source `name`."""
+    return f"{engine.DT_QTY_COL} ({name})"
+
+
+@profiled("catalog")
+def build_catalog(dt_source, policy=None, threshold=0.95, cache=None, rules=None, resolved=None):
+    """Load, clean and index the D-Tools catalog (every identifier key, whichever a run uses)."""
+    policy = policy or engine.DecisionPolicy()
+    rules = rules or AutoRules()
+    resolved = Counter() if resolved is None else resolved
+    dt_hash = engine.source_hash(dt_source) if cache is not None else None
+    df = engine.working_frame(engine.load_inventory(dt_source, engine.DT_COLUMNS))
+    df = engine.clean_source(df, "dt", engine.DT_QTY_COL, policy, threshold, cache, f"self:{dt_hash}", None, rules, resolved)
+    ids = engine.load_inventory(dt_source, DT_IDENTIFIER_COLUMNS)
+    return Catalog(
+        df, engine.load_inventory(dt_source), df["SKU"].dropna().drop_duplicates(), catalog_values(df, ids), dt_hash
+    )
+
+
+def load_source(mapping):
+    """Working frame of a source under the QuickBooks column names, identifier columns included."""
+    rename = dict(mapping.columns or {})
+    wanted = engine.QB_COLUMNS + QB_IDENTIFIER_COLUMNS
+    columns = [col for col, target in rename.items() if target in wanted]
+    columns += [col for col in wanted if col not in rename.values()]
+    df = engine.load_inventory(mapping.source, columns).rename(columns=rename)
+    if "SKU" not in df.columns:
+        raise ValueError(f"Source {mapping.name!r} has no SKU column, map one of its columns to 'SKU'")
+    return engine.working_frame(df)
+
+
+@profiled("cross_matches")
+def catalog_matches(mismatched, mismatched_dt, catalog, threshold, cache=None, key=None, top_k=None):
+    """Step 2 queue of one source, as `engine.cross_matches` gives on the same residuals.
+
+    The source's SKUs are scored against the whole catalog, the same choices
+    for every source (and the same cache entry from one run to the next, its
+    exact matches aside), then the pairs with a catalog SKU already matched
+    are dropped.
+    """
+    skus = mismatched["SKU"].dropna()
+    if cache is not None:
+        pairs = [pair for pair in cache.cross_pairs(key, skus, catalog.skus) if pair[2] > threshold]
+    else:
+        pairs = cross_fuzzy_match(skus, catalog.skus, threshold)
+    unmatched = set(mismatched_dt["SKU"].dropna())
+    pairs = [pair for pair in pairs if pair[1] in unmatched]
+    if top_k is not None:
+        pairs = top_k_pairs(pairs, top_k)
+    return [
+        {"QuickBooks SKU": sku, "D-Tools SKU": dt_sku, "Similitude": round(score * 100, 2)}
+        for sku, dt_sku, score in pairs
+    ]
+
+
+@profiled("resolve_source")
+def resolve_source(mapping, catalog, policy=None, threshold=0.95, cache=None, top_k=None,
+                   identifier_keys=IDENTIFIER_KEYS, rules=None, resolved=None):
+    """One source against the catalog: (cleaned frame, pairs merged), as `engine.reconcile` for one file."""
+    policy = policy or engine.DecisionPolicy()
+    rules = rules or AutoRules()
+    resolved = Counter() if resolved is None else resolved
+    source_hash = engine.source_hash(mapping.source) if cache is not None else None
+    df = engine.clean_source(
+        load_source(mapping), mapping.name, engine.QB_QTY_COL, policy, threshold, cache, f"self:{source_hash}", None,
+        rules, resolved,
+    )
+    _, mismatched, mismatched_dt = engine.split_matches(df, catalog.df)
+    paired = engine.identifier_matches(mismatched, mismatched_dt, keys=identifier_keys, dt_values=catalog.identifiers)
+    mismatched, mismatched_dt = engine.drop_paired(mismatched, mismatched_dt, paired)
+    queue = []
+    if policy.cross_matches == "merge" or rules.cross:
+        queue = catalog_matches(
+            mismatched, mismatched_dt, catalog, threshold, cache, f"cross:{source_hash}:{catalog.key}", top_k
+        )
+    auto_selected, queue = resolve_cross_matches(queue, df, catalog.df, rules, resolved, None, catalog.full)
+    return df, paired + auto_selected + engine.apply_cross_policy(queue, policy, None, auto_selected)
+
+
+@profiled("merge")
+def build_consolidated_output(catalog, quantities):
+    """D-Tools template with one quantity column per source (see `engine.quantity_map`) after its own.
+
+    The catalog quantity column holds the sum of the sources' quantities,
+    or the D-Tools quantity when no source has the SKU.
+    """
+    final_output = engine.restore_columns(catalog.df, catalog.full)
+    by_source = pd.DataFrame(
+        {quantity_column(name): final_output["SKU"].map(quantity_map) for name, quantity_map in quantities.items()},
+        index=final_output.index,
+    )
+    total = by_source.apply(pd.to_numeric, errors="coerce").sum(axis=1, min_count=1).astype(object)
+    if engine.DT_QTY_COL in final_output.columns:
+        final_output[engine.DT_QTY_COL] = plain_quantities(total.combine_first(final_output[engine.DT_QTY_COL].astype(object)))
+    else:
+        final_output[engine.DT_QTY_COL] = plain_quantities(total)
+    position = final_output.columns.get_loc(engine.DT_QTY_COL) + 1
+    for offset, col in enumerate(by_source.columns):
+        final_output.insert(position + offset, col, plain_quantities(by_source[col]))
+    return final_output.loc[:, ~final_output.columns.str.contains("^Unnamed")]
+
+
+@profiled("reconcile")
+def reconcile_sources(
+    sources, dt_source, policy=None, threshold=0.95, cache=None, top_k=None, identifier_keys=IDENTIFIER_KEYS,
+    rules=None, resolved=None,
+):
+    """Run the pipeline for each `SourceMapping` against one D-Tools catalog and return the consolidated inventory.
+
+    The parameters are those of `engine.reconcile`; every source gets the
+    same policy and rules. Source names must be unique.
+    """
+    names = [mapping.name for mapping in sources]
+    if not names or len(set(names)) != len(names):
+        raise ValueError(f"Source names must be given and unique, got {names}")
+    policy = policy or engine.DecisionPolicy()
+    rules = rules or AutoRules()
+    resolved = Counter() if resolved is None else resolved
+
+    catalog = build_catalog(dt_source, policy, threshold, cache, rules, resolved)
+    quantities = {}
+    for mapping in sources:
+        df, pairs = resolve_source(mapping, catalog, policy, threshold, cache, top_k, identifier_keys, rules, resolved)
+        quantities[mapping.name] = engine.quantity_map(df, pairs)
+    return build_consolidated_output(catalog, quantities)
@@ -0,0 +1,91 @@
+"""SKU normalization.
+
+A rule set is an ordered sequence of `(compiled pattern, replacement)` pairs
+applied after trimming and upper-casing. Both inventories go through the same
+`normalize_skus`, which normalizes each distinct raw SKU once with vectorized
+string operations and maps the result back onto the rows.
+"""
+import re
+
+import pandas as pd
+
+DEFAULT_RULES = (
+    (re.compile(r"(?<!\d)[.]"), ""),  # Remove dots, except right after a digit (e.g. 80.5)
+    (re.compile(r"\s+"), ""),  # Remove spaces
+)
+
+
+def normalize_sku(sku, rules=DEFAULT_RULES):
+    """Normalize one SKU: uppercase, trimmed, then every rule in order."""
+    sku = sku.upper().strip()
+    for pattern, replacement in rules:
+        sku = pattern.sub(replacement, sku)
+    return sku
+
+
+def normalize_skus(skus, rules=DEFAULT_RULES):
+    """Normalize a Series of raw SKUs, computing each distinct value only once."""
+    codes, uniques = pd.factorize(skus.astype(str))
+    normalized = pd.Series(uniques, dtype=object).str.strip().str.upper()
+    for pattern, replacement in rules:
+        normalized = normalized.str.replace(pattern, replacement, regex=True)
+    return pd.Series(normalized.to_numpy()[codes], index=skus.index, dtype=object)
+
+
+# Placeholders, and numbers Excel wrote in scientific notation ("8,76E+11", digits lost): not identifiers
+NOT_IDENTIFIERS = re.compile(r"#?N/?A|NONE|NULL|0*|\d+[.,]\d+E[+-]?\d+")
+
+
+def normalize_identifiers(values, rules=DEFAULT_RULES):
+    """Normalize part numbers and barcodes like SKUs, missing for placeholders.
+
+    Leading zeros are dropped from all-digit codes: a 12-digit UPC is the
+    13-digit EAN with a leading 0.
+    """
+    known = values.dropna()
+    normalized = normalize_skus(known, rules)
+    normalized = normalized[~normalized.str.fullmatch(NOT_IDENTIFIERS)]
+    digits = normalized.str.fullmatch(r"\d+")
+    normalized[digits] = normalized[digits].str.lstrip("0")
+    return normalized.reindex(values.index)
+
+
+# Canonical signature of a normalized SKU: structural variants of one SKU share it
+SIGNATURE_RULES = (
+    (re.compile(r"(?<!\d)0+(?=\d)"), ""),  # Fold zero padding (ABC-0100 -> ABC-100), before separators go
+    (re.compile(r"[-_/\\]"), ""),  # Remove separators
+)
+
+
+def brand_signatures(sku_norms, brands, rules=SIGNATURE_RULES):
+    """Brand, signature and whether the brand was stripped, per row (see `canonical_signatures`).
+
+    The brand is normalized like the SKUs, "" where missing.
+    """
+    signatures = normalize_skus(sku_norms, rules)
+    prefixes = normalize_skus(brands.fillna(""), DEFAULT_RULES + tuple(rules))
+    stripped = [
+        bool(prefix) and len(signature) > len(prefix) and signature.startswith(prefix)
+        for signature, prefix in zip(signatures.tolist(), prefixes.tolist())
+    ]
+    return pd.DataFrame(
+        {
+            "brand": prefixes.to_numpy(),
+            "signature": [
+                signature[len(prefix):] if strip else signature
+                for signature, prefix, strip in zip(signatures.tolist(), prefixes.tolist(), stripped)
+            ],
+            "stripped": stripped,
+        },
+        index=sku_norms.index,
+    )
+
+
+def canonical_signatures(sku_norms, brands=None, rules=SIGNATURE_RULES):
+    """Signature of each normalized SKU: `rules` applied, then its row's brand dropped where it prefixes it.
+
+    ABC-100, ABC100, ABC-0100 and, for a row of brand ABC, ABC-ABC100 all give ABC100.
+    """
+    if brands is None:
+        return normalize_skus(sku_norms, rules)
+    return brand_signatures(sku_norms, brands, rules)["signature"].astype(object)
@@ -0,0 +1,160 @@
+"""Progress, cancellation and process-pool fan-out for the long stages.
+
+A `Job` is shared by the thread running a source's pipeline and the thread
+displaying it: the pipeline reports its stage and progress on it and calls
+`check()` between units of work, which raises `Cancelled` once `cancel` is set.
+
+`run_chunks` splits a scoring run into ranges of items. Small runs probe them
+in-process (still one chunk at a time, for progress and cancellation); large
+ones in a process pool, each worker building the scoring state once.
+Cancelling drops the queued chunks and waits for the running ones, a few
+seconds of work at most, so no worker is left behind.
+
+A `Producer` runs slow tasks in the background while the user works on
+something else, e.g. the fuzzy matching during the exact-duplicate review.
+"""
+import contextvars
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+CHUNK_ITEMS = 2_000
+# Below this, starting the workers (~1 s each: numpy, RapidFuzz) costs more than it saves
+PARALLEL_MIN_ITEMS = 20_000
+
+
+class Cancelled(Exception):
+    """The job was cancelled; its partial results are dropped."""
+
+
+class Job:
+    """Progress and cancellation of one pipeline, read from another thread."""
+
+    def __init__(self, workers=None, cancel=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.cancel = cancel or threading.Event()
+        self.stage = None
+        self.total = 0  # items of the current stage, 0 when not counted
+        self.done = 0
+        self.scored = 0  # pairs scored, all stages
+        self.started = time.perf_counter()
+
+    def start(self, stage, total=0):
+        self.check()
+        self.stage, self.total, self.done = stage, total, 0
+        self.started = time.perf_counter()
+
+    def advance(self, n, scored=0):
+        self.done += n
+        self.scored += scored
+
+    def check(self):
+        if self.cancel.is_set():
+            raise Cancelled()
+
+    @property
+    def fraction(self):
+        return min(self.done / self.total, 1.0) if self.total else 0.0
+
+    def eta(self):
+        """Seconds left in the current stage, None before any progress."""
+        if not self.done or not self.total:
+            return None
+        elapsed = time.perf_counter() - self.started
+        return elapsed * (self.total - self.done) / self.done
+
+
+_worker_state = None
+
+
+def _init_worker(factory, args):
+    global _worker_state
+    _worker_state = factory(*args)
+
+
+def _probe(start, stop):
+    return _worker_state.probe(start, stop)
+
+
+def run_chunks(factory, args, n, job, chunk_items=CHUNK_ITEMS, min_parallel=None):
+    """Run `factory(*args).probe(start, stop)` over items 0..n, a chunk at a time.
+
+    `probe` returns ({key: value}, pairs scored); the dicts are merged.
+    """
+    min_parallel = PARALLEL_MIN_ITEMS if min_parallel is None else min_parallel
+    job.start("scoring", n)
+    chunks = [(start, min(start + chunk_items, n)) for start in range(0, n, chunk_items)]
+    pairs, scored = {}, 0
+    if job.workers <= 1 or n < min_parallel or len(chunks) < 2:
+        state = factory(*args)
+        for start, stop in chunks:
+            job.check()
+            chunk_pairs, chunk_scored = state.probe(start, stop)
+            pairs.update(chunk_pairs)
+            scored += chunk_scored
+            job.advance(stop - start, chunk_scored)
+        return pairs, scored
+
+    # spawn, not fork: a fork of the threaded Streamlit server can inherit locks held by other threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        min(job.workers, len(chunks)), mp_context=context, initializer=_init_worker, initargs=(factory, args)
+    ) as pool:
+        pending = {pool.submit(_probe, start, stop): stop - start for start, stop in chunks}
+        try:
+            while pending:
+                done, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                job.check()
+                for future in done:
+                    chunk_pairs, chunk_scored = future.result()
+                    pairs.update(chunk_pairs)
+                    scored += chunk_scored
+                    job.advance(pending.pop(future), chunk_scored)
+        except BaseException:
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+    return pairs, scored
+
+
+class Producer:
+    """Named tasks run side by side on background threads, each result published as it finishes.
+
+    A task is a function of its `Job`; the `workers` are shared out between
+    the tasks. Each thread runs in a copy of the caller's context (profiler
+    included), and every task stops at its next `check()` once cancelled.
+    """
+
+    def __init__(self, tasks, workers=None):
+        self.cancel = threading.Event()
+        self.tasks = tasks
+        share = max(1, (workers or os.cpu_count() or 1) // max(len(tasks), 1))
+        self.jobs = {name: Job(share, self.cancel) for name in tasks}
+        self._results = {}
+        self._finished = set()
+        self._threads = [
+            threading.Thread(target=contextvars.copy_context().run, args=(self._run, name, task), daemon=True)
+            for name, task in tasks.items()
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self, name, task):
+        try:
+            self._results[name] = (task(self.jobs[name]), None)
+        except Cancelled:
+            return
+        except Exception as e:  # Re-raised in the thread that takes the result
+            self._results[name] = (None, e)
+        self._finished.add(name)
+
+    def pending(self, name):
+        return name not in self._finished
+
+    def take(self, name):
+        """The task's result, once; None before it finishes and after it was taken."""
+        result, error = self._results.pop(name, (None, None))
+        if error is not None:
+            raise error
+        return result
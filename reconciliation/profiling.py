@@ -0,0 +1,318 @@
+"""Per-stage timing and memory profile of a session.
+
+A `Profiler` records spans: a name, wall and CPU time, the rows going in and
+out, counters such as the pairs scored by the matcher, and, while it tracks
+memory, the peak of traced memory during the span. The app opens one span per
+script rerun and the pipeline stages nest inside it; the spans can be saved
+as JSON or as a Chrome trace (chrome://tracing, https://ui.perfetto.dev).
+
+Stages are instrumented with `@profiled("name")` and counters with
+`count(...)`; both go to the profiler activated in the current context and do
+nothing when there is none, so the engine keeps no profiling state and the
+CLI / batch runs pay one context-variable lookup per call.
+
+tracemalloc is process-wide and slows allocations down (about 2x on the
+pipeline, for every session of the server): it is only turned on on request
+(`track_memory`), runs while at least one profiler asks for it, and stops
+when the last one stops asking or is garbage collected. Its peak is
+process-wide too, so only one profiler at a time, the owner, resets and
+records it. What a session keeps between reruns is measured apart, with
+`memory_report`.
+"""
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+MAX_SPANS = 5_000
+
+_current = contextvars.ContextVar("profiler", default=None)
+
+
+def _rows_in(args):
+    """Rows of the DataFrame arguments, None without any."""
+    sizes = [len(arg) for arg in args if isinstance(arg, pd.DataFrame)]
+    return sum(sizes) if sizes else None
+
+
+def _size(value):
+    """Rows of a DataFrame / entries of a list, summed over a tuple of them; None for anything else."""
+    if isinstance(value, (pd.DataFrame, pd.Series, list)):
+        return len(value)
+    if isinstance(value, tuple):
+        sizes = [size for size in map(_size, value) if size is not None]
+        return sum(sizes) if sizes else None
+    return None
+
+
+class _MemoryTracking:
+    """Process-wide tracemalloc, reference counted, with one owner of its peak."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = []  # ids of the profilers tracking memory, oldest first
+        self._started = False  # tracemalloc started here, not by the embedding program
+        self.owner = None
+
+    def acquire(self, user):
+        with self._lock:
+            if not self._users and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started = True
+            self._users.append(user)
+            if self.owner is None:
+                self.owner = user
+
+    def release(self, user):
+        with self._lock:
+            self._users.remove(user)
+            if self.owner == user:
+                self.owner = self._users[0] if self._users else None
+            if not self._users and self._started:
+                tracemalloc.stop()
+                self._started = False
+
+
+_memory = _MemoryTracking()
+
+
+class Profiler:
+    """Bounded log of spans, innermost last, for one session or batch run."""
+
+    def __init__(self, max_spans=MAX_SPANS):
+        self.spans = deque(maxlen=max_spans)
+        self.origin = time.perf_counter()
+        self.reruns = 0
+        self._local = threading.local()  # Open spans, per thread: sources are prepared side by side
+        self._rerun = None
+        self._last_end, self._last_cpu = self.origin, time.process_time()
+        self._release_memory = None  # set while this profiler tracks memory
+
+    # ---- Memory ----
+    def track_memory(self, enabled):
+        """Ask for / give up tracemalloc. Returns whether this profiler records the peaks.
+
+        Another profiler tracking memory first keeps the peaks until it stops.
+        """
+        if enabled and self._release_memory is None:
+            _memory.acquire(id(self))
+            # A session dropped with tracking on releases it too
+            self._release_memory = weakref.finalize(self, _memory.release, id(self))
+        elif not enabled and self._release_memory is not None:
+            self._release_memory()
+            self._release_memory = None
+        return self.records_memory
+
+    @property
+    def records_memory(self):
+        return self._release_memory is not None and _memory.owner == id(self)
+
+    # ---- Recording ----
+    @property
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _open(self, name, category, args):
+        record = {"name": name, "category": category, "depth": len(self._stack), "rerun": self.reruns, **args}
+        if self.records_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack and "_peak" in self._stack[-1]:
+                # reset_peak below forgets the parent's peak so far: hand it over
+                self._stack[-1]["_peak"] = max(self._stack[-1]["_peak"], peak)
+            tracemalloc.reset_peak()
+            record["_base"], record["_peak"] = current, 0
+        record["thread"] = threading.get_ident()
+        record["_start"], record["_cpu"] = time.perf_counter(), time.process_time()
+        record["_stack"] = self._stack
+        self._stack.append(record)
+        return record
+
+    def _close(self, record, end=None, cpu_end=None):
+        end = end if end is not None else time.perf_counter()
+        cpu_end = cpu_end if cpu_end is not None else time.process_time()
+        stack = record.pop("_stack")
+        stack.remove(record)
+        start = record.pop("_start")
+        record["start"] = start - self.origin
+        record["wall"] = end - start
+        record["cpu"] = cpu_end - record.pop("_cpu")
+        base, peak = record.pop("_base", None), record.pop("_peak", None)
+        if base is not None and self.records_memory:
+            peak = max(tracemalloc.get_traced_memory()[1], peak)
+            record["peak_mib"] = round((peak - base) / 2**20, 2)
+            if stack and "_peak" in stack[-1]:
+                stack[-1]["_peak"] = max(stack[-1]["_peak"], peak)
+        self._last_end, self._last_cpu = end, cpu_end
+        self.spans.append(record)
+
+    @contextmanager
+    def span(self, name, category="stage", **args):
+        """Time the block; the yielded dict takes extra fields (`rows_out`, counters)."""
+        record = self._open(name, category, args)
+        token = _current.set(self)
+        try:
+            yield record
+        finally:
+            _current.reset(token)
+            self._close(record)
+
+    def count(self, key, n=1):
+        """Add `n` to a counter of the innermost open span."""
+        if self._stack:
+            self._stack[-1][key] = self._stack[-1].get(key, 0) + n
+
+    def begin_rerun(self):
+        """Open the span of a new script run and make this profiler current in the calling context.
+
+        A run cut short by `st.rerun()` / `st.stop()` never reaches `end_rerun`:
+        it is closed here, at the end of its last stage, and flagged.
+        """
+        if self._rerun is not None:
+            self._rerun["interrupted"] = True
+            self.end_rerun(max(self._last_end, self._rerun["_start"]), max(self._last_cpu, self._rerun["_cpu"]))
+        self.reruns += 1
+        self._rerun = self._open(f"rerun {self.reruns}", "rerun", {})
+        _current.set(self)
+
+    def end_rerun(self, end=None, cpu_end=None):
+        if self._rerun is not None:
+            stack = self._rerun["_stack"]  # That run's thread, maybe not this one
+            while stack[-1] is not self._rerun:  # Never closed, should not happen
+                self._close(stack[-1], end, cpu_end)
+            self._close(self._rerun, end, cpu_end)
+            self._rerun = None
+
+    # ---- Reading ----
+    def frame(self, rerun=None):
+        """Spans as a DataFrame, in start order; only one rerun's with `rerun`."""
+        spans = [span for span in self.spans if rerun is None or span["rerun"] == rerun]
+        df = pd.DataFrame(spans)
+        if df.empty:
+            return df
+        df = df.sort_values("start", kind="stable")
+        df["wall_ms"] = (df["wall"] * 1000).round(1)
+        df["cpu_ms"] = (df["cpu"] * 1000).round(1)
+        first = ["name", "wall_ms", "cpu_ms", "rows_in", "rows_out", "pairs_scored", "peak_mib"]
+        columns = [col for col in first if col in df.columns]
+        columns += [col for col in df.columns if col not in columns + ["wall", "cpu", "start", "thread"]]
+        return df[columns].reset_index(drop=True)
+
+    def summary(self):
+        """Per stage: calls, total and worst wall time, total CPU time, highest peak."""
+        spans = [span for span in self.spans if span["category"] != "rerun"]
+        if not spans:
+            return pd.DataFrame()
+        df = pd.DataFrame(spans)
+        agg = {"calls": ("wall", "size"), "wall_ms": ("wall", "sum"), "max_wall_ms": ("wall", "max"), "cpu_ms": ("cpu", "sum")}
+        if "peak_mib" in df.columns:
+            agg["peak_mib"] = ("peak_mib", "max")
+        summary = df.groupby("name", sort=False).agg(**agg)
+        for col in ("wall_ms", "max_wall_ms", "cpu_ms"):
+            summary[col] = (summary[col] * 1000).round(1)
+        return summary.sort_values("wall_ms", ascending=False)
+
+    def to_json(self):
+        return json.dumps({"version": 1, "spans": list(self.spans)}, indent=2, default=str)
+
+    def to_chrome_trace(self):
+        """Complete ("X") events in microseconds, the other fields as args."""
+        events = []
+        for span in self.spans:
+            args = {key: value for key, value in span.items() if key not in ("name", "category", "start", "wall", "cpu", "thread", "depth")}
+            args["cpu_ms"] = round(span["cpu"] * 1000, 1)
+            events.append({
+                "name": span["name"], "cat": span["category"], "ph": "X",
+                "ts": round(span.get("start", 0) * 1e6), "dur": round(span["wall"] * 1e6),
+                "pid": os.getpid(), "tid": span.get("thread", 0), "args": args,
+            })
+        return json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, default=str)
+
+
+def deep_bytes(value, seen=None):
+    """Bytes held by a value: DataFrames and Series in depth, containers and `.df` holders through.
+
+    Objects already in `seen` (ids) count zero, so shared frames count once.
+    """
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(deep_bytes(item, seen) for item in value.values())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(deep_bytes(item, seen) for item in value)
+    if isinstance(getattr(value, "df", None), pd.DataFrame):
+        return sys.getsizeof(value) + deep_bytes(value.df, seen)
+    return sys.getsizeof(value)
+
+
+def memory_report(state, shared=()):
+    """MiB held per key of a mapping (a session's state), biggest first, shared objects counted once.
+
+    Objects reachable from `shared` (e.g. a cache other sessions use too) count zero.
+    """
+    seen = set()
+    for value in shared:
+        deep_bytes(value, seen)
+    sizes = {key: deep_bytes(value, seen) for key, value in state.items()}
+    report = pd.DataFrame({"mib": pd.Series(sizes, dtype=float) / 2**20}).sort_values("mib", ascending=False)
+    report.loc["total"] = report["mib"].sum()
+    return report.round(2)
+
+
+@contextmanager
+def activate(profiler):
+    """Make `profiler` receive the spans and counts of this context."""
+    token = _current.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name, **args):
+    """A span on the current profiler, or a plain dict when there is none."""
+    profiler = _current.get()
+    if profiler is None:
+        yield dict(args)
+        return
+    with profiler.span(name, **args) as record:
+        yield record
+
+
+def count(key, n=1):
+    profiler = _current.get()
+    if profiler is not None:
+        profiler.count(key, n)
+
+
+def profiled(name):
+    """Decorator: a span per call, with the rows in (DataFrame arguments) and out (the result's)."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _current.get()
+            if profiler is None:
+                return func(*args, **kwargs)
+            with profiler.span(name, rows_in=_rows_in(args)) as record:
+                result = func(*args, **kwargs)
+                record["rows_out"] = _size(result)
+            return result
+        return wrapper
+    return decorate
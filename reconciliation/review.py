@@ -0,0 +1,163 @@
+"""Step 1 review decisions, deferred.
+
+Each decision used to be applied when taken: a boolean mask over the whole
+frame to find the group, and a copy of the frame to drop or edit its rows, so
+a review of N decisions cost O(rows x N). `PendingDecisions` instead looks the
+groups up in a `SKU_NORM` -> row positions index built once, appends each
+decision to a log, and applies the log to the frame in one pass (`apply`) at
+the end of the stage. The result is the same frame as applying the decisions
+one by one with `engine.merge_duplicate` / `delete_duplicate` /
+`merge_fuzzy_cluster`.
+"""
+import numpy as np
+import pandas as pd
+
+from reconciliation.profiling import profiled
+
+
+def sku_index(df):
+    """{SKU_NORM: array of row positions}, in frame order."""
+    return df.groupby("SKU_NORM", sort=False).indices
+
+
+class _Group:
+    """Current state of a `SKU_NORM` group touched by a decision."""
+
+    __slots__ = ("positions", "sku", "qty")
+
+    def __init__(self, positions):
+        self.positions = positions  # rows still in the frame
+        self.sku = None  # new SKU of the first row, if renamed
+        self.qty = None  # quantity now held by every row, if set
+
+
+class PendingDecisions:
+    """Append-only log of step 1 decisions on one inventory frame."""
+
+    def __init__(self, df, qty_col):
+        self.df = df
+        self.qty_col = qty_col if qty_col in df.columns else None
+        self.index = sku_index(df)
+        self.log = []
+        self._folded = 0
+        self._groups = {}
+
+    def __len__(self):
+        return len(self.log)
+
+    def __contains__(self, sku_norm):
+        """Whether the group still has rows."""
+        self._fold()
+        group = self._groups.get(sku_norm)
+        return len(group.positions) > 0 if group else sku_norm in self.index
+
+    # ---- Recording: O(1) per decision ----
+    def merge_duplicate(self, sku_norm, selected_sku):
+        self.log.append(("merge", sku_norm, selected_sku))
+
+    def delete_duplicate(self, sku_norm):
+        self.log.append(("delete", sku_norm))
+
+    def merge_fuzzy_cluster(self, sku_norms, selected_sku=None):
+        self.log.append(("merge_cluster", tuple(sku_norms), selected_sku))
+
+    # ---- Folding the log into per-group state: O(group size) per decision ----
+    def _group(self, sku_norm):
+        if sku_norm not in self._groups:
+            self._groups[sku_norm] = _Group(self.index.get(sku_norm, np.empty(0, dtype=np.intp)))
+        return self._groups[sku_norm]
+
+    def _quantities(self, group):
+        if group.qty is not None:
+            return zip(group.positions, [group.qty] * len(group.positions))
+        return zip(group.positions, self.df[self.qty_col].iloc[group.positions].tolist())
+
+    def _total(self, *groups):
+        """Summed quantity of the groups' current rows, as `engine._quantity(...).sum()` gives it."""
+        # In frame order: the dtype pandas infers for mixed values depends on it
+        values = [value for _, value in sorted(pair for group in groups for pair in self._quantities(group))]
+        return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").sum()
+
+    def _fold(self):
+        for action, *args in self.log[self._folded:]:
+            if action == "merge":
+                group = self._group(args[0])
+                if len(group.positions) == 0:
+                    continue
+                if self.qty_col is not None:
+                    group.qty = self._total(group)
+                group.positions = group.positions[:1]
+                group.sku = args[1]
+            elif action == "delete":
+                self._group(args[0]).positions = np.empty(0, dtype=np.intp)
+            elif action == "merge_cluster":
+                self._merge_cluster(*args)
+        self._folded = len(self.log)
+
+    def _current_sku(self, group, position):
+        return group.sku if group.sku is not None and position == group.positions[0] else self.df["SKU"].iat[position]
+
+    def _merge_cluster(self, sku_norms, selected_sku):
+        groups = [self._group(sku_norm) for sku_norm in dict.fromkeys(sku_norms)]
+        rows = sorted(((position, group) for group in groups for position in group.positions), key=lambda row: row[0])
+        if not rows:
+            return
+        if selected_sku is None:
+            selected_sku = self._current_sku(rows[0][1], rows[0][0])
+        keep, kept_group = next(
+            ((position, group) for position, group in rows if self._current_sku(group, position) == selected_sku), rows[0]
+        )
+        total = self._total(*groups) if self.qty_col is not None else None
+        for group in groups:
+            group.positions = np.empty(0, dtype=np.intp)
+        kept_group.positions = np.array([keep], dtype=np.intp)
+        kept_group.sku = selected_sku
+        if total is not None:
+            kept_group.qty = total
+
+    # ---- Reading ----
+    def rows(self, *sku_norms):
+        """Current rows of these groups, with the pending decisions applied."""
+        self._fold()
+        parts, renamed, quantities = [], {}, {}
+        for sku_norm in dict.fromkeys(sku_norms):
+            group = self._groups.get(sku_norm)
+            positions = group.positions if group else self.index.get(sku_norm, np.empty(0, dtype=np.intp))
+            parts.append(positions)
+            if group and len(positions):
+                if group.sku is not None:
+                    renamed[positions[0]] = group.sku
+                if group.qty is not None:
+                    quantities.update(dict.fromkeys(positions, group.qty))
+        positions = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.intp)
+        rows = self.df.iloc[positions].copy()
+        where = {position: i for i, position in enumerate(positions)}
+        self._write(rows, {where[p]: sku for p, sku in renamed.items()}, {where[p]: qty for p, qty in quantities.items()})
+        return rows
+
+    def _write(self, df, renamed, quantities):
+        """Set new SKUs and quantities, both keyed by row position in `df`."""
+        for col, values in (("SKU", renamed), (self.qty_col, quantities)):
+            if values:
+                df.iloc[list(values), df.columns.get_loc(col)] = pd.Series(list(values.values()), dtype=object).to_numpy()
+
+    @profiled("apply_decisions")
+    def apply(self):
+        """The frame with every logged decision applied, in one pass."""
+        self._fold()
+        if not self._groups:
+            return self.df
+        renamed, quantities, dropped = {}, {}, []
+        for sku_norm, group in self._groups.items():
+            original = self.index.get(sku_norm, np.empty(0, dtype=np.intp))
+            dropped.append(np.setdiff1d(original, group.positions))
+            if len(group.positions):
+                if group.sku is not None:
+                    renamed[group.positions[0]] = group.sku
+                if group.qty is not None:
+                    quantities.update(dict.fromkeys(group.positions, group.qty))
+        df = self.df.copy()
+        self._write(df, renamed, quantities)
+        keep = np.ones(len(df), dtype=bool)
+        keep[np.concatenate(dropped)] = False
+        return df[keep]
@@ -0,0 +1,195 @@
+"""Rules that settle the obvious review entries without a click.
+
+In the app every queue entry is one click, and every click reruns the whole
+script. `AutoRules` settles whole queues in one pass over each queue and
+leaves only what the rules cannot settle for review:
+
+* exact `SKU_NORM` duplicates merged, quantities summed;
+* near-duplicate clusters of structural variants (every member with the
+  same canonical signature and the same brand) merged;
+* step 2 pairs at or above a similarity merged when neither SKU has another
+  candidate left and, optionally, the brand matches;
+* step 2 pairs with a discontinued D-Tools item ignored.
+
+Each decision goes to the journal as a reviewer's would, plus the rule that
+took it, so a delta run replays it. Counts per rule go to a `Counter`.
+"""
+import re
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from reconciliation.dtypes import isin
+from reconciliation.normalization import canonical_signatures
+from reconciliation.profiling import profiled
+from reconciliation.review import PendingDecisions
+
+DISCONTINUED_COL = "Discontinued"
+QB_DESCRIPTION_COL = "Description de la vente"
+
+RULES = ("merge_duplicates", "merge_variants", "accept_similarity", "ignore_discontinued")
+
+_YES = {"YES", "Y", "OUI", "TRUE", "1"}
+_WORD = re.compile(r"[^0-9A-Z]+")
+
+
+@dataclass(frozen=True)
+class AutoRules:
+    """Which queue entries are settled automatically (all off by default)."""
+
+    merge_duplicates: bool = False     # step 1, exact duplicates
+    merge_variants: bool = False       # step 1, near-duplicate clusters of one signature and one brand
+    accept_similarity: float = None    # step 2, merge pairs at or above this score (0.80-1.0, like the threshold)
+    same_brand: bool = True            # ... only when the brand matches
+    ignore_discontinued: bool = False  # step 2, ignore pairs with a discontinued D-Tools item
+
+    def __post_init__(self):
+        if self.accept_similarity is not None and not 0.80 <= self.accept_similarity <= 1.0:
+            raise ValueError(f"accept_similarity must be between 0.80 and 1.0, got {self.accept_similarity!r}")
+
+    @property
+    def cross(self):
+        """Whether a step 2 rule is on."""
+        return self.accept_similarity is not None or self.ignore_discontinued
+
+
+def _record(journal, stage, action, rule, **details):
+    if journal is not None:
+        journal.record(stage, action, rule=rule, **details)
+
+
+# ------------------------- STEP 1 -------------------------
+@profiled("auto_duplicates")
+def resolve_duplicates(pending, source, queue, rules, resolved, journal=None):
+    """Log the rule decisions on a duplicate queue into `pending`. Returns the groups left to review.
+
+    The SKU kept is the group's first, as in `engine.apply_cleanup_policy`:
+    call this before any other decision is logged.
+    """
+    if not rules.merge_duplicates or not queue:
+        return list(queue)
+    first_sku = pending.df.drop_duplicates("SKU_NORM").set_index("SKU_NORM")["SKU"]
+    for sku_norm, selected_sku in zip(queue, first_sku.reindex(queue).tolist()):
+        pending.merge_duplicate(sku_norm, selected_sku)
+        _record(journal, "duplicates", "merge", "merge_duplicates", source=source, sku_norm=sku_norm, selected_sku=selected_sku)
+    resolved["merge_duplicates"] += len(queue)
+    return []
+
+
+def _variant_clusters(df, clusters):
+    """Whether every row of each cluster has the same canonical signature and the same non-empty brand.
+
+    Without a Brand column (QuickBooks) no cluster qualifies.
+    """
+    if "Brand" not in df.columns:
+        return np.zeros(len(clusters), dtype=bool)
+    members = pd.DataFrame(
+        [(i, sku_norm) for i, cluster in enumerate(clusters) for sku_norm in cluster], columns=["cluster", "sku_norm"]
+    )
+    rows = df[isin(df["SKU_NORM"], members["sku_norm"])]
+    brands = rows["Brand"].astype(object).fillna("").astype(str).str.strip()
+    rows = pd.DataFrame({
+        "sku_norm": rows["SKU_NORM"].to_numpy(),
+        "signature": canonical_signatures(rows["SKU_NORM"], rows["Brand"]).to_numpy(),
+        "brand": brands.mask(brands == "").to_numpy(),
+    })
+    members = members.merge(rows, on="sku_norm", how="left")
+    counts = members.groupby("cluster").agg(
+        signatures=("signature", "nunique"), brands=("brand", "nunique"), rows=("brand", "size"), branded=("brand", "count")
+    )
+    counts = counts.reindex(range(len(clusters)), fill_value=0)
+    return ((counts["signatures"] == 1) & (counts["brands"] == 1) & (counts["branded"] == counts["rows"])).to_numpy()
+
+
+@profiled("auto_clusters")
+def resolve_clusters(pending, source, clusters, rules, resolved, journal=None):
+    """Log the rule decisions on near-duplicate clusters into `pending`. Returns the clusters left to review."""
+    if not rules.merge_variants or not clusters:
+        return list(clusters)
+    remaining = []
+    for cluster, variant in zip(clusters, _variant_clusters(pending.df, clusters)):
+        if not variant:
+            remaining.append(cluster)
+            continue
+        skus = pending.rows(*cluster)["SKU"]
+        selected_sku = skus.iloc[0] if len(skus) else None
+        pending.merge_fuzzy_cluster(cluster, selected_sku)
+        _record(journal, "fuzzy_duplicates", "merge", "merge_variants", source=source, skus=list(cluster), selected_sku=selected_sku)
+        resolved["merge_variants"] += 1
+    return remaining
+
+
+def resolve_cleanup(df, source, qty_col, queue, clusters, rules, resolved, journal=None):
+    """Both step 1 rules on a frame: (frame with the decisions applied, duplicates left, clusters left)."""
+    pending = PendingDecisions(df, qty_col)
+    queue = resolve_duplicates(pending, source, queue, rules, resolved, journal)
+    clusters = resolve_clusters(pending, source, clusters, rules, resolved, journal)
+    return pending.apply(), queue, clusters
+
+
+# ------------------------- STEP 2 -------------------------
+def _words(text):
+    return set(_WORD.split(str(text).upper())) - {""}
+
+
+def _brand_matches(brands, texts):
+    """Whether each D-Tools brand is a QuickBooks brand / in a QuickBooks description (all of its words)."""
+    return np.array([
+        isinstance(brand, str) and bool(_words(brand)) and _words(brand) <= _words(text)
+        for brand, text in zip(brands.tolist(), texts.tolist())
+    ], dtype=bool)
+
+
+def _discontinued(df_dt, dt_full):
+    """D-Tools SKUs flagged discontinued, from `df_dt` or the same rows of the complete file."""
+    if DISCONTINUED_COL in df_dt.columns:
+        flags = df_dt[DISCONTINUED_COL]
+    elif dt_full is not None and DISCONTINUED_COL in dt_full.columns:
+        flags = dt_full[DISCONTINUED_COL].reindex(df_dt.index)
+    else:
+        return []
+    flagged = flags.astype(object).fillna("").astype(str).str.strip().str.upper().isin(_YES).to_numpy()
+    return df_dt.loc[flagged, "SKU"].dropna().unique().tolist()
+
+
+@profiled("auto_cross_matches")
+def resolve_cross_matches(queue, df_qb, df_dt, rules, resolved, journal=None, dt_full=None):
+    """Apply the step 2 rules to a queue (best first). Returns (pairs merged, pairs left to review).
+
+    `dt_full` is the complete D-Tools file when `df_dt` lacks the
+    Discontinued column. The brand of a QuickBooks row is its Brand column,
+    else its description.
+    """
+    if not rules.cross or not queue:
+        return [], list(queue)
+    pairs = pd.DataFrame(queue)
+    ignore = np.zeros(len(pairs), dtype=bool)
+    if rules.ignore_discontinued:
+        ignore = isin(pairs["D-Tools SKU"], _discontinued(df_dt, dt_full)).to_numpy()
+
+    accept = np.zeros(len(pairs), dtype=bool)
+    if rules.accept_similarity is not None:
+        # Unambiguous: no other pair left for either SKU
+        left = pairs[~ignore]
+        sole = ~left["QuickBooks SKU"].duplicated(keep=False) & ~left["D-Tools SKU"].duplicated(keep=False)
+        accept[~ignore] = (sole & (left["Similitude"] >= rules.accept_similarity * 100)).to_numpy()
+        if rules.same_brand and accept.any():
+            qb_col = "Brand" if "Brand" in df_qb.columns else QB_DESCRIPTION_COL
+            qb_text = df_qb.drop_duplicates("SKU").set_index("SKU")[qb_col] if qb_col in df_qb.columns else pd.Series(dtype=object)
+            dt_brand = df_dt.drop_duplicates("SKU").set_index("SKU")["Brand"] if "Brand" in df_dt.columns else pd.Series(dtype=object)
+            candidates = pairs[accept]
+            accept[accept] = _brand_matches(
+                candidates["D-Tools SKU"].map(dt_brand).astype(object), candidates["QuickBooks SKU"].map(qb_text).astype(object)
+            )
+
+    for rule, action, mask in (("ignore_discontinued", "ignore", ignore), ("accept_similarity", "merge", accept)):
+        for fuzzy_match in pairs[mask].to_dict("records"):
+            _record(
+                journal, "cross_matches", action, rule,
+                qb_sku=fuzzy_match["QuickBooks SKU"], dt_sku=fuzzy_match["D-Tools SKU"], score=fuzzy_match["Similitude"],
+            )
+        if mask.any():
+            resolved[rule] += int(mask.sum())
+    merged = [queue[i] for i in np.flatnonzero(accept)]
+    return merged, [queue[i] for i in np.flatnonzero(~(accept | ignore))]
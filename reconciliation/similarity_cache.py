@@ -0,0 +1,187 @@
+"""On-disk store of SKU similarity scores.
+
+Every pair scoring above `SIMILARITY_FLOOR` (the slider's minimum) is kept in a
+SQLite database, so moving the threshold slider only filters stored scores and
+re-uploading the same files skips matching entirely.
+
+Entries are keyed by the content hash of the uploaded file(s). A score only
+depends on the two SKU strings, so an entry also remembers which SKUs it has
+scored: SKUs it has not seen yet (e.g. a SKU renamed during step 1) are scored
+and added, the rest come from disk. Entries are evicted least recently used
+first once the database grows past `max_bytes`.
+
+Scoring runs outside any transaction. The write lock is only taken to store
+the result: the known SKUs are read again under it, and the new SKUs are
+scored against any another session added in the meantime before the insert,
+so every known SKU is always scored against every other.
+"""
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+from reconciliation.matching import cross_fuzzy_match, fuzzy_match_scores
+
+SIMILARITY_FLOOR = 0.80
+
+CACHE_DIR = os.environ.get(
+    "INVENTORY_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "inventory_reconciliation")
+)
+CACHE_MAX_BYTES = int(os.environ.get("INVENTORY_CACHE_MAX_MB", "500")) * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, last_used REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS skus (
+    key TEXT NOT NULL, side INTEGER NOT NULL, sku TEXT NOT NULL,
+    PRIMARY KEY (key, side, sku)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS pairs (
+    key TEXT NOT NULL, sku1 TEXT NOT NULL, sku2 TEXT NOT NULL, score REAL NOT NULL,
+    PRIMARY KEY (key, sku1, sku2)
+) WITHOUT ROWID;
+PRAGMA user_version = 1;
+"""
+# Version 0 stored pairs without a primary key, duplicates included
+_SCHEMA_VERSION = 1
+_DROP_OLD_SCHEMA = """
+DROP INDEX IF EXISTS pairs_key;
+DROP TABLE IF EXISTS pairs;
+DROP TABLE IF EXISTS skus;
+DROP TABLE IF EXISTS entries;
+"""
+
+
+def content_hash(data):
+    """Return the SHA-256 hex digest of a file's bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class SimilarityCache:
+    """SQLite-backed similarity store with size-bounded LRU eviction."""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "similarity.sqlite")
+        self.max_bytes = max_bytes
+        with closing(self._connect()) as conn:
+            # Must be set before the first table exists to take effect
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+                conn.executescript(_DROP_OLD_SCHEMA)
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        # One connection per call: Streamlit reruns the script on different threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _begin(self, conn):
+        # Take the write lock before reading the known SKUs again, not at the first insert
+        conn.execute("BEGIN IMMEDIATE")
+
+    def self_pairs(self, key, skus, job=None):
+        """Return (sku1, sku2, score) for every pair of `skus` above the floor, in input order.
+
+        `job` (a `parallel.Job`) reports the scoring of new SKUs and can cancel it.
+        """
+        skus = list(dict.fromkeys(skus))
+        with closing(self._connect()) as conn:
+            known = self._known(conn, key, 0)
+            new = [sku for sku in skus if sku not in known]
+            scored = []
+            if new:
+                scored = fuzzy_match_scores(new, SIMILARITY_FLOOR, job=job)
+                scored += cross_fuzzy_match(new, known, SIMILARITY_FLOOR, job=job)
+            with conn:
+                self._begin(conn)
+                if new:
+                    now_known = self._known(conn, key, 0)
+                    added = list(now_known - known - set(new))
+                    new = [sku for sku in new if sku not in now_known]
+                    scored += cross_fuzzy_match(new, added, SIMILARITY_FLOOR, job=job)
+                    # One order per pair, whichever session scored it
+                    scored = [(min(sku1, sku2), max(sku1, sku2), score) for sku1, sku2, score in scored]
+                    self._add(conn, key, {0: new}, scored)
+                stored = self._pairs(conn, key)
+
+        position = {sku: i for i, sku in enumerate(skus)}
+        pairs = []
+        for sku1, sku2, score in stored:
+            if sku1 in position and sku2 in position:
+                if position[sku1] > position[sku2]:
+                    sku1, sku2 = sku2, sku1
+                pairs.append((sku1, sku2, score))
+        pairs.sort(key=lambda pair: (position[pair[0]], position[pair[1]]))
+        return pairs
+
+    def cross_pairs(self, key, left_skus, right_skus, job=None):
+        """Return (left_sku, right_sku, score) for every cross pair above the floor, best first."""
+        left = list(dict.fromkeys(left_skus))
+        right = list(dict.fromkeys(right_skus))
+        with closing(self._connect()) as conn:
+            known_left = self._known(conn, key, 0)
+            known_right = self._known(conn, key, 1)
+            new_left = [sku for sku in left if sku not in known_left]
+            new_right = [sku for sku in right if sku not in known_right]
+            scored = []
+            if new_left or new_right:
+                scored = cross_fuzzy_match(new_left, list(known_right) + new_right, SIMILARITY_FLOOR, job=job)
+                scored += cross_fuzzy_match(known_left, new_right, SIMILARITY_FLOOR, job=job)
+            with conn:
+                self._begin(conn)
+                if new_left or new_right:
+                    now_left, now_right = self._known(conn, key, 0), self._known(conn, key, 1)
+                    added_left = list(now_left - known_left - set(new_left))
+                    added_right = list(now_right - known_right - set(new_right))
+                    new_left = [sku for sku in new_left if sku not in now_left]
+                    new_right = [sku for sku in new_right if sku not in now_right]
+                    scored += cross_fuzzy_match(new_left, added_right, SIMILARITY_FLOOR, job=job)
+                    scored += cross_fuzzy_match(added_left, new_right, SIMILARITY_FLOOR, job=job)
+                    self._add(conn, key, {0: new_left, 1: new_right}, scored)
+                stored = self._pairs(conn, key)
+
+        left_position = {sku: i for i, sku in enumerate(left)}
+        right_position = {sku: i for i, sku in enumerate(right)}
+        pairs = [pair for pair in stored if pair[0] in left_position and pair[1] in right_position]
+        pairs.sort(key=lambda pair: (-pair[2], left_position[pair[0]], right_position[pair[1]]))
+        return pairs
+
+    def _known(self, conn, key, side):
+        rows = conn.execute("SELECT sku FROM skus WHERE key = ? AND side = ?", (key, side))
+        return {sku for (sku,) in rows}
+
+    def _pairs(self, conn, key):
+        conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return conn.execute("SELECT sku1, sku2, score FROM pairs WHERE key = ?", (key,)).fetchall()
+
+    def _add(self, conn, key, skus_by_side, scored):
+        conn.execute(
+            "INSERT INTO entries (key, last_used) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET last_used = excluded.last_used",
+            (key, time.time()),
+        )
+        for side, skus in skus_by_side.items():
+            conn.executemany("INSERT OR IGNORE INTO skus VALUES (?, ?, ?)", ((key, side, sku) for sku in skus))
+        conn.executemany(
+            "INSERT OR IGNORE INTO pairs VALUES (?, ?, ?, ?)",
+            ((key, sku1, sku2, score) for sku1, sku2, score in scored),
+        )
+        self._evict(conn, keep=key)
+
+    def _evict(self, conn, keep):
+        """Drop least recently used entries until the database fits in `max_bytes`."""
+        while self._size(conn) > self.max_bytes:
+            oldest = conn.execute(
+                "SELECT key FROM entries WHERE key != ? ORDER BY last_used LIMIT 1", (keep,)
+            ).fetchone()
+            if oldest is None:
+                break
+            for table in ("entries", "skus", "pairs"):
+                conn.execute(f"DELETE FROM {table} WHERE key = ?", oldest)
+        conn.execute("PRAGMA incremental_vacuum")
+
+    def _size(self, conn):
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return (page_count - free_pages) * page_size
@@ -0,0 +1,417 @@
+"""Out-of-core working frames: the inventories in a SQLite file instead of memory.
+
+Working frames are pandas frames, so the largest inventory is bounded by RAM.
+An `InventoryStore` streams each export into a table of a local SQLite
+database a chunk at a time (see `ingest.iter_inventory`), one row per file
+row, with indexes on `SKU` and `SKU_NORM`. The steps that touch every row run
+as indexed SQL:
+
+* step 1: the duplicate queue is a GROUP BY; merging or deleting every group
+  is one UPDATE and one DELETE;
+* step 2: the exact matches and both residuals are (anti-)joins on `SKU`,
+  kept as the views `VIEWS`;
+* step 3: each D-Tools row gets its QuickBooks quantity from a join with the
+  per-SKU quantities and the pairs merged, streamed to the export in chunks.
+
+Only the columns the fuzzy matching and the identifier join need are read
+back into pandas, from the residuals, and `page` reads one page of a table
+for display. A quantity is stored as a number when its text reads back the
+same ("12" -> 12) and as text otherwise, value by value where working frames
+decide for the whole column (see `dtypes`).
+
+The store backs `cli --store` only. The app keeps its working frames in
+memory and pages them with `table_view`; `count` and `page` answer the same
+`table_view.Query` for a store table, for a viewer over a store database,
+and are not wired into the app's step 1-3 tables.
+"""
+import hashlib
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from reconciliation import engine
+from reconciliation.dtypes import TEXT_DTYPE, plain_quantities, quantity_text
+from reconciliation.identifiers import DT_IDENTIFIER_COLUMNS, IDENTIFIER_KEYS, QB_IDENTIFIER_COLUMNS
+from reconciliation.ingest import iter_inventory
+from reconciliation.normalization import DEFAULT_RULES, normalize_skus
+from reconciliation.profiling import profiled
+
+# Quantity column of each source table
+SOURCES = {"qb": engine.QB_QTY_COL, "dt": engine.DT_QTY_COL}
+VIEWS = ("exact_matches", "mismatched_qb", "mismatched_dt")
+
+EXPORT_CHUNK_ROWS = 10_000
+PARAMS_PER_QUERY = 500  # Below SQLite's limit on bound parameters
+
+_VIEWS_SQL = """
+CREATE VIEW IF NOT EXISTS exact_matches AS
+    SELECT * FROM qb WHERE EXISTS (SELECT 1 FROM dt WHERE dt."SKU" IS qb."SKU");
+CREATE VIEW IF NOT EXISTS mismatched_qb AS
+    SELECT * FROM qb WHERE NOT EXISTS (SELECT 1 FROM dt WHERE dt."SKU" IS qb."SKU");
+CREATE VIEW IF NOT EXISTS mismatched_dt AS
+    SELECT * FROM dt WHERE NOT EXISTS (SELECT 1 FROM qb WHERE qb."SKU" IS dt."SKU");
+"""
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _numeric(col):
+    return f"CASE WHEN typeof({col}) IN ('integer', 'real') THEN {col} END"
+
+
+def typed_quantities(values):
+    """Quantities as numbers where the text reads back the same ("12" -> 12), else as text; missing as None."""
+    numbers = pd.to_numeric(values, errors="coerce")
+    readable = quantity_text(numbers).eq(values.astype(TEXT_DTYPE)).to_numpy(dtype=bool, na_value=False)
+    text = values.astype(object).where(values.notna(), None)
+    return pd.Series(np.where(readable, plain_quantities(numbers), text), index=values.index, dtype=object)
+
+
+def file_hash(source):
+    """`engine.source_hash`, reading a path a block at a time."""
+    if hasattr(source, "getvalue"):
+        return engine.source_hash(source)
+    digest = hashlib.sha256()
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class InventoryStore:
+    """Both inventories as tables `qb` and `dt` of a SQLite file, `_row` the file row and `_sku_norm` the SKU_NORM."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        # A scratch database: rebuilt from the exports, never worth an fsync
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute("PRAGMA journal_mode = MEMORY")
+        self.columns = {}  # source -> file columns, in order
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------- LOAD -------------------------
+    @profiled("store_load")
+    def load(self, source, file, name=None, rules=DEFAULT_RULES):
+        """Stream an export (path or uploaded file) into the `source` table, "qb" or "dt"."""
+        if source not in SOURCES:
+            raise ValueError(f"source must be one of {tuple(SOURCES)}, got {source!r}")
+        qty_col = SOURCES[source]
+        with self.conn:
+            self.conn.execute(f"DROP TABLE IF EXISTS {source}")
+            columns = None
+            for chunk in iter_inventory(file, name):
+                if columns is None:
+                    if "SKU" not in chunk.columns:
+                        raise ValueError(f"The {source} export has no SKU column")
+                    columns = chunk.columns.tolist()
+                    self.conn.execute(
+                        f"CREATE TABLE {source} (_row INTEGER PRIMARY KEY, _sku_norm, {', '.join(map(_quote, columns))})"
+                    )
+                rows = chunk.astype(object).where(chunk.notna(), None)
+                if qty_col in rows.columns:
+                    rows[qty_col] = typed_quantities(chunk[qty_col])
+                rows.insert(0, "_sku_norm", normalize_skus(chunk["SKU"], rules))
+                rows.insert(0, "_row", chunk.index)
+                placeholders = ", ".join("?" * rows.shape[1])
+                self.conn.executemany(f"INSERT INTO {source} VALUES ({placeholders})", rows.itertuples(index=False))
+            if columns is None:
+                columns = ["SKU"]
+                self.conn.execute(f'CREATE TABLE {source} (_row INTEGER PRIMARY KEY, _sku_norm, "SKU")')
+            self.conn.execute(f'CREATE INDEX {source}_sku ON {source} ("SKU")')
+            self.conn.execute(f"CREATE INDEX {source}_sku_norm ON {source} (_sku_norm)")
+        self.columns[source] = columns
+        if len(self.columns) == len(SOURCES):
+            self.conn.executescript(_VIEWS_SQL)
+
+    # ------------------------- READ -------------------------
+    def _table_columns(self, table):
+        return self.columns["dt" if table in ("dt", "mismatched_dt") else "qb"]
+
+    def frame(self, table, columns=None):
+        """`table` (a source or one of `VIEWS`) as a working frame: file rows as labels, `SKU_NORM` column.
+
+        Only `columns` (default: all) present in the file are read, plus `SKU`.
+        """
+        wanted = [col for col in self._table_columns(table) if columns is None or col in columns or col == "SKU"]
+        rows = self.conn.execute(f"SELECT _row, _sku_norm, {', '.join(map(_quote, wanted))} FROM {table} ORDER BY _row")
+        df = pd.DataFrame.from_records(rows.fetchall(), columns=["_row", "SKU_NORM", *wanted])
+        df = df.set_index("_row").rename_axis(None)
+        return df.astype({col: TEXT_DTYPE for col in df.columns if col not in SOURCES.values()})
+
+    def _where(self, table, query):
+        if query is None or not query.text:
+            return "", []
+        pattern = "%" + query.text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        columns = self._table_columns(table)
+        # LIKE ignores the case of ASCII letters only
+        return (
+            " WHERE " + " OR ".join(f"CAST({_quote(col)} AS TEXT) LIKE ? ESCAPE '\\'" for col in columns),
+            [pattern] * len(columns),
+        )
+
+    def count(self, table, query=None):
+        """Rows of `table` matching `query` (a `table_view.Query`)."""
+        where, params = self._where(table, query)
+        return self.conn.execute(f"SELECT COUNT(*) FROM {table}{where}", params).fetchone()[0]
+
+    def page(self, table, query, number, page_size, columns=None):
+        """Page `number` (from 1) of the rows of `table` matching `query`, as `table_view.TableView.page`."""
+        shown = [col for col in self._table_columns(table) if columns is None or col in columns]
+        where, params = self._where(table, query)
+        order = "_row"
+        if query is not None and query.sort_by in self._table_columns(table):
+            order = f"{_quote(query.sort_by)} {'ASC' if query.ascending else 'DESC'} NULLS LAST, _row"
+        rows = self.conn.execute(
+            f"SELECT _row, {', '.join(map(_quote, shown))} FROM {table}{where} ORDER BY {order} LIMIT ? OFFSET ?",
+            [*params, page_size, (number - 1) * page_size],
+        )
+        return pd.DataFrame.from_records(rows.fetchall(), columns=["_row", *shown]).set_index("_row").rename_axis(None)
+
+    # ------------------------- STEP 1 -------------------------
+    @profiled("duplicate_queue")
+    def duplicate_queue(self, source):
+        """`engine.duplicate_queue` of a source table."""
+        rows = self.conn.execute(
+            f"SELECT _sku_norm FROM {source} GROUP BY _sku_norm HAVING COUNT(*) > 1 ORDER BY MIN(_row)"
+        )
+        return [sku_norm for (sku_norm,) in rows]
+
+    def _total(self, source):
+        qty = _quote(SOURCES[source])
+        return f"TOTAL({_numeric(qty)})" if SOURCES[source] in self.columns[source] else "NULL"
+
+    def merge_duplicates(self, source):
+        """Collapse every duplicate group into its first row, holding the summed quantity (`engine.merge_duplicate`)."""
+        with self.conn:
+            self.conn.execute("DROP TABLE IF EXISTS temp.duplicate_groups")
+            self.conn.execute(
+                f"CREATE TEMP TABLE duplicate_groups AS SELECT _sku_norm, MIN(_row) AS keep, {self._total(source)} AS total "
+                f"FROM {source} GROUP BY _sku_norm HAVING COUNT(*) > 1"
+            )
+            if SOURCES[source] in self.columns[source]:
+                qty = _quote(SOURCES[source])
+                self.conn.execute(
+                    f"UPDATE {source} SET {qty} = CASE WHEN g.total = CAST(g.total AS INTEGER) "
+                    f"THEN CAST(g.total AS INTEGER) ELSE g.total END FROM duplicate_groups g WHERE {source}._row = g.keep"
+                )
+            self.conn.execute(
+                f"DELETE FROM {source} WHERE _sku_norm IN (SELECT _sku_norm FROM duplicate_groups) "
+                f"AND _row NOT IN (SELECT keep FROM duplicate_groups)"
+            )
+
+    def delete_duplicates(self, source):
+        """Drop every row of every duplicate group (`engine.delete_duplicate`)."""
+        with self.conn:
+            self.conn.execute(
+                f"DELETE FROM {source} WHERE _sku_norm IN "
+                f"(SELECT _sku_norm FROM {source} GROUP BY _sku_norm HAVING COUNT(*) > 1)"
+            )
+
+    def merge_group(self, source, sku_norms, selected_sku=None):
+        """`engine.merge_fuzzy_cluster` on a source table."""
+        norms = list(sku_norms)
+        rows = self.conn.execute(
+            f'SELECT _row, "SKU" FROM {source} WHERE _sku_norm IN ({", ".join("?" * len(norms))}) ORDER BY _row', norms
+        ).fetchall()
+        if not rows:
+            return
+        if selected_sku is None:
+            selected_sku = rows[0][1]
+        keep = next((row for row, sku in rows if sku == selected_sku), rows[0][0])
+        others = [row for row, _ in rows if row != keep]
+        with self.conn:
+            if SOURCES[source] in self.columns[source]:
+                total = self.conn.execute(
+                    f"SELECT {self._total(source)} FROM {source} WHERE _row IN ({', '.join('?' * len(rows))})",
+                    [row for row, _ in rows],
+                ).fetchone()[0]
+                self.conn.execute(
+                    f"UPDATE {source} SET {_quote(SOURCES[source])} = ? WHERE _row = ?",
+                    (int(total) if float(total).is_integer() else total, keep),
+                )
+            self.conn.execute(f'UPDATE {source} SET "SKU" = ? WHERE _row = ?', (selected_sku, keep))
+            self.conn.execute(f"DELETE FROM {source} WHERE _row IN ({', '.join('?' * len(others))})", others)
+
+    # ------------------------- STEP 3 -------------------------
+    def _existing(self, source, skus):
+        found = set()
+        skus = list(dict.fromkeys(skus))
+        for start in range(0, len(skus), PARAMS_PER_QUERY):
+            part = skus[start:start + PARAMS_PER_QUERY]
+            rows = self.conn.execute(f'SELECT DISTINCT "SKU" FROM {source} WHERE "SKU" IN ({", ".join("?" * len(part))})', part)
+            found.update(sku for (sku,) in rows)
+        return found
+
+    def _pair(self, fuzzy_selected):
+        """The pairs `engine.quantity_map` uses, in the temp table `paired`."""
+        in_qb = self._existing("qb", [
+            sku for fuzzy_match in fuzzy_selected for sku in (fuzzy_match["QuickBooks SKU"], fuzzy_match["D-Tools SKU"])
+        ])
+        paired, paired_qb = {}, set()
+        for fuzzy_match in fuzzy_selected:
+            qb_sku, dt_sku = fuzzy_match["QuickBooks SKU"], fuzzy_match["D-Tools SKU"]
+            if dt_sku in in_qb or dt_sku in paired or qb_sku in paired_qb or qb_sku not in in_qb:
+                continue
+            paired[dt_sku] = qb_sku
+            paired_qb.add(qb_sku)
+        self.conn.execute("DROP TABLE IF EXISTS temp.paired")
+        self.conn.execute("CREATE TEMP TABLE paired (dt_sku PRIMARY KEY, qb_sku)")
+        self.conn.executemany("INSERT INTO paired VALUES (?, ?)", paired.items())
+
+    def final_columns(self):
+        """Columns of the final inventory, as `engine.build_final_output` gives them."""
+        columns = [col for col in self.columns["dt"] if not str(col).startswith("Unnamed")] + ["SKU_NORM"]
+        return columns if engine.DT_QTY_COL in columns else [*columns, engine.DT_QTY_COL]
+
+    @profiled("merge")
+    def _prepare(self, fuzzy_selected):
+        """Temp tables of the final query: the pairs merged, the QuickBooks quantity of each SKU."""
+        self._pair(fuzzy_selected)
+        qb_qty = _quote(engine.QB_QTY_COL)
+        with self.conn:
+            self.conn.execute("DROP TABLE IF EXISTS temp.qb_quantity")
+            self.conn.execute("CREATE TEMP TABLE qb_quantity (sku PRIMARY KEY, qty)")
+            if engine.QB_QTY_COL in self.columns["qb"]:
+                # A SKU on one row keeps its quantity as is, on several their sum (`engine.quantity_map`);
+                # missing SKUs match each other, as in pandas
+                self.conn.execute(
+                    f'INSERT INTO qb_quantity SELECT "SKU", CASE WHEN COUNT(*) = 1 THEN MAX({qb_qty}) '
+                    f'ELSE SUM({_numeric(qb_qty)}) END FROM qb GROUP BY "SKU"'
+                )
+
+    def _final_query(self):
+        own = f"d.{_quote(engine.DT_QTY_COL)}" if engine.DT_QTY_COL in self.columns["dt"] else "NULL"
+        quantity = f"COALESCE(exact.qty, pair.qty, {own})"
+        selected = [
+            f"{quantity if col == engine.DT_QTY_COL else 'd._sku_norm' if col == 'SKU_NORM' else f'd.{_quote(col)}'} "
+            f"AS {_quote(col)}"
+            for col in self.final_columns()
+        ]
+        return (
+            f"SELECT {', '.join(selected)} FROM dt d "
+            f'LEFT JOIN qb_quantity exact ON exact.sku IS d."SKU" '
+            f'LEFT JOIN paired ON paired.dt_sku = d."SKU" '
+            f"LEFT JOIN qb_quantity pair ON pair.sku = paired.qb_sku "
+            f"ORDER BY d._row"
+        )
+
+    def final_chunks(self, fuzzy_selected, chunk_rows=EXPORT_CHUNK_ROWS):
+        """The final inventory (`engine.build_final_output`), as successive frames of `chunk_rows` rows."""
+        self._prepare(fuzzy_selected)
+        yield from self._chunks(chunk_rows)
+
+    def _chunks(self, chunk_rows):
+        columns = self.final_columns()
+        cursor = self.conn.execute(self._final_query())
+        while rows := cursor.fetchmany(chunk_rows):
+            chunk = pd.DataFrame.from_records(rows, columns=columns)
+            chunk[engine.DT_QTY_COL] = plain_quantities(chunk[engine.DT_QTY_COL])
+            yield chunk
+
+    def _parquet_quantity_dtype(self, chunk_rows):
+        """dtype of the quantity in a Parquet export, as `engine._parquet_frame` picks it for the whole column."""
+        cursor = self.conn.execute(f"SELECT {_quote(engine.DT_QTY_COL)} FROM ({self._final_query()})")
+        numeric, floats = True, False
+        while rows := cursor.fetchmany(chunk_rows):
+            values = pd.Series([qty for (qty,) in rows], dtype=object)
+            qty = pd.to_numeric(values, errors="coerce")
+            numeric &= qty.notna().sum() == values.notna().sum()
+            floats |= qty.dtype.kind == "f"
+        return "float64" if numeric and floats else "int64" if numeric else "string"
+
+    @profiled("export")
+    def export(self, fuzzy_selected, path, chunk_rows=EXPORT_CHUNK_ROWS):
+        """Stream the final inventory to .xlsx, `;`-separated .csv or .parquet, as `engine.export`. Returns its rows."""
+        columns = self.final_columns()
+        self._prepare(fuzzy_selected)
+        chunks = self._chunks(chunk_rows)
+        written = 0
+        if path.endswith(".csv"):
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                for chunk in chunks:
+                    chunk.to_csv(f, index=False, sep=";", header=written == 0)
+                    written += len(chunk)
+            if written == 0:
+                pd.DataFrame(columns=columns).to_csv(path, index=False, sep=";")
+        elif path.endswith(".parquet"):
+            qty_dtype = self._parquet_quantity_dtype(chunk_rows)
+            writer = None
+            for chunk in chunks:
+                chunk = chunk.astype({col: "string" for col in chunk.columns if col != engine.DT_QTY_COL})
+                qty = chunk[engine.DT_QTY_COL]
+                chunk[engine.DT_QTY_COL] = qty.astype("string") if qty_dtype == "string" else pd.to_numeric(qty).astype(qty_dtype)
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+                written += len(chunk)
+            if writer is None:
+                pd.DataFrame(columns=columns).to_parquet(path, index=False)
+            else:
+                writer.close()
+        else:
+            def counted():
+                nonlocal written
+                for chunk in chunks:
+                    written += len(chunk)
+                    yield chunk
+            engine.write_excel_chunks(columns, counted(), path)
+        return written
+
+
+# ------------------------- BATCH RUN -------------------------
+def _clean(store, source, policy, threshold, cache, key):
+    """`engine.clean_source` with the policy only, on a store table."""
+    clusters = []
+    if policy.fuzzy_duplicates == "merge":
+        clusters = engine.fuzzy_duplicates(store.frame(source, ["Brand"]), threshold, cache, key)
+    if policy.duplicates == "merge":
+        store.merge_duplicates(source)
+    elif policy.duplicates == "delete":
+        store.delete_duplicates(source)
+    for cluster in clusters:
+        store.merge_group(source, cluster)
+
+
+@profiled("reconcile")
+def reconcile_store(
+    qb_source, dt_source, output, path, policy=None, threshold=0.95, cache=None, top_k=None,
+    identifier_keys=IDENTIFIER_KEYS,
+):
+    """`engine.reconcile` through an `InventoryStore` at `path`, exporting straight to `output`. Returns the rows written.
+
+    No journal and no `AutoRules`: those need the working frames in memory.
+    """
+    policy = policy or engine.DecisionPolicy()
+    qb_hash, dt_hash = (file_hash(source) if cache is not None else None for source in (qb_source, dt_source))
+    with InventoryStore(path) as store:
+        store.load("qb", qb_source)
+        store.load("dt", dt_source)
+        _clean(store, "qb", policy, threshold, cache, f"self:{qb_hash}")
+        _clean(store, "dt", policy, threshold, cache, f"self:{dt_hash}")
+
+        mismatched_qb = store.frame("mismatched_qb", QB_IDENTIFIER_COLUMNS)
+        mismatched_dt = store.frame("mismatched_dt", DT_IDENTIFIER_COLUMNS)
+        paired = engine.identifier_matches(mismatched_qb, mismatched_dt, keys=identifier_keys)
+        mismatched_qb, mismatched_dt = engine.drop_paired(mismatched_qb, mismatched_dt, paired)
+        fuzzy_selected = []
+        if policy.cross_matches == "merge":
+            queue = engine.cross_matches(
+                mismatched_qb, mismatched_dt, threshold, cache, f"cross:{qb_hash}:{dt_hash}", top_k=top_k
+            )
+            fuzzy_selected = engine.apply_cross_policy(queue, policy)
+        return store.export(paired + fuzzy_selected, output)
@@ -0,0 +1,171 @@
+"""Synthetic QuickBooks / D-Tools inventory pairs for benchmarking.
+
+Rows are copies of real rows of the bundled exports (same columns, same kind
+of values), with generated SKUs: each one takes the shape of a real SKU
+(letters, digits and separators in the same places) with random characters,
+so lengths and separators follow the real catalog and unrelated SKUs rarely
+look alike. On top of that, `SyntheticSpec` controls how many rows are:
+
+* exact duplicates: the same SKU again in the same file;
+* variants: the SKU with other case / spaces / dots, i.e. the same `SKU_NORM`;
+* typos: one character substituted, dropped or swapped, a near-duplicate;
+* drifted: in QuickBooks, a D-Tools SKU entered with a variant or a typo.
+
+    python -m reconciliation.synthetic 10000 -o /tmp/synthetic
+"""
+import argparse
+import os
+import string
+import sys
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from reconciliation.engine import DT_QTY_COL, QB_QTY_COL, load_inventory
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QB_TEMPLATE = os.path.join(REPO_DIR, "qb_inventory.xlsx")
+DT_TEMPLATE = os.path.join(REPO_DIR, "dtools_inventory.csv")
+
+LETTERS = np.array(list(string.ascii_uppercase))
+DIGITS = np.array(list(string.digits))
+
+
+@dataclass
+class SyntheticSpec:
+    """Rates are fractions of the D-Tools catalog size `n_skus`."""
+
+    n_skus: int = 10_000
+    duplicate_rate: float = 0.01  # exact duplicate rows, in each file
+    variant_rate: float = 0.02    # separator / case variants, in each file
+    typo_rate: float = 0.01       # one-edit near-duplicates, in each file
+    overlap_rate: float = 0.85    # D-Tools products also in QuickBooks
+    drift_rate: float = 0.03      # of the shared products, SKU entered differently in QuickBooks
+    qb_only_rate: float = 0.10    # QuickBooks products unknown to D-Tools
+    seed: int = 0
+
+
+def _random_like(skus, rng):
+    """New SKUs with the letter / digit / separator layout of `skus`."""
+    out = []
+    for sku in skus:
+        chars = list(sku.upper())
+        for i, char in enumerate(chars):
+            if char.isdigit():
+                chars[i] = DIGITS[rng.integers(10)]
+            elif char.isalpha():
+                chars[i] = LETTERS[rng.integers(26)]
+        out.append("".join(chars))
+    return out
+
+
+def _unique_skus(shapes, n, rng):
+    skus, seen = [], set()
+    while len(skus) < n:
+        for sku in _random_like(rng.choice(shapes, n - len(skus)), rng):
+            if sku not in seen:
+                seen.add(sku)
+                skus.append(sku)
+    return skus
+
+
+def variant(sku, rng):
+    """Same product, same `SKU_NORM`: other case, a space or a dot between characters."""
+    kind = rng.integers(3)
+    if kind == 0 or len(sku) < 2:
+        return sku.lower()
+    i = int(rng.integers(1, len(sku)))
+    if kind == 1 or sku[i - 1].isdigit():  # A dot right after a digit is kept by the normalization
+        return f"{sku[:i]} {sku[i:]}"
+    return f"{sku[:i]}.{sku[i:]}"
+
+
+def typo(sku, rng):
+    """One substitution, deletion or transposition."""
+    if len(sku) < 3:
+        return sku + LETTERS[rng.integers(26)]
+    i = int(rng.integers(len(sku) - 1))
+    kind = rng.integers(3)
+    if kind == 0:
+        pool = DIGITS if sku[i].isdigit() else LETTERS
+        return sku[:i] + next(c for c in rng.permutation(pool) if c != sku[i]) + sku[i + 1:]
+    if kind == 1:
+        return sku[:i] + sku[i + 1:]
+    return sku[:i] + sku[i + 1] + sku[i] + sku[i + 2:]
+
+
+def _with_noise(skus, spec, rng):
+    """Catalog SKUs plus the within-file duplicates, variants and typos, shuffled."""
+    n = spec.n_skus
+    extra = []
+    for rate, make in ((spec.duplicate_rate, lambda sku, rng: sku), (spec.variant_rate, variant), (spec.typo_rate, typo)):
+        extra += [make(sku, rng) for sku in rng.choice(skus, int(n * rate))]
+    all_skus = np.array(list(skus) + extra, dtype=object)
+    return all_skus[rng.permutation(len(all_skus))]
+
+
+def _rows(template, skus, qty_col, rng):
+    """Rows copied from the real template, with new SKUs and quantities."""
+    df = template.iloc[rng.integers(len(template), size=len(skus))].reset_index(drop=True)
+    df["SKU"] = skus
+    df[qty_col] = rng.integers(-2, 50, size=len(skus)).astype(str)
+    return df
+
+
+def generate(spec=None, qb_template=QB_TEMPLATE, dt_template=DT_TEMPLATE):
+    """Return (qb, dt) inventory frames with the real column layouts."""
+    spec = spec or SyntheticSpec()
+    rng = np.random.default_rng(spec.seed)
+    qb_real, dt_real = load_inventory(qb_template), load_inventory(dt_template)
+    shapes = pd.concat([qb_real["SKU"], dt_real["SKU"]]).dropna().astype(str).unique()
+
+    n_qb_only = int(spec.n_skus * spec.qb_only_rate)
+    catalog = _unique_skus(shapes, spec.n_skus + n_qb_only, rng)
+    dt_skus, qb_only = catalog[:spec.n_skus], catalog[spec.n_skus:]
+
+    shared = list(rng.choice(dt_skus, int(spec.n_skus * spec.overlap_rate), replace=False))
+    drifted = rng.random(len(shared)) < spec.drift_rate
+    shared = [
+        (typo(sku, rng) if rng.random() < 0.5 else variant(sku, rng)) if drift else sku
+        for sku, drift in zip(shared, drifted)
+    ]
+
+    dt = _rows(dt_real, _with_noise(dt_skus, spec, rng), DT_QTY_COL, rng)
+    qb = _rows(qb_real, _with_noise(shared + qb_only, spec, rng), QB_QTY_COL, rng)
+    return qb, dt
+
+
+def write(spec, directory, qb_format=None):
+    """Write a generated pair as the exports the tool reads. Returns (qb_path, dt_path).
+
+    QuickBooks is an .xlsx like the real export, or `;` CSV past 100k rows
+    (writing a million-row workbook takes longer than everything measured).
+    """
+    qb, dt = generate(spec)
+    os.makedirs(directory, exist_ok=True)
+    qb_format = qb_format or ("xlsx" if len(qb) <= 100_000 else "csv")
+    qb_path = os.path.join(directory, f"qb_{spec.n_skus}.{qb_format}")
+    dt_path = os.path.join(directory, f"dt_{spec.n_skus}.csv")
+    if qb_format == "xlsx":
+        qb.to_excel(qb_path, index=False)
+    else:
+        qb.to_csv(qb_path, index=False, sep=";")
+    dt.to_csv(dt_path, index=False, sep=";")
+    return qb_path, dt_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic QuickBooks / D-Tools pair.")
+    parser.add_argument("n_skus", type=int, help="D-Tools catalog size")
+    parser.add_argument("-o", "--output-dir", default=".", help="directory for the two files (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--qb-format", choices=("xlsx", "csv"), help="default: xlsx up to 100k rows, csv past that")
+    args = parser.parse_args(argv)
+    for path in write(SyntheticSpec(n_skus=args.n_skus, seed=args.seed), args.output_dir, args.qb_format):
+        print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
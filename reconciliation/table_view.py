@@ -0,0 +1,72 @@
+"""Server-side paging of the big tables shown in the app.
+
+`st.dataframe(df)` serializes the whole frame to Arrow and sends it to the
+browser on every rerun, every click included. A `TableView` filters, sorts
+and slices on the server instead, so only one page of the chosen columns is
+serialized. The row order of the current filter and sort is kept between
+reruns: turning a page is a slice, whatever the size of the frame.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from reconciliation.dtypes import TEXT_DTYPE
+
+PAGE_SIZES = (25, 50, 100, 500)
+
+
+@dataclass(frozen=True)
+class Query:
+    """Which rows, in which order: a case-insensitive text filter and a sort column."""
+
+    text: str = ""
+    sort_by: str = None
+    ascending: bool = True
+
+
+def _as_text(values):
+    return values if values.dtype == TEXT_DTYPE else values.astype(TEXT_DTYPE)
+
+
+def row_order(df, query):
+    """Positions of the rows of `df` matching `query.text` in any column, sorted by `query.sort_by`."""
+    order = np.arange(len(df))
+    if query.text:
+        found = np.zeros(len(df), dtype=bool)
+        for col in df.columns:
+            found |= _as_text(df[col]).str.contains(query.text, case=False, regex=False, na=False).to_numpy(dtype=bool)
+        order = order[found]
+    if query.sort_by in df.columns:
+        values = df[query.sort_by].iloc[order].reset_index(drop=True)
+        try:
+            ranked = values.sort_values(ascending=query.ascending, kind="stable", na_position="last")
+        except TypeError:  # Mixed numbers and text
+            ranked = _as_text(values).sort_values(ascending=query.ascending, kind="stable", na_position="last")
+        order = order[ranked.index.to_numpy()]
+    return order
+
+
+class TableView:
+    """The row order of one displayed table, recomputed only when the frame or the query changes."""
+
+    def __init__(self):
+        self._df = None
+        self._query = None
+        self._order = None
+
+    def rows(self, df, query):
+        """Positions of the rows shown, in order."""
+        if df is not self._df or query != self._query:
+            self._df, self._query, self._order = df, query, row_order(df, query)
+        return self._order
+
+    def page(self, df, query, number, page_size, columns=None):
+        """Page `number` (from 1) of the rows shown, only `columns` (default: all)."""
+        rows = self.rows(df, query)
+        start = (number - 1) * page_size
+        page = df.iloc[rows[start:start + page_size]]
+        return page if columns is None else page[list(columns)]
+
+
+def page_count(rows, page_size):
+    return max(1, -(-rows // page_size))
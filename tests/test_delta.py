@@ -0,0 +1,66 @@
+"""Delta mode gives the full run's output on the same files."""
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from reconciliation import delta, engine, ingest
+from reconciliation.journal import DecisionJournal
+from reconciliation.similarity_cache import SimilarityCache
+
+ROOT = Path(__file__).resolve().parent.parent
+QB_QTY = engine.QB_QTY_COL
+
+
+@pytest.fixture(autouse=True)
+def parsed_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "PARSED_CACHE_DIR", str(tmp_path / "parsed"))
+
+
+@pytest.fixture(scope="module")
+def cache(tmp_path_factory):
+    return SimilarityCache(tmp_path_factory.mktemp("similarity"))
+
+
+@pytest.fixture(scope="module")
+def qb():
+    df = pd.read_excel(ROOT / "qb_inventory.xlsx", dtype=str)
+    # A second duplicate group, of three rows with different quantities
+    extra = df[df["SKU"] == df["SKU"].iloc[20]]
+    return pd.concat([df, extra.assign(**{QB_QTY: "3"}), extra.assign(**{QB_QTY: "5"})], ignore_index=True)
+
+
+def _drop_rows(df, sku, n):
+    return df.drop(df.index[df["SKU"] == sku][:n])
+
+
+def _changed_quantity(df, sku):
+    df = df.copy()
+    df.loc[df.index[df["SKU"] == sku][0], QB_QTY] = "11"
+    return df
+
+
+WEEK_2 = {
+    "162 down to one row": lambda df: _drop_rows(df, "162", 1),
+    "three rows down to two": lambda df: _drop_rows(df, df["SKU"].iloc[20], 1),
+    "three rows down to one": lambda df: _drop_rows(df, df["SKU"].iloc[20], 2),
+    "quantity changed in a group": lambda df: _changed_quantity(df, df["SKU"].iloc[20]),
+    "unchanged": lambda df: df,
+}
+
+
+@pytest.mark.parametrize("duplicates", ["delete", "merge"])
+@pytest.mark.parametrize("change", WEEK_2)
+def test_delta_equals_full_run(tmp_path, qb, cache, change, duplicates):
+    policy = engine.DecisionPolicy(duplicates=duplicates, fuzzy_duplicates="merge", cross_matches="merge")
+    dt = ROOT / "dtools_inventory.csv"
+    qb1, qb2 = tmp_path / "qb1.csv", tmp_path / "qb2.csv"
+    qb.to_csv(qb1, sep=";", index=False)
+    WEEK_2[change](qb).to_csv(qb2, sep=";", index=False)
+
+    previous = DecisionJournal()
+    engine.reconcile(qb1, dt, policy, threshold=0.9, cache=cache, journal=previous)
+    full = engine.reconcile(qb2, dt, policy, threshold=0.9, cache=cache)
+    incremental, _ = delta.reconcile_delta(qb2, dt, previous, policy, threshold=0.9)
+
+    pd.testing.assert_frame_equal(incremental.reset_index(drop=True), full.reset_index(drop=True))
@@ -0,0 +1,114 @@
+"""Step 3 on the sample exports: `engine.build_final_output` against the merge chain it replaced."""
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from reconciliation import engine, ingest
+
+ROOT = Path(__file__).resolve().parent.parent
+QB_FILE = ROOT / "qb_inventory.xlsx"
+DT_FILE = ROOT / "dtools_inventory.csv"
+
+
+@pytest.fixture(autouse=True)
+def parsed_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "PARSED_CACHE_DIR", str(tmp_path))
+
+
+@pytest.fixture
+def inventories():
+    df_qb = engine.working_frame(engine.load_inventory(QB_FILE, engine.QB_COLUMNS))
+    df_dt = engine.working_frame(engine.load_inventory(DT_FILE, engine.DT_COLUMNS))
+    return df_qb, df_dt, engine.load_inventory(DT_FILE)
+
+
+def _merge_chain(df_qb, df_dt, df_dt_full):
+    """Step 3 before `quantity_map`: the QuickBooks quantities left-joined on SKU.
+
+    The exact and fuzzy joins that followed never applied (no quantity column
+    under the D-Tools name), so this join alone gave the output.
+    """
+    df_output = engine.restore_columns(df_dt, df_dt_full).copy()
+    df_qb = df_qb.rename(columns={engine.QB_QTY_COL: engine.DT_QTY_COL})
+    df_output = df_output.merge(df_qb[["SKU", engine.DT_QTY_COL]], on="SKU", how="left", suffixes=("", "_QB"))
+    df_output[engine.DT_QTY_COL] = df_output[f"{engine.DT_QTY_COL}_QB"].combine_first(df_output[engine.DT_QTY_COL])
+    df_output = df_output.drop(columns=[f"{engine.DT_QTY_COL}_QB"])
+    return df_output.loc[:, ~df_output.columns.str.contains("^Unnamed")]
+
+
+def _quantities(df):
+    return pd.to_numeric(df[engine.DT_QTY_COL], errors="coerce").astype(float).reset_index(drop=True)
+
+
+def test_one_row_per_dtools_row(inventories):
+    df_qb, df_dt, df_dt_full = inventories
+    final_output = engine.build_final_output(df_qb, df_dt, [], df_dt_full)
+
+    assert len(final_output) == len(df_dt_full)
+    assert final_output["SKU"].tolist() == df_dt_full["SKU"].tolist()
+
+
+def test_quantities_match_merge_chain(inventories):
+    df_qb, df_dt, df_dt_full = inventories
+    final_output = engine.build_final_output(df_qb, df_dt, [], df_dt_full)
+    baseline = _merge_chain(df_qb, df_dt, df_dt_full)
+
+    shared = df_qb.loc[df_qb["SKU"].duplicated(), "SKU"].unique()
+    assert len(shared) == 1  # SKU 162, on two QuickBooks rows
+    kept = ~final_output["SKU"].isin(shared)
+    baseline_kept = ~baseline["SKU"].isin(shared)
+    assert final_output.columns.tolist() == baseline.columns.tolist()
+    pd.testing.assert_series_equal(_quantities(final_output[kept]), _quantities(baseline[baseline_kept]))
+    pd.testing.assert_frame_equal(
+        final_output[kept].drop(columns=engine.DT_QTY_COL).reset_index(drop=True).astype(object),
+        baseline[baseline_kept].drop(columns=engine.DT_QTY_COL).reset_index(drop=True).astype(object),
+    )
+
+
+def test_shared_quickbooks_sku_resolved_as_merge_chain(inventories):
+    df_qb, df_dt, df_dt_full = inventories
+    final_output = engine.build_final_output(df_qb, df_dt, [], df_dt_full)
+    baseline = _merge_chain(df_qb, df_dt, df_dt_full)
+
+    for sku in df_qb.loc[df_qb["SKU"].duplicated(), "SKU"].unique():
+        row = final_output[final_output["SKU"] == sku]
+        baseline_rows = baseline[baseline["SKU"] == sku]
+        # The chain repeated the D-Tools row once per QuickBooks row, all with the same quantity
+        assert len(baseline_rows) == (df_qb["SKU"] == sku).sum()
+        assert _quantities(baseline_rows).nunique() == 1
+        assert len(row) == 1
+        assert _quantities(row).iloc[0] == _quantities(baseline_rows).iloc[0]
+        assert _quantities(row).iloc[0] == pd.to_numeric(df_qb.loc[df_qb["SKU"] == sku, engine.QB_QTY_COL]).sum()
+
+
+def test_pairs_fill_quantities_after_direct_sku_hits(inventories):
+    df_qb, df_dt, df_dt_full = inventories
+    qb_quantity = pd.to_numeric(df_qb.drop_duplicates("SKU").set_index("SKU")[engine.QB_QTY_COL]).astype(float).dropna()
+    _, mismatched_qb, mismatched_dt = engine.split_matches(df_qb, df_dt)
+    candidates = [
+        pair for pair in engine.cross_matches(mismatched_qb, mismatched_dt, 0.90) if pair["QuickBooks SKU"] in qb_quantity
+    ]
+    first = candidates[0]
+    second = next(
+        pair for pair in candidates
+        if pair["QuickBooks SKU"] != first["QuickBooks SKU"] and pair["D-Tools SKU"] != first["D-Tools SKU"]
+        and qb_quantity[pair["QuickBooks SKU"]] != qb_quantity[first["QuickBooks SKU"]]
+    )
+    exact_sku = next(sku for sku in df_dt["SKU"] if sku in qb_quantity)
+    other_qb_sku = next(sku for sku in qb_quantity.index if qb_quantity[sku] != qb_quantity[exact_sku])
+    fuzzy_selected = [
+        # A direct SKU hit wins over a pair on the same D-Tools SKU
+        {"QuickBooks SKU": other_qb_sku, "D-Tools SKU": exact_sku},
+        first,
+        # Each D-Tools SKU takes the first pair naming it
+        {"QuickBooks SKU": second["QuickBooks SKU"], "D-Tools SKU": first["D-Tools SKU"]},
+        second,
+    ]
+    final_output = engine.build_final_output(df_qb, df_dt, fuzzy_selected, df_dt_full)
+    quantity = dict(zip(final_output["SKU"], pd.to_numeric(final_output[engine.DT_QTY_COL], errors="coerce")))
+
+    assert len(final_output) == len(df_dt_full)
+    assert quantity[exact_sku] == qb_quantity[exact_sku]
+    for pair in (first, second):
+        assert quantity[pair["D-Tools SKU"]] == qb_quantity[pair["QuickBooks SKU"]]
@@ -0,0 +1,58 @@
+"""`ingest.read_inventory` gives what pandas reads from the sample exports, parsed or cached."""
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from reconciliation import ingest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SAMPLES = {
+    "qb_inventory.xlsx": lambda path: pd.read_excel(path, dtype=str),
+    "dtools_inventory.csv": lambda path: pd.read_csv(path, sep=";", dtype=str),
+}
+
+
+@pytest.fixture(autouse=True)
+def parsed_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "PARSED_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _assert_read_as_pandas(df, expected):
+    pd.testing.assert_frame_equal(df.astype(object), expected.astype(object))
+
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_read_inventory_matches_pandas(name, parsed_cache):
+    path = ROOT / name
+    expected = SAMPLES[name](path)
+
+    _assert_read_as_pandas(ingest.read_inventory(path), expected)  # cold
+    assert list(parsed_cache.glob("*.parquet"))
+    _assert_read_as_pandas(ingest.read_inventory(path), expected)  # from the Parquet cache
+
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_read_inventory_columns_match_pandas(name):
+    path = ROOT / name
+    expected = SAMPLES[name](path)
+    columns = ["SKU", expected.columns[-1], "Not a column"]
+
+    for _ in range(2):  # cold, then cached (XLSX) or parsed again (CSV)
+        _assert_read_as_pandas(ingest.read_inventory(path, columns), expected[columns[:2]])
+    _assert_read_as_pandas(ingest.read_inventory(path), expected)
+    _assert_read_as_pandas(ingest.read_inventory(path, columns), expected[columns[:2]])
+
+
+def test_excel_line_endings_match_openpyxl():
+    df = ingest.read_inventory(ROOT / "qb_inventory.xlsx")
+    text = df.select_dtypes(exclude="number")
+    assert not text.apply(lambda col: col.str.contains("\r", regex=False).any()).any()
+
+
+def test_na_values_are_pandas_defaults(tmp_path):
+    path = tmp_path / "na.csv"
+    path.write_text("SKU;Quantity on Hand\n" + "".join(f"{token};1\n" for token in ingest.NA_VALUES) + "x;\n")
+    _assert_read_as_pandas(ingest.read_inventory(path), pd.read_csv(path, sep=";", dtype=str))
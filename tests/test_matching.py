@@ -0,0 +1,73 @@
+"""`matching`: the indexed self-join gives the all-pairs scan's result."""
+import itertools
+import random
+
+import pytest
+from rapidfuzz import fuzz
+
+from reconciliation import parallel
+from reconciliation.matching import SelfJoin, fast_fuzzy_match, fuzzy_match_scores
+
+THRESHOLDS = [0.0, 0.5, 0.8, 0.9, 0.95, 0.99, 1.0]
+
+
+def _all_pairs(skus, threshold):
+    return [(sku1, sku2) for sku1, sku2 in itertools.combinations(skus, 2) if fuzz.ratio(sku1, sku2) / 100 > threshold]
+
+
+def _random_skus(rng, n):
+    base = ["".join(rng.choices("AB12-", k=rng.randint(0, 8))) for _ in range(max(1, n // 3))]
+    skus = []
+    for _ in range(n):
+        sku = list(rng.choice(base))
+        for _ in range(rng.randint(0, 2)):  # a typo, an insert or a delete
+            edit = rng.randrange(3)
+            position = rng.randint(0, len(sku))
+            if edit == 0 and position < len(sku):
+                sku[position] = rng.choice("AB12-")
+            elif edit == 1:
+                sku.insert(position, rng.choice("AB12-"))
+            elif sku:
+                sku.pop(min(position, len(sku) - 1))
+        skus.append("".join(sku))
+    return skus
+
+
+@pytest.mark.parametrize("threshold", THRESHOLDS)
+@pytest.mark.parametrize("seed", range(40))
+def test_fast_fuzzy_match_equals_all_pairs(seed, threshold):
+    skus = _random_skus(random.Random(seed), 60)
+    assert fast_fuzzy_match(skus, threshold) == _all_pairs(skus, threshold)
+
+
+@pytest.mark.parametrize("threshold", THRESHOLDS)
+@pytest.mark.parametrize(
+    "skus",
+    [
+        [],
+        ["A"],
+        ["", ""],
+        ["", "A", "B", ""],
+        ["A", "B", "A", "AB", "BA"],
+        ["1", "12", "123", "1234", "12345"],
+        ["ABC-100", "ABC100", "ABC-0100", "abc-100", "ABC-100"],
+    ],
+)
+def test_fast_fuzzy_match_edge_cases(skus, threshold):
+    assert fast_fuzzy_match(skus, threshold) == _all_pairs(skus, threshold)
+
+
+@pytest.mark.parametrize("threshold", [0.8, 0.95])
+def test_probe_ranges_equal_one_pass(threshold):
+    skus = _random_skus(random.Random(7), 300)
+    join = SelfJoin(skus, threshold)
+    pairs = {}
+    for start in reversed(range(0, len(skus), 7)):  # Any ranges, in any order
+        pairs.update(join.probe(start, min(start + 7, len(skus)))[0])
+    assert pairs == join.probe(0, len(skus))[0]
+    assert [(skus[i], skus[j]) for i, j in sorted(pairs)] == _all_pairs(skus, threshold)
+
+
+def test_job_equals_no_job():
+    skus = _random_skus(random.Random(8), 300)
+    assert fuzzy_match_scores(skus, 0.8, job=parallel.Job(workers=1)) == fuzzy_match_scores(skus, 0.8)
@@ -0,0 +1,56 @@
+"""`Profiler.track_memory`: one process-wide tracemalloc, shared by the profilers asking for it."""
+import gc
+import tracemalloc
+
+import pytest
+
+from reconciliation import profiling
+
+
+@pytest.fixture(autouse=True)
+def no_tracing():
+    assert not tracemalloc.is_tracing()
+    yield
+    assert not tracemalloc.is_tracing()
+
+
+def _peaks(profiler, name):
+    with profiler.span(name):
+        data = bytearray(4 * 2**20)
+        del data
+    return [span.get("peak_mib") for span in profiler.spans if span["name"] == name]
+
+
+def test_only_the_owner_records_peaks():
+    first, second, off = profiling.Profiler(), profiling.Profiler(), profiling.Profiler()
+    assert first.track_memory(True)
+    assert not second.track_memory(True)
+
+    assert _peaks(first, "stage")[0] >= 4
+    assert _peaks(second, "stage") == [None]
+    assert _peaks(off, "stage") == [None]
+
+    first.track_memory(False)
+    assert tracemalloc.is_tracing()  # Still asked for by the second
+    assert second.records_memory
+    assert _peaks(second, "later")[0] >= 4
+    second.track_memory(False)
+    assert not tracemalloc.is_tracing()
+
+
+def test_dropped_profiler_stops_tracing():
+    profiler = profiling.Profiler()
+    profiler.track_memory(True)
+    assert tracemalloc.is_tracing()
+    del profiler
+    gc.collect()
+    assert not tracemalloc.is_tracing()
+
+
+def test_track_memory_is_idempotent():
+    profiler = profiling.Profiler()
+    assert profiler.track_memory(True)
+    assert profiler.track_memory(True)
+    profiler.track_memory(False)
+    profiler.track_memory(False)
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,94 @@
+"""`PendingDecisions.apply` gives the frame the `engine` decisions give one after another."""
+import random
+
+import pandas as pd
+import pytest
+
+from reconciliation import engine
+from reconciliation.dtypes import compact
+from reconciliation.review import PendingDecisions
+
+QTY = engine.QB_QTY_COL
+
+QUANTITIES = {
+    "numbers": lambda rng: rng.choice(["0", "1", "2", "7", "12", "3.5", None]),
+    "text": lambda rng: rng.choice(["0", "1", "12", "2.5", "abc", "", None]),
+}
+
+
+def _frame(rng, kind, n=40):
+    norms = [f"N{rng.randrange(12)}" for _ in range(n)]
+    df = pd.DataFrame({
+        "SKU": [f"{norm.lower()}-{rng.randrange(3)}" for norm in norms],
+        "Description": [f"row {i}" for i in range(n)],
+        QTY: [QUANTITIES[kind](rng) for _ in range(n)],
+        "SKU_NORM": norms,
+    })
+    return compact(df, [QTY])
+
+
+def _decisions(rng, df, n):
+    norms = sorted(set(df["SKU_NORM"])) + ["MISSING"]
+    skus = sorted(set(df["SKU"])) + ["NEW-SKU"]
+    decisions = []
+    for _ in range(n):
+        action = rng.choice(["merge", "delete", "merge_cluster"])
+        if action == "merge":
+            decisions.append(("merge", rng.choice(norms), rng.choice(skus)))
+        elif action == "delete":
+            decisions.append(("delete", rng.choice(norms)))
+        else:
+            cluster = rng.sample(norms, rng.randint(1, 4))
+            decisions.append(("merge_cluster", cluster, rng.choice(skus + [None])))
+    return decisions
+
+
+def _apply_one_by_one(df, decisions, qty_col):
+    for action, *args in decisions:
+        if action == "merge":
+            df = engine.merge_duplicate(df, args[0], args[1], qty_col)
+        elif action == "delete":
+            df = engine.delete_duplicate(df, args[0])
+        else:
+            df = engine.merge_fuzzy_cluster(df, args[0], args[1], qty_col)
+    return df
+
+
+def _record(pending, decisions):
+    for action, *args in decisions:
+        if action == "merge":
+            pending.merge_duplicate(*args)
+        elif action == "delete":
+            pending.delete_duplicate(*args)
+        else:
+            pending.merge_fuzzy_cluster(*args)
+
+
+@pytest.mark.parametrize("kind", QUANTITIES)
+@pytest.mark.parametrize("seed", range(60))
+def test_apply_equals_decisions_one_by_one(seed, kind):
+    rng = random.Random(seed)
+    df = _frame(rng, kind)
+    decisions = _decisions(rng, df, rng.randint(1, 15))
+
+    pending = PendingDecisions(df, QTY)
+    half = len(decisions) // 2
+    _record(pending, decisions[:half])
+    # Reading between decisions folds part of the log first
+    partial = _apply_one_by_one(df, decisions[:half], QTY)
+    for sku_norm in sorted(set(df["SKU_NORM"])):
+        pd.testing.assert_frame_equal(pending.rows(sku_norm), partial[partial["SKU_NORM"] == sku_norm])
+    _record(pending, decisions[half:])
+
+    pd.testing.assert_frame_equal(pending.apply(), _apply_one_by_one(df, decisions, QTY))
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_apply_without_quantity_column(seed):
+    rng = random.Random(seed)
+    df = _frame(rng, "numbers").drop(columns=QTY)
+    decisions = _decisions(rng, df, 10)
+    pending = PendingDecisions(df, QTY)
+    _record(pending, decisions)
+
+    pd.testing.assert_frame_equal(pending.apply(), _apply_one_by_one(df, decisions, QTY))
@@ -0,0 +1,36 @@
+"""`InventoryStore.count` and `.page` show the rows `table_view` shows for the same query."""
+from pathlib import Path
+
+import pytest
+
+from reconciliation import engine, ingest
+from reconciliation.store import InventoryStore
+from reconciliation.table_view import Query, TableView
+
+ROOT = Path(__file__).resolve().parent.parent
+DT = ROOT / "dtools_inventory.csv"
+
+
+@pytest.fixture(autouse=True)
+def parsed_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "PARSED_CACHE_DIR", str(tmp_path / "parsed"))
+
+
+@pytest.fixture
+def store(tmp_path):
+    with InventoryStore(str(tmp_path / "store.sqlite")) as store:
+        store.load("dt", DT)
+        yield store
+
+
+@pytest.mark.parametrize("query", [Query(), Query("leviton"), Query("Cat6"), Query("50%"), Query("no such text")])
+def test_page_equals_table_view(store, query):
+    df = engine.load_inventory(DT)
+    rows = TableView().rows(df, query)
+
+    assert store.count("dt", query) == len(rows)
+    for number in (1, 2):
+        page = store.page("dt", query, number, 25, columns=["SKU", "Brand"])
+        expected = df.iloc[rows[(number - 1) * 25:number * 25]]
+        assert page.index.tolist() == expected.index.tolist()
+        assert page["SKU"].tolist() == expected["SKU"].tolist()
@@ -0,0 +1,35 @@
+"""Streaming `cross_fuzzy_match(top_k=...)` keeps what `top_k_pairs` keeps on the full hit list."""
+import random
+
+import pytest
+
+from reconciliation.matching import cross_fuzzy_match, top_k_pairs
+
+
+def _skus(rng, n, alphabet="AB12"):
+    return ["".join(rng.choices(alphabet, k=rng.randint(3, 6))) for _ in range(n)]
+
+
+@pytest.mark.parametrize("top_k", [1, 2, 3])
+# 1, 2 and 8 rows per block, then one block
+@pytest.mark.parametrize("chunk_cells", [1, 60, 250, 10**6])
+@pytest.mark.parametrize("seed", range(15))
+def test_streaming_top_k_equals_top_k_of_all_hits(seed, chunk_cells, top_k):
+    rng = random.Random(seed)
+    # A small alphabet: many SKUs at the same distance, so ties everywhere
+    left, right = _skus(rng, 40), _skus(rng, 30)
+    hits = cross_fuzzy_match(left, right, 0.6, workers=1)
+    expected = top_k_pairs(hits, top_k)
+
+    assert cross_fuzzy_match(left, right, 0.6, workers=1, chunk_cells=chunk_cells, top_k=top_k) == expected
+
+
+@pytest.mark.parametrize("chunk_cells", [1, 6, 10**6])
+def test_ties_across_blocks(chunk_cells):
+    # Every right SKU scores the same against every left one: the lower positions win the ties
+    left = ["AAAB", "AAAC", "AAAD", "AAAE"]
+    right = ["AAAF", "AAAG", "AAAH"]
+    hits = cross_fuzzy_match(left, right, 0.5, workers=1)
+    assert len({score for *_, score in hits}) == 1
+    for top_k in (1, 2):
+        assert cross_fuzzy_match(left, right, 0.5, workers=1, chunk_cells=chunk_cells, top_k=top_k) == top_k_pairs(hits, top_k)
@@ -0,0 +1,71 @@
+"""Structural variants: grouped by brand and signature, without scoring, and auto-merged within one brand."""
+from collections import Counter
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from reconciliation import engine, ingest, rules
+
+ROOT = Path(__file__).resolve().parent.parent
+MERGE_VARIANTS = rules.AutoRules(merge_variants=True)
+
+
+@pytest.fixture(autouse=True)
+def parsed_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "PARSED_CACHE_DIR", str(tmp_path / "parsed"))
+
+
+def _variants(rows):
+    df = engine.working_frame(pd.DataFrame(rows, columns=["Brand", "SKU"]))
+    position = {sku: i for i, sku in enumerate(df["SKU_NORM"].unique())}
+    return engine.structural_variants(df, position)
+
+
+def test_same_brand_variants_are_grouped():
+    pairs, grouped = _variants([("ABC", "ABC-100"), ("ABC", "ABC100"), ("ABC", "abc-0100")])
+    assert pairs == [("ABC-100", "ABC100", 1.0), ("ABC-100", "ABC-0100", 1.0)]
+    assert grouped == {"ABC100", "ABC-0100"}
+
+
+def test_stripped_brand_prefix_links_brands():
+    pairs, _ = _variants([("Leviton", "6246010L"), ("CDN", "CDN-6246010L")])
+    assert pairs == [("6246010L", "CDN-6246010L", 1.0)]
+
+
+def test_same_signature_of_two_brands_is_scored():
+    # CDN patch cord, 1 ft, and a Leviton patch cord, 10 ft: one signature, two parts
+    df, _ = engine.prepare_source(ROOT / "dtools_inventory.csv", engine.DT_COLUMNS)
+    assert set(df.loc[df["SKU_NORM"].isin(["6246010L", "62460-10L"]), "Brand"]) == {"CDN", "Leviton"}
+    position = {sku: i for i, sku in enumerate(df["SKU_NORM"].unique())}
+
+    pairs, grouped = engine.structural_variants(df, position)
+
+    assert not [pair for pair in pairs if {"6246010L", "62460-10L"} & set(pair[:2])]
+    assert not {"6246010L", "62460-10L"} & grouped
+
+
+@pytest.mark.parametrize("rows, merged", [
+    ([("QSC", "SL-QSE-8N-P", "1"), ("QSC", "SLQSE-8N-P", "0")], True),
+    ([("CDN", "6246010L", "4"), ("Leviton", "62460-10L", "2")], False),
+    ([("QSC", "SL-QSE-8N-P", "1"), (None, "SLQSE-8N-P", "0")], False),
+])
+def test_auto_merge_needs_one_brand(rows, merged):
+    df = engine.working_frame(pd.DataFrame(rows, columns=["Brand", "SKU", engine.DT_QTY_COL]))
+    cluster = df["SKU_NORM"].tolist()
+    resolved = Counter()
+
+    df, _, remaining = rules.resolve_cleanup(df, "dt", engine.DT_QTY_COL, [], [cluster], MERGE_VARIANTS, resolved)
+
+    assert resolved["merge_variants"] == merged
+    assert remaining == ([] if merged else [cluster])
+    assert len(df) == (1 if merged else 2)
+
+
+def test_auto_merge_needs_a_brand_column():
+    df = engine.working_frame(pd.DataFrame({"SKU": ["ABC-100", "ABC100"], engine.QB_QTY_COL: ["1", "2"]}))
+    cluster = df["SKU_NORM"].tolist()
+
+    _, _, remaining = rules.resolve_cleanup(df, "qb", engine.QB_QTY_COL, [], [cluster], MERGE_VARIANTS, Counter())
+
+    assert remaining == [cluster]